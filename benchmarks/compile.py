@@ -0,0 +1,286 @@
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project")
+)
+
+import CCache
+import kompilator
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+
+# identifiers are lowercase letters only
+def name(i):
+    s = ""
+    while True:
+        s = chr(ord("a") + i % 26) + s
+        i //= 26
+        if i == 0:
+            return s
+
+
+def program(decls, body):
+    return "PROGRAM IS\nVAR " + ", ".join(decls) + "\nBEGIN\n" + body + "END\n"
+
+
+# straight-line assignments and writes
+def gen_statements(n):
+    forms = (
+        "  c := a + b;\n",
+        "  a := c - 1;\n",
+        "  b := a * 3;\n",
+        "  WRITE c;\n",
+        "  b := c / 2;\n",
+        "  a := b % 7;\n",
+    )
+    body = "  READ a;\n  READ b;\n  c := a;\n"
+    body += "".join(forms[i % len(forms)] for i in range(n))
+    return program(["a", "b", "c"], body)
+
+
+# IF, IF-ELSE, WHILE and REPEAT nested n deep
+def gen_depth(n):
+    body = ["  READ a;", "  b := 0;", "  c := 1;"]
+    closers = []
+    for i in range(n):
+        kind = i % 4
+        if kind == 0:
+            body += [f"  IF a > {i % 7} THEN", "  b := b + 1;"]
+            closers.append(["  ENDIF"])
+        elif kind == 1:
+            body += [f"  IF a != {i % 5} THEN", "  c := c + b;"]
+            closers.append(["  ELSE", "  b := b + 2;", "  ENDIF"])
+        elif kind == 2:
+            body += [f"  WHILE c < {3 + i % 3} DO", "  c := c + 1;"]
+            closers.append(["  ENDWHILE"])
+        else:
+            body += ["  REPEAT", "  b := b + a;"]
+            closers.append([f"  UNTIL b > {i};"])
+    for lines in reversed(closers):
+        body += lines
+    body += ["  WRITE b;", "  WRITE c;", ""]
+    return program(["a", "b", "c"], "\n".join(body))
+
+
+# a chain of procedures, each calls the one before it
+def gen_procedures(n):
+    text = ""
+    for i in range(n):
+        p = "p" + name(i)
+        text += f"PROCEDURE {p}(x, y) IS\nVAR t\nBEGIN\n"
+        text += "  t := x + 1;\n  y := t * 2;\n"
+        if i > 0:
+            text += f"  p{name(i - 1)}(t, y);\n"
+        text += "  IF y > 100 THEN\n    y := y / 3;\n  ENDIF\nEND\n"
+    body = "  READ a;\n  b := 0;\n"
+    body += f"  p{name(n - 1)}(a, b);\n" if n > 0 else ""
+    body += "  WRITE b;\n"
+    return text + program(["a", "b"], body)
+
+
+# every statement uses a constant of its own
+def gen_constants(n):
+    body = "  READ a;\n  b := 0;\n"
+    for i in range(n):
+        body += f"  b := a + {1000003 + 7919 * i};\n"
+    body += "  WRITE b;\n"
+    return program(["a", "b"], body)
+
+
+# sequential IF-ELSE statements, two labels each
+def gen_labels(n):
+    body = "  READ a;\n  b := 0;\n"
+    for i in range(n):
+        body += f"  IF a > {i % 10} THEN\n    b := b + 1;\n"
+        body += "  ELSE\n    b := b + 2;\n  ENDIF\n"
+    body += "  WRITE b;\n"
+    return program(["a", "b"], body)
+
+
+AXES = {
+    "statements": (gen_statements, (1000, 2000, 4000, 8000)),
+    "depth": (gen_depth, (250, 500, 1000, 2000)),
+    "procedures": (gen_procedures, (25, 50, 100, 200)),
+    "constants": (gen_constants, (500, 1000, 2000, 4000)),
+    "labels": (gen_labels, (500, 1000, 2000, 4000)),
+}
+
+
+# the kompilator.py pipeline without the cache: read, compile, write
+def compile_once(inPath, outPath):
+    (err, _) = kompilator.compile_file(inPath, outPath)
+    if err is not None:
+        raise Exception(f"{inPath}: {err}")
+
+
+# best wall time of repeat runs, then one run under tracemalloc for the peak
+def measure(inPath, outPath, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compile_once(inPath, outPath)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    tracemalloc.start()
+    try:
+        compile_once(inPath, outPath)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    with open(outPath) as f:
+        instructions = sum(1 for _ in f)
+    return {"time": best, "peak": peak, "instructions": instructions}
+
+
+# slope of log(time) against log(size): 1 is linear, 2 quadratic
+def slope(points, key):
+    xs = [math.log(p["size"]) for p in points]
+    ys = [math.log(p[key]) for p in points]
+    mx = sum(xs) / len(xs)
+    my = sum(ys) / len(ys)
+    var = sum((x - mx) ** 2 for x in xs)
+    if var == 0:
+        return 0.0
+    return sum((x - mx) * (y - my) for x, y in zip(xs, ys)) / var
+
+
+def run(axes, scale, repeat, tmp):
+    results = {}
+    for axis in axes:
+        (gen, sizes) = AXES[axis]
+        points = []
+        for size in sizes:
+            size = max(1, int(size * scale))
+            inPath = os.path.join(tmp, f"{axis}-{size}.imp")
+            outPath = os.path.join(tmp, f"{axis}-{size}.mr")
+            with open(inPath, "w") as f:
+                f.write(gen(size))
+            point = {"size": size}
+            point.update(measure(inPath, outPath, repeat))
+            points.append(point)
+            print(
+                f"{axis:12}{size:8}{1000 * point['time']:12.1f} ms"
+                f"{point['peak'] / 1024:12.0f} KiB{point['instructions']:9} instr",
+                flush=True,
+            )
+        results[axis] = {
+            "points": points,
+            "time_slope": slope(points, "time"),
+            "peak_slope": slope(points, "peak"),
+        }
+    return results
+
+
+# returns the number of regressions
+def compare(results, baseline, tolerance):
+    regressions = 0
+    print(f"\n{'':12}{'size':>8}{'time':>10}{'peak':>10}  (new / baseline)")
+    for axis, res in results.items():
+        old = baseline["results"].get(axis)
+        if old is None:
+            continue
+        old_points = {p["size"]: p for p in old["points"]}
+        for p in res["points"]:
+            q = old_points.get(p["size"])
+            if q is None:
+                continue
+            rt = p["time"] / q["time"]
+            rp = p["peak"] / q["peak"]
+            flag = ""
+            if rt > tolerance or rp > tolerance:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{axis:12}{p['size']:8}{rt:10.2f}{rp:10.2f}{flag}")
+        print(
+            f"{axis:12}{'slope':>8}{res['time_slope']:10.2f}"
+            f"{res['peak_slope']:10.2f}  (baseline {old['time_slope']:.2f}"
+            f" / {old['peak_slope']:.2f})"
+        )
+    return regressions
+
+
+def main():
+    argp = argparse.ArgumentParser(
+        description="compile time and peak memory on generated programs"
+    )
+    argp.add_argument(
+        "axes", nargs="*", help=f"some of {', '.join(AXES)} (default: all)"
+    )
+    argp.add_argument(
+        "--scale", type=float, default=1.0, help="multiplies every program size"
+    )
+    argp.add_argument("--repeat", type=int, default=3)
+    argp.add_argument("-o", "--output", help="write the results as JSON")
+    argp.add_argument(
+        "--baseline",
+        default=BASELINE,
+        help="results to compare against (default: %(default)s)",
+    )
+    argp.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store these results as the baseline",
+    )
+    argp.add_argument(
+        "--tolerance",
+        type=float,
+        default=1.25,
+        help="slowdown or memory growth reported as a regression",
+    )
+    args = argp.parse_args()
+    for axis in args.axes:
+        if axis not in AXES:
+            argp.error(f"unknown axis {axis}")
+    with tempfile.TemporaryDirectory() as tmp:
+        results = run(args.axes or list(AXES), args.scale, args.repeat, tmp)
+    print()
+    for axis, res in results.items():
+        print(
+            f"{axis:12} time slope {res['time_slope']:.2f}, "
+            f"peak slope {res['peak_slope']:.2f}"
+        )
+    data = {
+        "version": CCache.compiler_version(),
+        "python": platform.python_version(),
+        "scale": args.scale,
+        "results": results,
+    }
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(data, f, indent=1)
+            f.write("\n")
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(data, f, indent=1)
+            f.write("\n")
+        print(f"baseline saved to {args.baseline}")
+    elif not os.path.exists(args.baseline):
+        sys.stderr.write(
+            f"no baseline {args.baseline}, nothing to compare with;"
+            " store one with --save-baseline\n"
+        )
+        sys.exit(1)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("scale") != args.scale:
+            sys.stderr.write(
+                f"baseline was measured with --scale {baseline.get('scale')}\n"
+            )
+            sys.exit(1)
+        if compare(results, baseline, args.tolerance) > 0:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
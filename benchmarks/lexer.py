@@ -0,0 +1,91 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "project")
+)
+
+from CLexer import CLexer
+from CFastLexer import CFastLexer
+
+
+# a procedure and a main program repeated until the text has the given size
+def generate(size):
+    unit = """PROCEDURE pa(a,b) IS
+VAR t, k
+BEGIN
+  t := a * b; [ comment ]
+  k := 10;
+  WHILE k > 0 DO
+    IF t >= 1234 THEN
+      t := t / 2;
+    ELSE
+      t := t + a;
+    ENDIF
+    k := k - 1;
+  ENDWHILE
+  REPEAT
+    b := b % 7;
+  UNTIL b != 3;
+  WRITE t;
+END
+"""
+    main = """PROGRAM IS
+VAR x, y
+BEGIN
+  READ x;
+  READ y;
+  pa(x, y);
+  WRITE x;
+END
+"""
+    return unit * max(1, (size - len(main)) // len(unit)) + main
+
+
+def stream(lexer, text):
+    return [(t.type, t.value, t.lineno, t.index, t.end) for t in lexer.tokenize(text)]
+
+
+def measure(lexer, text, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = 0
+        for _ in lexer.tokenize(text):
+            count += 1
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return (count, best)
+
+
+def main():
+    argp = argparse.ArgumentParser(
+        description="tokens per second of CLexer and CFastLexer"
+    )
+    argp.add_argument("files", nargs="*", help=".imp sources (default: generated)")
+    argp.add_argument(
+        "--size", type=int, default=2, help="generated source size in MiB"
+    )
+    argp.add_argument("--repeat", type=int, default=3)
+    args = argp.parse_args()
+    if args.files:
+        text = "".join(open(path).read() for path in args.files)
+    else:
+        text = generate(args.size * 1024 * 1024)
+    if stream(CLexer(), text) != stream(CFastLexer(), text):
+        print("token streams differ")
+        sys.exit(1)
+    print(f"source: {len(text)} bytes")
+    rates = {}
+    for name, lexer in (("sly", CLexer()), ("fast", CFastLexer())):
+        count, elapsed = measure(lexer, text, args.repeat)
+        rates[name] = count / elapsed
+        print(f"{name:5} {count} tokens in {elapsed:.3f}s: {rates[name]:,.0f} tokens/s")
+    print(f"speedup: {rates['fast'] / rates['sly']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PROJECT = os.path.join(HERE, "..", "project")
+sys.path.insert(0, PROJECT)
+
+from CFastLexer import CFastLexer
+from CFastParser import CFastParser
+from CParser import CParser
+from CProcessor import CProcessor
+from ProcObj import ExpObject, ValueObject
+import compile
+
+
+# stops after parsing: the procedures and main as CParser.program_all
+# gets them
+class TreeOnly(CProcessor):
+    def compile_program(self, procedures, main):
+        return (procedures, main)
+
+
+def dump(node):
+    if type(node) is list:
+        return [dump(n) for n in node]
+    if type(node) is tuple:
+        return tuple(dump(n) for n in node)
+    if type(node) is ValueObject:
+        return ("value", node.vType.name, node.data)
+    if type(node) is ExpObject:
+        return ("exp", node.oType.name, dump(node.left), dump(node.right), node.dest)
+    return node
+
+
+# the tree, the symbol tables, the label and cell counters and the syntax
+# errors reported, or how the parse failed
+def tree(parser, text):
+    proc = TreeOnly()
+    parser.proc = proc
+    errors = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(errors):
+            result = parser.parse(CFastLexer().tokenize(text))
+    except Exception as e:
+        return ("error", type(e).__name__, str(e))
+    errors = errors.getvalue().replace("sly: ", "")
+    if result is None:
+        return ("failed", errors)
+    symbols = [
+        (
+            name,
+            p.proc_no,
+            p.getLabel(),
+            p.line,
+            [(v, var.address, var.mode.name) for v, var in p.symbols.items()],
+            [var.address for var in p.params],
+        )
+        for name, p in proc.symbols_proc.items()
+    ]
+    counters = (proc.createLabel(), proc.getNewAddress())
+    return (dump(result), symbols, counters, proc.getLog(), errors)
+
+
+def sources(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".imp"):
+                        full = os.path.join(root, name)
+                        with open(full) as f:
+                            yield (full, f.read())
+        else:
+            with open(path) as f:
+                yield (path, f.read())
+
+
+def generated():
+    for axis, (gen, sizes) in compile.AXES.items():
+        for size in (1, 2, 3, 10, sizes[0] // 10):
+            yield (f"{axis}-{size}", gen(size))
+
+
+# returns the number of programs parsed differently
+def conformance(programs):
+    same = 0
+    differ = 0
+    for name, text in programs:
+        if tree(CParser(), text) == tree(CFastParser(), text):
+            same += 1
+        else:
+            differ += 1
+            print(f"{name}: trees differ")
+    print(f"conformance: {same} same, {differ} differ")
+    return differ
+
+
+def measure(cls, tokens, repeat):
+    best = None
+    for _ in range(repeat):
+        parser = cls()
+        parser.proc = TreeOnly()
+        start = time.perf_counter()
+        parser.parse(iter(tokens))
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def import_time(module, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-c", f"import {module}"], cwd=PROJECT, check=True
+        )
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    argp = argparse.ArgumentParser(
+        description="compare the trees of CParser and CFastParser, then their speed"
+    )
+    argp.add_argument(
+        "paths", nargs="*", help=".imp files or directories (default: tests/)"
+    )
+    argp.add_argument("--size", type=int, default=4000, help="statements to time")
+    argp.add_argument("--repeat", type=int, default=3)
+    args = argp.parse_args()
+    paths = args.paths or [os.path.join(HERE, "..", "tests")]
+    programs = list(sources(paths)) + list(generated())
+    if conformance(programs) > 0:
+        sys.exit(1)
+    texts = (
+        compile.gen_statements(args.size),
+        compile.gen_depth(args.size // 8),
+        compile.gen_procedures(args.size // 10),
+    )
+    streams = [list(CFastLexer().tokenize(text)) for text in texts]
+    count = sum(map(len, streams))
+    print(f"\nsource: {count} tokens")
+    rates = {}
+    for name, cls in (("sly", CParser), ("fast", CFastParser)):
+        elapsed = sum(measure(cls, tokens, args.repeat) for tokens in streams)
+        rates[name] = count / elapsed
+        print(f"{name:5} {elapsed * 1000:8.1f} ms: {rates[name]:,.0f} tokens/s")
+    print(f"speedup: {rates['fast'] / rates['sly']:.2f}x")
+    for module in ("CParser", "CFastParser"):
+        print(f"import {module}: {import_time(module, args.repeat) * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
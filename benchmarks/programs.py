@@ -0,0 +1,230 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "project"))
+
+import CCache
+import kompilator
+
+PROGRAMS = os.path.join(HERE, "..", "tests", "programs")
+EXPECTED = os.path.join(PROGRAMS, "expected.json")
+
+# cost of every instruction of the virtual machine
+COST = {
+    "GET": 100,
+    "PUT": 100,
+    "LOAD": 10,
+    "STORE": 10,
+    "LOADI": 20,
+    "STOREI": 20,
+    "ADD": 10,
+    "SUB": 10,
+    "ADDI": 20,
+    "SUBI": 20,
+    "SET": 50,
+    "HALF": 5,
+    "JUMP": 1,
+    "JPOS": 1,
+    "JZERO": 1,
+    "JUMPI": 10,
+    "HALT": 0,
+}
+
+
+class MachineError(Exception):
+    pass
+
+
+# the virtual machine: memory cells start at 0, cell 0 is the accumulator,
+# SUB stops at 0. Returns the values written, the cost and how many inputs
+# were read; raises MachineError past limit
+def execute(code, inputs, limit):
+    mem = {}
+    get = mem.get
+    out = []
+    pos = 0
+    k = 0
+    cost = 0
+    while True:
+        if k < 0 or k >= len(code):
+            raise MachineError(f"jump outside of the program to {k}")
+        (op, a) = code[k]
+        cost += COST[op]
+        if cost > limit:
+            raise MachineError(f"cost over {limit}")
+        k += 1
+        if op == "LOAD":
+            mem[0] = get(a, 0)
+        elif op == "STORE":
+            mem[a] = get(0, 0)
+        elif op == "ADD":
+            mem[0] = get(0, 0) + get(a, 0)
+        elif op == "SUB":
+            mem[0] = max(get(0, 0) - get(a, 0), 0)
+        elif op == "SET":
+            mem[0] = a
+        elif op == "HALF":
+            mem[0] = get(0, 0) // 2
+        elif op == "JUMP":
+            k = a
+        elif op == "JPOS":
+            if get(0, 0) > 0:
+                k = a
+        elif op == "JZERO":
+            if get(0, 0) == 0:
+                k = a
+        elif op == "LOADI":
+            mem[0] = get(get(a, 0), 0)
+        elif op == "STOREI":
+            mem[get(a, 0)] = get(0, 0)
+        elif op == "ADDI":
+            mem[0] = get(0, 0) + get(get(a, 0), 0)
+        elif op == "SUBI":
+            mem[0] = max(get(0, 0) - get(get(a, 0), 0), 0)
+        elif op == "JUMPI":
+            k = get(a, 0)
+        elif op == "GET":
+            mem[a] = inputs[pos] if pos < len(inputs) else 0
+            pos += 1
+        elif op == "PUT":
+            out.append(get(a, 0))
+        else:
+            return (out, cost, min(pos, len(inputs)))
+
+
+# the expected runs by program name, each [inputs, outputs, cost]
+def load_expected(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+# one program per line, so a changed cost is a one-line diff
+def save_expected(path, expected):
+    with open(path, "w") as f:
+        f.write("{\n")
+        names = sorted(expected)
+        for i, name in enumerate(names):
+            sep = "," if i + 1 < len(names) else ""
+            f.write(f" {json.dumps(name)}: {json.dumps(expected[name])}{sep}\n")
+        f.write("}\n")
+
+
+# returns the number of failed programs and the total costs, expected and
+# new; new costs are put into expected. Each program is compiled twice with
+# an empty fragment store in fragments: reused fragments must give the same
+# code as a cold build
+def check(paths, expected, options, slack, fragments):
+    options = dict(options, fragments=fragments)
+    failed = 0
+    (old_cost, new_cost) = (0, 0)
+    for name, path in paths:
+        runs = expected.get(name)
+        if runs is None:
+            print(f"{name}: no expected runs")
+            failed += 1
+            continue
+        with open(path) as f:
+            text = f.read()
+        try:
+            result = kompilator.compile_source(text, options)
+            warm = kompilator.compile_source(text, options)
+        except kompilator.CompileError as e:
+            print(f"{name}: {e}")
+            failed += 1
+            continue
+        code = [(i.op, i.arg) for i in result.code]
+        if [(i.op, i.arg) for i in warm.code] != code:
+            print(f"{name}: reused fragments give different code")
+            failed += 1
+            continue
+        for run in runs:
+            (inputs, outputs, cost) = run
+            try:
+                (out, spent, _) = execute(code, inputs, cost * slack + 1000)
+            except MachineError as e:
+                print(f"{name}: inputs {inputs}: {e}")
+                failed += 1
+                break
+            if out != outputs:
+                print(f"{name}: inputs {inputs}: wrote {out}, expected {outputs}")
+                failed += 1
+                break
+            if spent > cost:
+                print(f"{name}: inputs {inputs}: cost {spent}, expected {cost}")
+            old_cost += cost
+            new_cost += spent
+            run[2] = spent
+    return (failed, old_cost, new_cost)
+
+
+def main():
+    argp = argparse.ArgumentParser(
+        description="compile the test programs, run them on the virtual machine"
+        " and compare what they write and what they cost with the expected runs"
+    )
+    argp.add_argument("names", nargs="*", help="programs to check (default: all)")
+    argp.add_argument(
+        "--expected",
+        default=EXPECTED,
+        help="expected runs (default: %(default)s)",
+    )
+    argp.add_argument(
+        "--option",
+        action="append",
+        default=[],
+        metavar="NAME=VALUE",
+        help="a compile_source option, e.g. peephole=False",
+    )
+    argp.add_argument(
+        "--slack",
+        type=int,
+        default=20,
+        help="stop a run costing this many times the expected cost"
+        " (default: %(default)s)",
+    )
+    argp.add_argument(
+        "--save-costs",
+        action="store_true",
+        help="store the new costs as expected when every program passes",
+    )
+    args = argp.parse_args()
+    options = {}
+    for option in args.option:
+        (name, _, value) = option.partition("=")
+        if name not in kompilator.OPTIONS:
+            argp.error(f"unknown option {name}")
+        if value in ("True", "False"):
+            options[name] = value == "True"
+        elif value.isdigit():
+            options[name] = int(value)
+        else:
+            options[name] = value
+    expected = load_expected(args.expected)
+    names = args.names or sorted(expected)
+    paths = [(name, os.path.join(PROGRAMS, name + ".imp")) for name in names]
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory() as path:
+        fragments = CCache.CompileCache(path)
+        (failed, old_cost, new_cost) = check(
+            paths, expected, options, args.slack, fragments
+        )
+    elapsed = time.perf_counter() - start
+    print(
+        f"programs: {len(paths) - failed} passed, {failed} failed"
+        f" in {elapsed:.1f} s; cost {new_cost} (expected {old_cost},"
+        f" ratio {new_cost / max(old_cost, 1):.4f})"
+    )
+    if failed > 0:
+        sys.exit(1)
+    if args.save_costs:
+        save_expected(args.expected, expected)
+        print(f"costs saved to {args.expected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+class LabelRef:
+    __slots__ = ("label", "offset")
+
+    def __init__(self, label, offset=0):
+        self.label = label
+        self.offset = offset
+
+
+class ConstRef:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+class Instr:
+    __slots__ = ("op", "arg", "labels", "comment")
+
+    # arg is an int, a LabelRef or a ConstRef until CProcessor.resolve runs
+    def __init__(self, op, arg=None, *labels, comment=None):
+        self.op = op
+        self.arg = arg
+        self.labels = list(labels) if labels else None
+        self.comment = comment
+
+    def mark(self, *labels):
+        if self.labels is None:
+            self.labels = list(labels)
+        else:
+            self.labels.extend(labels)
+        return self
+
+    def __str__(self) -> str:
+        if self.arg is None:
+            line = self.op
+        else:
+            line = f"{self.op} {self.arg}"
+        if self.comment is not None:
+            line += f" [{self.comment}]"
+        return line
@@ -0,0 +1,186 @@
+import contextlib
+import hashlib
+import marshal
+import os
+import shutil
+
+DEFAULT_SIZE = 64 * 1024 * 1024
+STATS_FILE = "stats"
+STATS_KEYS = ("hits", "misses", "fragment_hits", "fragment_misses", "evictions")
+
+_version = None
+
+
+def default_dir():
+    path = os.environ.get("KOMPILATOR_CACHE")
+    if path is not None:
+        return path
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "kompilator")
+
+
+# the compiler's version is the content of its own sources, so any change to
+# the code generator invalidates every cached entry
+def compiler_version():
+    global _version
+    if _version is None:
+        here = os.path.dirname(os.path.abspath(__file__))
+        h = hashlib.sha256()
+        for name in sorted(os.listdir(here)):
+            if name.endswith(".py"):
+                h.update(name.encode())
+                with open(os.path.join(here, name), "rb") as f:
+                    h.update(f.read())
+        _version = h.hexdigest()
+    return _version
+
+
+class CompileCache:
+    def __init__(self, path, max_size=DEFAULT_SIZE):
+        self.path = path
+        self.max_size = max_size
+        self.counters = dict.fromkeys(STATS_KEYS, 0)
+
+    def key(self, source, options=()):
+        h = hashlib.sha256()
+        h.update(compiler_version().encode())
+        h.update(repr(sorted(options)).encode())
+        h.update(b"\0")
+        h.update(source.encode())
+        return h.hexdigest()
+
+    def fragment_key(self, data):
+        h = hashlib.sha256()
+        h.update(compiler_version().encode())
+        h.update(data)
+        return h.hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.path, key + ".mr")
+
+    def fragment_path(self, key):
+        return os.path.join(self.path, key + ".frag")
+
+    # entry layout: length of the compiler log, the log, the assembly
+    def get(self, key):
+        path = self.entry_path(key)
+        try:
+            with open(path, "r") as f:
+                size = int(f.readline())
+                log = f.read(size)
+                code = f.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        return (log, code)
+
+    # the assembly is copied from the output file just written
+    def put_file(self, key, log, path):
+        with self.writer(self.entry_path(key), "w") as f:
+            f.write(f"{len(log)}\n")
+            f.write(log)
+            with open(path, "r") as code:
+                shutil.copyfileobj(code, f)
+
+    # per-procedure fragments, see CProcessor.export_fragment
+    def get_fragment(self, key):
+        path = self.fragment_path(key)
+        try:
+            with open(path, "rb") as f:
+                frag = marshal.loads(f.read())
+            os.utime(path)
+        except (OSError, EOFError, ValueError, TypeError):
+            self.counters["fragment_misses"] += 1
+            return None
+        self.counters["fragment_hits"] += 1
+        return frag
+
+    def put_fragment(self, key, frag):
+        with self.writer(self.fragment_path(key), "wb") as f:
+            marshal.dump(frag, f)
+
+    # writes go to a temporary file that replaces the entry when complete
+    @contextlib.contextmanager
+    def writer(self, path, mode):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            with open(tmp, mode) as f:
+                yield f
+            os.replace(tmp, path)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def take_counters(self):
+        counters = self.counters
+        self.counters = dict.fromkeys(STATS_KEYS, 0)
+        return counters
+
+    def add_counters(self, counters):
+        for name in STATS_KEYS:
+            self.counters[name] += counters[name]
+
+    def entries(self):
+        result = []
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return result
+        for name in names:
+            if name.endswith(".mr") or name.endswith(".frag"):
+                try:
+                    st = os.stat(os.path.join(self.path, name))
+                except OSError:
+                    continue
+                result.append((st.st_mtime_ns, st.st_size, name))
+        return result
+
+    # least recently used entries go first until the cache fits max_size
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                continue
+            total -= size
+            self.counters["evictions"] += 1
+
+    def load_stats(self):
+        stats = dict.fromkeys(STATS_KEYS, 0)
+        try:
+            with open(os.path.join(self.path, STATS_FILE), "r") as f:
+                for line in f:
+                    name, _, value = line.partition(" ")
+                    if name in stats:
+                        stats[name] = int(value)
+        except (OSError, ValueError):
+            pass
+        return stats
+
+    # adds this run's counters to the totals kept in the cache directory
+    def save_stats(self):
+        stats = self.load_stats()
+        for name, value in self.take_counters().items():
+            stats[name] += value
+        with self.writer(os.path.join(self.path, STATS_FILE), "w") as f:
+            for name in STATS_KEYS:
+                f.write(f"{name} {stats[name]}\n")
+
+    def stats(self):
+        stats = self.load_stats()
+        entries = self.entries()
+        stats["entries"] = len(entries)
+        stats["size"] = sum(size for _, size, _ in entries)
+        return stats
@@ -0,0 +1,143 @@
+import CCache
+import argparse
+import os
+
+
+def default_socket():
+    path = os.environ.get("KOMPILATOR_SOCKET")
+    if path is not None:
+        return path
+    base = os.environ.get("XDG_RUNTIME_DIR") or "/tmp"
+    return os.path.join(base, f"kompilator-{os.getuid()}.sock")
+
+
+# shared by kompilator.py and the thin client klient.py
+def make_argparser(prog):
+    argp = argparse.ArgumentParser(prog=prog)
+    argp.add_argument("paths", nargs="*", metavar="path")
+    argp.add_argument(
+        "--batch",
+        action="store_true",
+        help="compile every given .imp file or directory, output next to input",
+    )
+    argp.add_argument("-o", "--out-dir", help="batch output directory")
+    argp.add_argument("-j", "--jobs", type=int, help="batch worker processes")
+    argp.add_argument(
+        "--codegen-jobs",
+        type=int,
+        default=0,
+        metavar="N",
+        help="generate the code of procedures in N worker processes",
+    )
+    argp.add_argument(
+        "--parser",
+        choices=("sly", "fast"),
+        default="sly",
+        help="sly's LALR parser or the hand-written one (default: %(default)s)",
+    )
+    argp.add_argument(
+        "--no-inlining",
+        action="store_true",
+        help="compile every procedure call as a call",
+    )
+    argp.add_argument(
+        "--inline-growth",
+        type=int,
+        default=100,
+        metavar="PERCENT",
+        help="let inlining add at most PERCENT%% of the program's statements"
+        " (default: %(default)s)",
+    )
+    argp.add_argument(
+        "--no-hoisting",
+        action="store_true",
+        help="leave loop-invariant multiplications and divisions in the loop",
+    )
+    argp.add_argument(
+        "--no-strength-reduction",
+        action="store_true",
+        help="keep multiplying loop counters instead of adding in every pass",
+    )
+    argp.add_argument(
+        "--no-propagation",
+        action="store_true",
+        help="do not carry known constants and copies into later statements",
+    )
+    argp.add_argument(
+        "--no-tracking",
+        action="store_true",
+        help="keep loads of values the accumulator already holds",
+    )
+    argp.add_argument(
+        "--no-dead-stores",
+        action="store_true",
+        help="keep stores to variables that are not read afterwards",
+    )
+    argp.add_argument(
+        "--no-jump-threading",
+        action="store_true",
+        help="leave jump chains and unreachable code as generated",
+    )
+    argp.add_argument(
+        "--no-peephole",
+        action="store_true",
+        help="leave out the peephole pass over the generated code",
+    )
+    argp.add_argument(
+        "--binary",
+        action="store_true",
+        help="also write a binary object file (.mrb) next to each output",
+    )
+    argp.add_argument(
+        "--cache-dir",
+        default=CCache.default_dir(),
+        help="compilation cache directory (default: %(default)s)",
+    )
+    argp.add_argument(
+        "--cache-size",
+        type=int,
+        default=CCache.DEFAULT_SIZE // (1024 * 1024),
+        help="cache size limit in MiB, least recently used entries are evicted",
+    )
+    argp.add_argument(
+        "--no-cache", action="store_true", help="always compile, skip the cache"
+    )
+    argp.add_argument(
+        "--cache-stats", action="store_true", help="print cache hit/miss statistics"
+    )
+    argp.add_argument(
+        "--timings",
+        action="store_true",
+        help="print wall time and peak memory (tracemalloc) of each compiler phase",
+    )
+    argp.add_argument(
+        "--timings-json",
+        metavar="FILE",
+        help="write the phase timings as JSON to FILE (- for stdout)",
+    )
+    argp.add_argument(
+        "--stats-json",
+        metavar="FILE",
+        help="write code size and memory statistics as JSON to FILE (- for stdout)",
+    )
+    argp.add_argument(
+        "--serve",
+        action="store_true",
+        help="run a compile server with warm parsers on --socket",
+    )
+    argp.add_argument(
+        "--socket",
+        default=default_socket(),
+        help="compile server socket (default: %(default)s)",
+    )
+    return argp
+
+
+def check_args(argp, args):
+    if args.serve or (args.cache_stats and not args.paths):
+        return
+    if args.batch:
+        if not args.paths:
+            argp.error("expected files or directories to compile")
+    elif len(args.paths) != 2:
+        argp.error("expected <input file> <output file>")
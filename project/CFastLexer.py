@@ -0,0 +1,190 @@
+import collections
+import functools
+import itertools
+import operator
+import re
+
+
+# tokens of CFastLexer: the same fields as sly's Token, built in bulk
+FastToken = collections.namedtuple("Token", "type value lineno index end")
+_new_token = functools.partial(tuple.__new__, FastToken)
+
+
+# lexeme -> token type; identifiers and numbers are classified on first use
+# and remembered, so the common case is a dict hit
+class _TokenTypes(dict):
+    def __missing__(self, value):
+        c = value[0]
+        if c == "_" or "a" <= c <= "z":
+            t = "ID"
+        elif "0" <= c <= "9":
+            t = "NUMBER"
+        elif c == "[" and value[-1] == "]":
+            t = "#comment"
+        elif "A" <= c <= "Z":
+            # not a keyword itself, may still start with one (PROGRAMIS)
+            t = "#upper"
+        else:
+            t = "LEXERR"
+        self[value] = t
+        return t
+
+
+# counts newline runs in the whitespace before a token
+class _Newlines(dict):
+    runs = re.compile(r"\n+")
+
+    def __missing__(self, skipped):
+        n = len(self.runs.findall(skipped))
+        self[skipped] = n
+        return n
+
+
+# same token stream as CLexer (types, values, lineno, index, end and the
+# LEXERR exception). The text is cut into chunks at line breaks outside
+# comments, each chunk is split with one findall over a master regex and
+# the tokens are built column-wise; chunks with an unknown uppercase word
+# or a LEXERR go through the exact one-match-at-a-time path instead
+class CFastLexer:
+    KEYWORDS = {
+        "PROCEDURE": "PROCEDURE",
+        "IS": "IS",
+        "VAR": "VAR",
+        "BEGIN": "BEGIN",
+        "PROGRAM": "PROGRAM",
+        "IF": "IF",
+        "THEN": "THEN",
+        "ELSE": "ELSE",
+        "ENDIF": "ENDIF",
+        "ENDWHILE": "ENDWHILE",
+        "END": "END",
+        "WHILE": "WHILE",
+        "DO": "DO",
+        "REPEAT": "REPEAT",
+        "UNTIL": "UNTIL",
+        "READ": "READ",
+        "WRITE": "WRITE",
+    }
+    OPERATORS = {
+        ":=": "ASSIGN",
+        "!=": "NEQ",
+        "<=": "LE",
+        ">=": "GE",
+        "+": "ADD",
+        "-": "SUB",
+        "*": "MUL",
+        "/": "DIV",
+        "(": "LPAREN",
+        ")": "RPAREN",
+        "%": "MOD",
+        "<": "LT",
+        ">": "GT",
+        "=": "EQ",
+        ";": "SCOLON",
+        ",": "COMMA",
+    }
+    CHUNK = 1 << 16
+    master = re.compile(
+        r"([ \t\n]*)"
+        r"(\[[^]]*\]|[_a-z]+|[0-9]+|[A-Z]+|:=|!=|<=|>=|[-+*/()%<>=;,]|[^\n \t;]+)"
+    )
+    # sly's alternatives in sly's order, for the exact path
+    SKIP, ID, NUMBER, KEYWORD, OPERATOR, LEXERR = range(1, 7)
+    exact = re.compile(
+        r"([ \t]+|\[[^]]*\]|\n+)"
+        r"|([_a-z]+)"
+        r"|([0-9]+)"
+        r"|(" + "|".join(KEYWORDS) + ")"
+        r"|(:=|!=|<=|>=|[-+*/()%<>=;,])"
+        r"|([^\n \t;]+)"
+    )
+
+    def tokenize(self, text, lineno=1, index=0):
+        self.text = text
+        self.types = _TokenTypes(self.KEYWORDS)
+        self.types.update(self.OPERATORS)
+        self.newlines = _Newlines()
+        # one string object per distinct lexeme
+        self.strings = {}
+        self.index = index
+        self.lineno = lineno
+        while self.index < len(text):
+            stop = self.chunk_end(text, self.index)
+            yield from self.tokenize_chunk(text, self.index, stop)
+
+    # a line break that ends a run of them and is not inside a comment
+    def chunk_end(self, text, start):
+        stop = text.find("\n", start + self.CHUNK)
+        while stop != -1:
+            while stop < len(text) and text[stop] == "\n":
+                stop += 1
+            if text.rfind("[", start, stop) <= text.rfind("]", start, stop):
+                return stop
+            stop = text.find("]", stop)
+            if stop != -1:
+                stop = text.find("\n", stop)
+        return len(text)
+
+    def tokenize_chunk(self, text, start, stop):
+        pairs = self.master.findall(text, start, stop)
+        if not pairs:
+            self.lineno += self.newlines[text[start:stop]]
+            self.index = stop
+            return []
+        (skipped, values) = zip(*pairs)
+        values = list(map(self.strings.setdefault, values, values))
+        types = list(map(self.types.__getitem__, values))
+        if "#upper" in types or "LEXERR" in types:
+            return self.tokenize_exact(text, start, stop)
+        lengths = list(map(len, values))
+        ends = list(
+            itertools.accumulate(
+                map(operator.add, map(len, skipped), lengths), initial=start
+            )
+        )
+        del ends[0]
+        starts = list(map(operator.sub, ends, lengths))
+        linenos = list(
+            itertools.accumulate(
+                map(self.newlines.__getitem__, skipped), initial=self.lineno
+            )
+        )
+        del linenos[0]
+        # whitespace after the last token
+        self.lineno = linenos[-1] + self.newlines[text[ends[-1] : stop]]
+        self.index = stop
+        columns = (types, values, linenos, starts, ends)
+        if "#comment" in types:
+            keep = [i for i, t in enumerate(types) if t != "#comment"]
+            columns = [[column[i] for i in keep] for column in columns]
+        return map(_new_token, zip(*columns))
+
+    def tokenize_exact(self, text, start, stop):
+        keywords = self.KEYWORDS
+        operators = self.OPERATORS
+        index = start
+        lineno = self.lineno
+        try:
+            for m in self.exact.finditer(text, start, stop):
+                kind = m.lastindex
+                value = self.strings.setdefault(m.group(), m.group())
+                index = m.end()
+                if kind == self.SKIP:
+                    # like CLexer.ignore_newline: one line per run
+                    if value[0] == "\n":
+                        lineno += 1
+                    continue
+                if kind == self.ID:
+                    t = "ID"
+                elif kind == self.NUMBER:
+                    t = "NUMBER"
+                elif kind == self.KEYWORD:
+                    t = keywords[value]
+                elif kind == self.OPERATOR:
+                    t = operators[value]
+                else:
+                    raise Exception(f"Line {lineno}: Unknown token {value}")
+                yield _new_token((t, value, lineno, m.start(), index))
+        finally:
+            self.index = index
+            self.lineno = lineno
@@ -0,0 +1,295 @@
+from ProcObj import *
+import sys
+
+# statements without a block
+_COMMANDS = frozenset(("ID", "READ", "WRITE", "LEXERR"))
+_EXPRESSIONS = {
+    "ADD": OpType.ADD,
+    "SUB": OpType.SUB,
+    "MUL": OpType.MUL,
+    "DIV": OpType.DIV,
+    "MOD": OpType.MOD,
+}
+_CONDITIONS = {
+    "EQ": OpType.EQ,
+    "NEQ": OpType.NEQ,
+    "GT": OpType.GT,
+    "LT": OpType.LT,
+    "GE": OpType.GE,
+    "LE": OpType.LE,
+}
+
+
+class _SyntaxError(Exception):
+    pass
+
+
+# tokens after which a finished statement is reduced by CParser (its LALR
+# lookaheads); any other token is a syntax error before the statement's
+# action runs
+_FOLLOW = frozenset(
+    ("ID", "IF", "WHILE", "REPEAT", "READ", "WRITE", "LEXERR")
+    + ("END", "ELSE", "ENDIF", "ENDWHILE", "UNTIL")
+)
+_STARTS = frozenset(("PROCEDURE", "PROGRAM"))
+
+
+# recursive descent over the grammar of CParser. Every construct calls the
+# same CProcessor methods at the same point as the matching CParser
+# reduction (bottom-up, left to right, after the same lookahead), so both
+# build the same procedures, main and symbol tables. Syntax errors are
+# recovered from the way sly does it without error rules
+class CFastParser:
+    proc = None
+
+    # tokens as produced by CFastLexer; None when the input is not a program
+    def parse(self, tokens):
+        self.tokens = iter(tokens)
+        self.tok = next(self.tokens, None)
+        self.shifted = None
+        while True:
+            try:
+                return self.program_all()
+            except _SyntaxError:
+                pass
+            # the parse so far and the offending token are dropped, parsing
+            # starts over at the next PROCEDURE or PROGRAM
+            if self.tok is None:
+                return None
+            self.tok = next(self.tokens, None)
+            while self.tok is not None and self.tok[0] not in _STARTS:
+                self.tok = next(self.tokens, None)
+            if self.tok is None:
+                return None
+            self.shifted = 0
+
+    # main is reduced without looking ahead, so the program is compiled
+    # before tokens after its END are found
+    def program_all(self):
+        procedures = self.procedures()
+        main = self.main()
+        result = self.proc.compile_program(procedures, main)
+        if self.tok is not None:
+            self.error()
+        return result
+
+    # reported like sly: the first error, then only errors at least three
+    # tokens after the previous one
+    def error(self):
+        if self.shifted is None or self.shifted >= 3:
+            tok = self.tok
+            if tok is None:
+                sys.stderr.write("Parse error in input. EOF\n")
+            else:
+                sys.stderr.write(f"Syntax error at line {tok[2]}, token={tok[0]}\n")
+        if self.shifted is None:
+            self.tokens = self.counted(self.tokens)
+        self.shifted = 0
+        raise _SyntaxError()
+
+    def counted(self, tokens):
+        for tok in tokens:
+            self.shifted += 1
+            yield tok
+
+    # a statement is finished, the next token must be able to follow it
+    def finish(self):
+        if self.tok is None or self.tok[0] not in _FOLLOW:
+            self.error()
+
+    def expect(self, type):
+        tok = self.tok
+        if tok is None or tok[0] != type:
+            self.error()
+        self.tok = next(self.tokens, None)
+        return tok[1]
+
+    def accept(self, type):
+        tok = self.tok
+        if tok is not None and tok[0] == type:
+            self.tok = next(self.tokens, None)
+            return True
+        return False
+
+    def procedures(self):
+        procedures = []
+        while self.accept("PROCEDURE"):
+            line = self.tok[2] if self.tok is not None else None
+            (name, refs) = self.proc_head()
+            self.expect("IS")
+            declarations = None
+            if self.accept("VAR"):
+                declarations = self.declarations()
+            self.expect("BEGIN")
+            commands = self.commands()
+            self.expect("END")
+            if self.tok is None or self.tok[0] not in _STARTS:
+                self.error()
+            self.proc.createProc(name, line)
+            if declarations is not None:
+                self.proc.initVars(name, declarations)
+            self.proc.initRefs(name, refs)
+            procedures.append([name, commands])
+        return procedures
+
+    def main(self):
+        line = self.tok[2] if self.tok is not None else None
+        self.expect("PROGRAM")
+        self.expect("IS")
+        if self.accept("VAR"):
+            declarations = self.declarations()
+            self.expect("BEGIN")
+            commands = self.commands()
+            self.expect("END")
+            self.proc.createMain(line)
+            self.proc.initVars("main", declarations)
+        else:
+            self.expect("BEGIN")
+            commands = self.commands()
+            self.expect("END")
+            self.proc.createProc("main", line)
+        return ["main", commands]
+
+    # nested blocks are kept on an explicit stack, so nesting depth is not
+    # limited by Python's recursion limit. A frame holds the open statement
+    # and the command list it interrupted; the first command of a list is
+    # taken as is and later ones are appended, as in CParser.commands
+    def commands(self):
+        stack = []
+        commands = None
+        started = False
+        while True:
+            tok = self.tok
+            kind = tok[0] if tok is not None else None
+            if kind == "IF" or kind == "WHILE":
+                self.tok = next(self.tokens, None)
+                condition = self.condition()
+                self.expect("THEN" if kind == "IF" else "DO")
+                stack.append([kind, condition, None, commands, started])
+                (commands, started) = (None, False)
+                continue
+            if kind == "REPEAT":
+                self.tok = next(self.tokens, None)
+                stack.append([kind, None, None, commands, started])
+                (commands, started) = (None, False)
+                continue
+            if kind in _COMMANDS:
+                command = self.command(tok)
+            else:
+                if not started:
+                    self.error()
+                if not stack:
+                    return commands
+                frame = stack[-1]
+                if frame[0] == "IF" and self.accept("ELSE"):
+                    frame[0] = "ELSE"
+                    frame[2] = commands
+                    (commands, started) = (None, False)
+                    continue
+                command = self.close(frame, commands)
+                stack.pop()
+                (commands, started) = (frame[3], frame[4])
+            if not started:
+                commands = command
+                started = True
+            elif command is not None:
+                commands.extend(command)
+
+    # the end of a block statement, frame as in commands
+    def close(self, frame, commands):
+        (kind, condition, first) = frame[:3]
+        if kind == "IF":
+            self.expect("ENDIF")
+            self.finish()
+            if commands is None:
+                return None
+            return self.proc.a_if(condition, commands)
+        if kind == "ELSE":
+            self.expect("ENDIF")
+            self.finish()
+            if first is None and commands is None:
+                return None
+            return self.proc.a_ife(condition, first, commands)
+        if kind == "WHILE":
+            self.expect("ENDWHILE")
+            self.finish()
+            if commands is None:
+                return None
+            return self.proc.a_while(condition, commands)
+        self.expect("UNTIL")
+        condition = self.condition()
+        self.expect("SCOLON")
+        self.finish()
+        if commands is None:
+            return None
+        return self.proc.a_until(condition, commands)
+
+    # a statement without a block
+    def command(self, tok):
+        kind = tok[0]
+        self.tok = next(self.tokens, None)
+        if kind == "ID":
+            if self.accept("LPAREN"):
+                refs = self.declarations()
+                self.expect("RPAREN")
+                self.expect("SCOLON")
+                self.finish()
+                return self.proc.a_proc(tok[1], refs)
+            self.expect("ASSIGN")
+            expression = self.expression()
+            self.expect("SCOLON")
+            self.finish()
+            return self.proc.a_assign(tok[1], expression)
+        if kind == "READ":
+            name = self.expect("ID")
+            self.expect("SCOLON")
+            self.finish()
+            return self.proc.a_read(name)
+        if kind == "WRITE":
+            value = self.value()
+            self.expect("SCOLON")
+            self.finish()
+            return self.proc.a_write(value)
+        self.finish()
+        raise Exception("syntax error")
+
+    # name(parameters) of a procedure declaration
+    def proc_head(self):
+        name = self.expect("ID")
+        self.expect("LPAREN")
+        refs = self.declarations()
+        self.expect("RPAREN")
+        return (name, refs)
+
+    def declarations(self):
+        names = [self.expect("ID")]
+        while self.accept("COMMA"):
+            names.append(self.expect("ID"))
+        return names
+
+    def expression(self):
+        left = self.value()
+        tok = self.tok
+        if tok is not None and tok[0] in _EXPRESSIONS:
+            self.tok = next(self.tokens, None)
+            return ExpObject(_EXPRESSIONS[tok[0]], left, self.value())
+        return left
+
+    def condition(self):
+        left = self.value()
+        tok = self.tok
+        if tok is None or tok[0] not in _CONDITIONS:
+            self.error()
+        self.tok = next(self.tokens, None)
+        return ExpObject(_CONDITIONS[tok[0]], left, self.value())
+
+    def value(self):
+        tok = self.tok
+        if tok is not None:
+            if tok[0] == "NUMBER":
+                self.tok = next(self.tokens, None)
+                return self.proc.a_num(tok[1])
+            if tok[0] == "ID":
+                self.tok = next(self.tokens, None)
+                return self.proc.a_id(tok[1])
+        self.error()
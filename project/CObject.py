@@ -0,0 +1,241 @@
+import array
+import mmap
+import struct
+import sys
+
+# binary object file, little-endian, every section 8-byte aligned:
+#   header      magic, version, flags, instruction count, source map entry
+#               count, string table size
+#   code        one (opcode, operand) pair of int64 per instruction
+#   source map  (first instruction, source line, name) int64 triples,
+#               present when flags has SOURCE_MAP
+#   strings     NUL-terminated UTF-8, referenced by index from 1
+# opcode: index in OPCODES, the string index of the comment from bit 8 up.
+# operand: NONE when the instruction has none, a value outside int64 is
+# kept as a decimal string and stored as -(2 + string index).
+# source line 0 marks code without a place in the source (constants and
+# the mul/div/mod routines)
+MAGIC = b"MRB\0"
+VERSION = 1
+SOURCE_MAP = 1
+HEADER = struct.Struct("<4sHHQQQ")
+NONE = -1
+OPCODES = (
+    "GET",
+    "PUT",
+    "LOAD",
+    "STORE",
+    "LOADI",
+    "STOREI",
+    "ADD",
+    "SUB",
+    "ADDI",
+    "SUBI",
+    "SET",
+    "HALF",
+    "JUMP",
+    "JPOS",
+    "JZERO",
+    "JUMPI",
+    "HALT",
+)
+_opcode = {op: i for i, op in enumerate(OPCODES)}
+_max_operand = 2**63 - 1
+
+
+class ObjectError(Exception):
+    pass
+
+
+class _Strings:
+    def __init__(self):
+        self.index = {}
+        self.blob = bytearray()
+
+    def add(self, s):
+        i = self.index.get(s)
+        if i is None:
+            i = len(self.index) + 1
+            self.index[s] = i
+            self.blob += s.encode() + b"\0"
+        return i
+
+
+# code: resolved AsmObj.Instr list (what CompileResult.code holds) or
+# (op, operand, comment) triples; source_map: (first instruction, line,
+# name) triples or None
+def encode(code, source_map=None):
+    strings = _Strings()
+    words = array.array("q")
+    for instr in code:
+        if type(instr) is tuple:
+            (op, arg, comment) = instr
+        else:
+            (op, arg, comment) = (instr.op, instr.arg, instr.comment)
+        opcode = _opcode.get(op)
+        if opcode is None:
+            raise ObjectError(f"Unknown instruction {op}")
+        if comment is not None:
+            opcode |= strings.add(comment) << 8
+        if arg is None:
+            arg = NONE
+        elif type(arg) is not int or arg < 0 or arg > _max_operand:
+            arg = -2 - strings.add(str(arg))
+        words.append(opcode)
+        words.append(arg)
+    flags = 0
+    entries = array.array("q")
+    if source_map is not None:
+        flags |= SOURCE_MAP
+        for start, line, name in source_map:
+            entries.extend((start, line or 0, strings.add(name)))
+    blob = strings.blob
+    blob += bytes(-len(blob) % 8)
+    if sys.byteorder != "little":
+        words.byteswap()
+        entries.byteswap()
+    header = HEADER.pack(
+        MAGIC, VERSION, flags, len(words) // 2, len(entries) // 3, len(blob)
+    )
+    return b"".join((header, words.tobytes(), entries.tobytes(), blob))
+
+
+def write(path, code, source_map=None):
+    with open(path, "wb") as f:
+        f.write(encode(code, source_map))
+
+
+# the text kompilator.py writes, back to (op, operand, comment) triples
+def parse_text(text):
+    code = []
+    for line in text.split("\n"):
+        comment = None
+        if line.endswith("]"):
+            i = line.index(" [")
+            comment = line[i + 2 : -1]
+            line = line[:i]
+        (op, _, arg) = line.partition(" ")
+        code.append((op, int(arg) if arg else None, comment))
+    return code
+
+
+# a loaded object file. The code section is used in place through a
+# memoryview, over an mmap when opened with load
+class ObjectFile:
+    def __init__(self, data, mm=None):
+        self.__mmap = mm
+        if len(data) < HEADER.size:
+            raise ObjectError("Truncated object file")
+        (magic, version, flags, count, entries, size) = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ObjectError("Not an object file")
+        if version != VERSION:
+            raise ObjectError(f"Unsupported object file version {version}")
+        start = HEADER.size
+        mid = start + 16 * count
+        end = mid + 24 * entries
+        if len(data) < end + size:
+            raise ObjectError("Truncated object file")
+        strings = bytes(data[end : end + size]).decode().split("\0")
+        self.strings = [None] + strings
+        view = memoryview(data)
+        self.words = _words(view[start:mid])
+        self.flags = flags
+        self.source_map = None
+        if flags & SOURCE_MAP:
+            t = _words(view[mid:end])
+            self.source_map = [
+                (t[i], t[i + 1] or None, self.strings[t[i + 2]])
+                for i in range(0, len(t), 3)
+            ]
+            if type(t) is memoryview:
+                t.release()
+
+    def __len__(self):
+        return len(self.words) // 2
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        opcode = self.words[2 * i]
+        arg = self.words[2 * i + 1]
+        if arg == NONE:
+            arg = None
+        elif arg < 0:
+            arg = int(self.strings[-2 - arg])
+        comment = self.strings[opcode >> 8] if opcode >> 8 else None
+        return (OPCODES[opcode & 0xFF], arg, comment)
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+    # the text form, line by line, exactly as kompilator.py writes it
+    def lines(self):
+        strings = self.strings
+        words = self.words
+        for i in range(0, len(words), 2):
+            opcode = words[i]
+            arg = words[i + 1]
+            if arg == NONE:
+                line = OPCODES[opcode & 0xFF]
+            elif arg < 0:
+                line = f"{OPCODES[opcode & 0xFF]} {strings[-2 - arg]}"
+            else:
+                line = f"{OPCODES[opcode & 0xFF]} {arg}"
+            if opcode >> 8:
+                line += f" [{strings[opcode >> 8]}]"
+            yield line
+
+    def text(self):
+        return "\n".join(self.lines())
+
+    def close(self):
+        if type(self.words) is memoryview:
+            self.words.release()
+        self.words = None
+        if self.__mmap is not None:
+            self.__mmap.close()
+            self.__mmap = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _words(view):
+    if sys.byteorder == "little":
+        return view.cast("q")
+    t = array.array("q")
+    t.frombytes(view)
+    t.byteswap()
+    return t
+
+
+def load(path):
+    with open(path, "rb") as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return ObjectFile(mm, mm)
+    except Exception:
+        mm.close()
+        raise
+
+
+# python CObject.py prog.mrb [prog.mr]: the text form of an object file
+def main():
+    if len(sys.argv) not in (2, 3):
+        print("usage: CObject.py <object file> [<output file>]")
+        sys.exit(2)
+    with load(sys.argv[1]) as obj:
+        text = obj.text()
+    if len(sys.argv) == 3:
+        with open(sys.argv[2], "w") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
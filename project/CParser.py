@@ -2,6 +2,7 @@ from sly import Parser
 from CLexer import CLexer
 from CProcessor import *
 from ProcObj import *
+import CTables
 
 
 class CParser(Parser):
@@ -9,27 +10,23 @@ class CParser(Parser):
     start = "program_all"
     proc = CProcessor()
 
+    # LALR tables are loaded from the on-disk cache when the grammar is unchanged
+    @classmethod
+    def _build(cls, definitions):
+        CTables.build(cls, definitions)
+
     @_("")
     def empty(self, p):
         pass
 
     @_("procedures main")
     def program_all(self, p):
-        self.proc.tree_walk(p.main)
-        self.proc.tree_walk_proc(p.procedures)
-        t = self.proc.process_list(p.main)
-        f = self.proc.process_list_procedures(p.procedures)
-        t1 = self.proc.fin_glue_outer(t)
-        f1 = self.proc.fin_glue_proc(f)
-        t1 = self.proc.fin_merge(t1, f1)
-        t1 = self.proc.substitute_consts(t1)
-        t1 = self.proc.substitute_labels(t1)
-        return t1
+        return self.proc.compile_program(p.procedures, p.main)
 
     @_("procedures PROCEDURE proc_head IS VAR declarations BEGIN commands END")
     def procedures(self, p):
         name = p.proc_head[0]
-        self.proc.createProc(name)
+        self.proc.createProc(name, self.line_position(p.proc_head))
         self.proc.initVars(name, p.declarations)
         self.proc.initRefs(name, p.proc_head[1])
         p.procedures.append([name, p.commands])
@@ -38,7 +35,7 @@ class CParser(Parser):
     @_("procedures PROCEDURE proc_head IS BEGIN commands END")
     def procedures(self, p):
         name = p.proc_head[0]
-        self.proc.createProc(name)
+        self.proc.createProc(name, self.line_position(p.proc_head))
         self.proc.initRefs(f"{name}", p.proc_head[1])
         p.procedures.append([f"{p.proc_head[0]}", p.commands])
         return p.procedures
@@ -49,13 +46,13 @@ class CParser(Parser):
 
     @_("PROGRAM IS VAR declarations BEGIN commands END")
     def main(self, p):
-        self.proc.createMain()
+        self.proc.createMain(p.lineno)
         self.proc.initVars("main", p.declarations)
         return ["main", p.commands]
 
     @_("PROGRAM IS BEGIN commands END")
     def main(self, p):
-        self.proc.createProc("main")
+        self.proc.createProc("main", p.lineno)
         return ["main", p.commands]
 
     @_("commands command")
@@ -180,11 +177,11 @@ class CParser(Parser):
 
     @_("NUMBER")
     def value(self, p):
-        return ValueObject(ValueType.NUM, p.NUMBER)
+        return self.proc.a_num(p.NUMBER)
 
     @_("ID")
     def value(self, p):
-        return ValueObject(ValueType.VAR, p.ID)
+        return self.proc.a_id(p.ID)
 
     @_("LEXERR")
     def command(self, p):
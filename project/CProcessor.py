@@ -1,6 +1,10 @@
-import re
 from ProcObj import *
+from AsmObj import *
+from concurrent.futures import ProcessPoolExecutor
 from enum import Enum
+import contextlib
+import itertools
+import marshal
 
 
 class Mode(Enum):
@@ -9,6 +13,7 @@ class Mode(Enum):
 
 
 class Variable:
+    __slots__ = ("address", "mode", "isSet")
     address: int
     mode: "Mode"
     isSet: bool
@@ -29,7 +34,19 @@ class Variable:
 
 
 class Procedure:
-    def __init__(self, proc_name, cproc: "CProcessor"):
+    __slots__ = (
+        "symbols",
+        "params",
+        "proc_no",
+        "__pname",
+        "__thisLabel",
+        "__is_called",
+        "__back",
+        "__times_called",
+        "line",
+    )
+
+    def __init__(self, proc_name, cproc: "CProcessor", line=None):
         self.symbols = {}
         self.params = []
         self.proc_no = cproc.getProcNo()
@@ -38,6 +55,7 @@ class Procedure:
         self.__is_called = False
         self.__back = None
         self.__times_called = 0
+        self.line = line
 
     def inline(self):
         self.__is_called = False
@@ -64,21 +82,34 @@ class Procedure:
     def getTimesCalled(self):
         return self.__times_called
 
-    def initJumpBack(self, cproc):
-        self.__back = Variable(cproc.getNewAddress(), Mode.VAR)
+    def hasJumpBack(self):
+        return self.__back is not None
 
-    def initVars(self, cproc, vars):
+    # cells are given by place, once the used variables are known
+    def initJumpBack(self):
+        self.__back = Variable(None, Mode.VAR)
+
+    def initVars(self, vars):
         for var in vars:
             if var in self.symbols:
                 raise Exception("Redeclaration of a variable")
-            self.symbols[var] = Variable(cproc.getNewAddress(), Mode.VAR)
+            self.symbols[var] = Variable(None, Mode.VAR)
 
-    def initRefs(self, cproc, refs):
+    def initRefs(self, refs):
         for ref in refs:
-            t = Variable(cproc.getNewAddress(), Mode.REF)
+            t = Variable(None, Mode.REF)
             self.symbols[ref] = t
             self.params.append(t)
 
+    # the return address of a procedure, then its variables in declaration
+    # order; a VAR variable not in used gets no cell
+    def place(self, cproc, used):
+        if self.__back is not None and self.__pname != "main":
+            self.__back.address = cproc.getNewAddress()
+        for name, var in self.symbols.items():
+            if var.mode == Mode.REF or name in used:
+                var.address = cproc.getNewAddress()
+
     def touch_var(self, var):
         if var not in self.symbols:
             return False
@@ -97,12 +128,61 @@ class Procedure:
         return self.symbols[var]
 
 
+# what is known about the VAR variables of a procedure at a point of its
+# code: known maps a name to its constant value or to the name of the
+# variable holding the same value; copies is the reverse of the latter
+class Facts:
+    __slots__ = ("known", "copies")
+
+    def __init__(self, known=None):
+        self.known = {} if known is None else known
+        self.copies = {}
+        for name, fact in self.known.items():
+            if type(fact) is str:
+                self.copies.setdefault(fact, set()).add(name)
+
+    def copy(self):
+        return Facts(dict(self.known))
+
+    # name gets a new value: its fact and the copies of it are gone
+    def kill(self, name):
+        fact = self.known.pop(name, None)
+        if type(fact) is str:
+            self.copies[fact].discard(name)
+        for other in self.copies.pop(name, ()):
+            del self.known[other]
+
+    def setConst(self, name, value):
+        self.kill(name)
+        self.known[name] = value
+
+    def setCopy(self, name, source):
+        self.kill(name)
+        fact = self.known.get(source, source)
+        self.known[name] = fact
+        if type(fact) is str:
+            self.copies.setdefault(fact, set()).add(name)
+
+    # only the facts holding in every one of envs are left
+    def meet(self, envs):
+        (first, rest) = (envs[0], envs[1:])
+        known = {
+            name: fact
+            for name, fact in first.known.items()
+            if all(env.known.get(name) == fact for env in rest)
+        }
+        self.__init__(known)
+
+
 class CProcessor:
-    __const_tag = "@#"
-    __to_label = "TO#"
-    __dest_label = "LBL#"
-    __to_label_next = "TO#$"
     __max_const = 2**63 - 1
+    # statements a procedure may have to be inlined outside of loops, four
+    # times more for every loop level up to three
+    __inline_size = 8
+    __address_ops = frozenset(
+        ("GET", "PUT", "LOAD", "STORE", "LOADI", "STOREI")
+        + ("ADD", "SUB", "ADDI", "SUBI", "JUMPI")
+    )
 
     def __init__(self):
         self.data = {}
@@ -113,6 +193,7 @@ class CProcessor:
         self.__loop_depth = 0
         self.__proc_counter = 0
         self.__helper_reg = []
+        self.__helpers_asked = 0
         self.__mul_label = None
         self.__outerMulIsUsed = False
         self.__div_label = None
@@ -122,6 +203,28 @@ class CProcessor:
         self.__no_divs = 0
         self.__no_mods = 0
         self.__no_muls = 0
+        self.__log = []
+        self.__addresses = None
+        self.__nums = {}
+        self.__ids = {}
+        self.fragments = None
+        self.timings = None
+        self.codegen_jobs = 0
+        self.propagation = True
+        self.tracking = True
+        self.dead_stores = True
+        self.inlining = True
+        self.inline_growth = 100
+        self.hoisting = True
+        self.strength_reduction = True
+        self.peephole = True
+        self.jump_threading = True
+        self.__removed = {}
+        self.__dead_stores = {}
+        self.__inlined = {}
+        self.__hoisted = {}
+        self.__reduced = {}
+        self.__jumps = {"threaded": 0, "inverted": 0, "unreachable": 0}
 
     def getModLabel(self):
         if self.__mod_label is None:
@@ -139,6 +242,7 @@ class CProcessor:
         return self.__div_label
 
     def getHelperReg(self, n):
+        self.__helpers_asked = max(self.__helpers_asked, n + 1)
         if len(self.__helper_reg) == n:
             self.__helper_reg.append(self.getNewAddress())
         elif len(self.__helper_reg) < n:
@@ -149,51 +253,154 @@ class CProcessor:
         self.__proc_counter += 1
         return self.__proc_counter
 
-    def createMain(self):
-        self.symbols_proc["main"] = Procedure("main", self)
+    def createMain(self, line=None):
+        self.symbols_proc["main"] = Procedure("main", self, line)
 
-    def createProc(self, name):
-        self.symbols_proc[name] = Procedure(name, self)
+    def createProc(self, name, line=None):
+        self.symbols_proc[name] = Procedure(name, self, line)
         t = self.symbols_proc[name]
-        t.initJumpBack(self)
+        t.initJumpBack()
 
     def initVars(self, name, vars):
-        self.symbols_proc[name].initVars(self, vars)
+        self.symbols_proc[name].initVars(vars)
 
     def initRefs(self, name, refs):
-        self.symbols_proc[name].initRefs(self, refs)
+        self.symbols_proc[name].initRefs(refs)
 
     def getNewAddress(self):
         self.__protected_add += 1
         return self.__protected_add
 
+    # warnings are collected, the caller decides where they go
+    def warn(self, msg):
+        self.__log.append(msg)
+
+    # a phase of CTimings.Timings, nothing when not timing
+    def timed(self, name):
+        if self.timings is None:
+            return contextlib.nullcontext()
+        return self.timings.phase(name)
+
+    def getLog(self):
+        return self.__log
+
+    # after resolve; code has the instructions of every entry of the source
+    # map, calls counts the call sites in compiled code
+    def getStats(self, sections):
+        routines = []
+        if self.__outerMulIsUsed:
+            routines.append("mul")
+        if self.__outerDivIsUsed:
+            routines.append("div")
+        if self.__outerModIsUsed:
+            routines.append("mod")
+        procedures = [
+            name
+            for name, proc in self.symbols_proc.items()
+            if name != "main" and proc.isCalled()
+        ]
+        total = sum(map(len, sections))
+        code = {}
+        entries = self.getSourceMap()
+        for (start, _, name), end in zip(
+            entries, [e[0] for e in entries[1:]] + [total]
+        ):
+            code[name] = end - start
+        placed = [
+            proc
+            for name, proc in self.symbols_proc.items()
+            if name == "main" or proc.isCalled()
+        ]
+        variables = sum(
+            var.address is not None for proc in placed for var in proc.symbols.values()
+        )
+        returns = len(placed) - 1
+        return {
+            "instructions": total,
+            "code": code,
+            "cells": self.__protected_add + 1,
+            "memory": {
+                "variables": variables,
+                "returns": returns,
+                "helpers": len(self.__helper_reg),
+                "constants": len(self.data),
+            },
+            "constants": len(self.data),
+            "labels": self.__label_no,
+            "procedures": procedures,
+            "calls": {
+                name: proc.getTimesCalled()
+                for name, proc in self.symbols_proc.items()
+                if name != "main"
+            },
+            "routines": routines,
+            "operations": {
+                "mul": self.__no_muls,
+                "div": self.__no_divs,
+                "mod": self.__no_mods,
+            },
+            "peephole": {
+                "removed": sum(self.__removed.values()),
+                "rules": dict(self.__removed),
+            },
+            "jumps": dict(self.__jumps),
+            "inlined": dict(self.__inlined),
+            "hoisted": sum(self.__hoisted.get(proc.getName(), 0) for proc in placed),
+            "reduced": sum(self.__reduced.get(proc.getName(), 0) for proc in placed),
+            "dead": {
+                "stores": sum(
+                    self.__dead_stores.get(proc.getName(), 0) for proc in placed
+                ),
+                "variables": sum(len(proc.symbols) for proc in placed) - variables,
+            },
+            "warnings": len(self.__log),
+        }
+
     # asm
     def c_load(self, id: "str", sym_proc):
         if sym_proc.get_var(id).mode == Mode.VAR:
-            return f"LOAD {sym_proc.get_var(id).address}"
+            return Instr("LOAD", sym_proc.get_var(id).address)
         else:
-            return f"LOADI {sym_proc.get_var(id).address}"
+            return Instr("LOADI", sym_proc.get_var(id).address)
 
     def c_store(self, id: "str", sym_proc):
         if sym_proc.get_var(id).mode == Mode.VAR:
-            return f"STORE {sym_proc.get_var(id).address}"
+            return Instr("STORE", sym_proc.get_var(id).address)
         else:
-            return f"STOREI {sym_proc.get_var(id).address}"
+            return Instr("STOREI", sym_proc.get_var(id).address)
 
     def c_add(self, id: "str", sym_proc):
         if sym_proc.get_var(id).mode == Mode.VAR:
-            return f"ADD {sym_proc.get_var(id).address}"
+            return Instr("ADD", sym_proc.get_var(id).address)
         else:
-            return f"ADDI {sym_proc.get_var(id).address}"
+            return Instr("ADDI", sym_proc.get_var(id).address)
 
     def c_sub(self, id: "str", sym_proc):
         if sym_proc.get_var(id).mode == Mode.VAR:
-            return f"SUB {sym_proc.get_var(id).address}"
+            return Instr("SUB", sym_proc.get_var(id).address)
         else:
-            return f"SUBI {sym_proc.get_var(id).address}"
+            return Instr("SUBI", sym_proc.get_var(id).address)
 
     #!asm
     # parse
+    # value nodes are shared: one per literal value and one per identifier
+    def a_num(self, text):
+        return self.h_num(int(text))
+
+    def h_num(self, num):
+        node = self.__nums.get(num)
+        if node is None:
+            node = ValueObject(ValueType.NUM, num)
+            self.__nums[num] = node
+        return node
+
+    def a_id(self, name):
+        node = self.__ids.get(name)
+        if node is None:
+            node = ValueObject(ValueType.VAR, name)
+            self.__ids[name] = node
+        return node
+
     def a_read(self, id):
         return [("#read", id)]
 
@@ -203,12 +410,12 @@ class CProcessor:
         sym_proc.touch_var(id)
         if sym_proc.get_var(id).mode == Mode.VAR:
             return [
-                f"GET {sym_proc.get_var(id).address}",
+                Instr("GET", sym_proc.get_var(id).address),
             ]
         else:
             return [
-                f"GET 0",
-                f"STOREI {sym_proc.get_var(id).address}",
+                Instr("GET", 0),
+                Instr("STOREI", sym_proc.get_var(id).address),
             ]
 
     def a_write(self, val):
@@ -220,25 +427,25 @@ class CProcessor:
                 if self.__loop_depth == 0:
                     raise Exception(f"Uninitialized variable {val.data}")
                 else:
-                    print(f"WARINIG: {val.data} may be used before set")
+                    self.warn(f"WARINIG: {val.data} may be used before set")
             if sym_proc.get_var(val.data).mode == Mode.VAR:
                 return [
-                    f"PUT {sym_proc.get_var(val.data).address}",
+                    Instr("PUT", sym_proc.get_var(val.data).address),
                 ]
             else:
                 return [
-                    f"LOADI {sym_proc.get_var(val.data).address}",
-                    f"PUT 0",
+                    Instr("LOADI", sym_proc.get_var(val.data).address),
+                    Instr("PUT", 0),
                 ]
         else:
             if self.__loop_depth == 0:
                 return [
-                    f"SET {val.data}",
-                    f"PUT 0",
+                    Instr("SET", val.data),
+                    Instr("PUT", 0),
                 ]
             else:
                 return [
-                    f"PUT {self.const_tag(val.data)}",
+                    Instr("PUT", self.const_tag(val.data)),
                 ]
 
     def a_assign(self, id, val):
@@ -254,14 +461,14 @@ class CProcessor:
                 if self.__loop_depth == 0:
                     raise Exception(f"Uninitialized variable {val.data}")
                 else:
-                    print(f"WARINIG: {val.data} may be used before set")
+                    self.warn(f"WARINIG: {val.data} may be used before set")
             return [
                 self.c_load(val.data, sym_proc),
                 self.c_store(id, sym_proc),
             ]
         else:
             return [
-                f"SET {val.data}",
+                Instr("SET", val.data),
                 self.c_store(id, sym_proc),
             ]
 
@@ -270,14 +477,14 @@ class CProcessor:
             if self.__loop_depth == 0:
                 raise Exception(f"Uninitialized variable {exp.left.data}")
             else:
-                print(f"WARINIG: {exp.left.data} may be used before set")
+                self.warn(f"WARINIG: {exp.left.data} may be used before set")
         if exp.right.vType == ValueType.VAR and (
             not sym_proc.check_ivar(exp.right.data)
         ):
             if self.__loop_depth == 0:
                 raise Exception(f"Uninitialized variable {exp.right.data}")
             else:
-                print(f"WARINIG: {exp.right.data} may be used before set")
+                self.warn(f"WARINIG: {exp.right.data} may be used before set")
         if not sym_proc.touch_var(id):
             raise Exception(f"Undeclared variable {id}")
         exp.setDest(id)
@@ -292,31 +499,51 @@ class CProcessor:
         elif exp.oType == OpType.MOD:
             return self.b_mod(exp, sym_proc)
 
+    # a removed store reports what compiling it would have and marks its
+    # variable set, so the checks of later statements are unchanged
+    def b_dead(self, id, val, sym_proc):
+        if type(val) is ValueObject:
+            # checked in the order of b_assign
+            if not sym_proc.check_evar(id):
+                raise Exception(f"Undeclared variable {id}")
+            vals = [] if id == val.data else [val]
+        else:
+            vals = [val.left, val.right]
+        for v in vals:
+            if v.vType == ValueType.VAR and not sym_proc.check_ivar(v.data):
+                if self.__loop_depth == 0:
+                    raise Exception(f"Uninitialized variable {v.data}")
+                else:
+                    self.warn(f"WARINIG: {v.data} may be used before set")
+        if not sym_proc.touch_var(id):
+            raise Exception(f"Undeclared variable {id}")
+        return []
+
     def b_add(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            v = int(exp.left.data) + int(exp.right.data)
+            v = exp.left.data + exp.right.data
             if v <= self.__max_const:
                 return [
-                    f"SET {v}",
+                    Instr("SET", v),
                     self.c_store(exp.dest, sym_proc),
                 ]
             else:
                 if v % 2 == 0:
                     return [
-                        f"SET {v // 2}",
-                        f"ADD 0",
+                        Instr("SET", v // 2),
+                        Instr("ADD", 0),
                         self.c_store(exp.dest, sym_proc),
                     ]
                 else:
                     return [
-                        f"SET {exp.left.data}",
+                        Instr("SET", exp.left.data),
                         self.c_store(exp.dest, sym_proc),
-                        f"SET {exp.right.data}",
+                        Instr("SET", exp.right.data),
                         self.c_add(exp.dest, sym_proc),
                         self.c_store(exp.dest, sym_proc),
                     ]
         elif exp.left.vType == ValueType.NUM:
-            if int(exp.left.data) == 0:
+            if exp.left.data == 0:
                 if exp.right.data == exp.dest:
                     return []
                 else:
@@ -326,12 +553,12 @@ class CProcessor:
                     ]
             else:
                 return [
-                    f"SET {exp.left.data}",
+                    Instr("SET", exp.left.data),
                     self.c_add(exp.right.data, sym_proc),
                     self.c_store(exp.dest, sym_proc),
                 ]
         elif exp.right.vType == ValueType.NUM:
-            if int(exp.right.data) == 0:
+            if exp.right.data == 0:
                 if exp.left.data == exp.dest:
                     return []
                 else:
@@ -341,7 +568,7 @@ class CProcessor:
                     ]
             else:
                 return [
-                    f"SET {exp.right.data}",
+                    Instr("SET", exp.right.data),
                     self.c_add(exp.left.data, sym_proc),
                     self.c_store(exp.dest, sym_proc),
                 ]
@@ -354,29 +581,29 @@ class CProcessor:
 
     def b_sub(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            l = int(exp.left.data)
-            r = int(exp.right.data)
+            l = exp.left.data
+            r = exp.right.data
             v = 0
             if r <= l:
                 v = l - r
             return [
-                f"SET {v}",
+                Instr("SET", v),
                 self.c_store(exp.dest, sym_proc),
             ]
         elif exp.left.vType == ValueType.NUM:
-            if int(exp.left.data) == 0:
+            if exp.left.data == 0:
                 return [
-                    f"SET 0",
+                    Instr("SET", 0),
                     self.c_store(exp.dest, sym_proc),
                 ]
             else:
                 return [
-                    f"SET {exp.left.data}",
+                    Instr("SET", exp.left.data),
                     self.c_sub(exp.right.data, sym_proc),
-                    self.c_store(exp.dest),
+                    self.c_store(exp.dest, sym_proc),
                 ]
         elif exp.right.vType == ValueType.NUM:
-            r = int(exp.right.data)
+            r = exp.right.data
             if r == 0:
                 if exp.left.data == exp.dest:
                     return []
@@ -388,7 +615,7 @@ class CProcessor:
             i = self.const_tag(r)
             return [
                 self.c_load(exp.left.data, sym_proc),
-                f"SUB {i}",
+                Instr("SUB", i),
                 self.c_store(exp.dest, sym_proc),
             ]
         else:
@@ -400,26 +627,26 @@ class CProcessor:
 
     def b_mul(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            v = int(exp.left.data) * int(exp.right.data)
+            v = exp.left.data * exp.right.data
             if v <= self.__max_const:
                 return [
-                    f"SET {v}",
+                    Instr("SET", v),
                     self.c_store(exp.dest, sym_proc),
                 ]
             else:
                 if v // 2 <= self.__max_const:
                     if v % 2 == 0:
                         return [
-                            f"SET {v // 2}",
-                            f"ADD 0",
+                            Instr("SET", v // 2),
+                            Instr("ADD", 0),
                             self.c_store(exp.dest, sym_proc),
                         ]
                     else:
                         t = v - (v // 2)
                         return [
-                            f"SET {t}",
+                            Instr("SET", t),
                             self.c_store(exp.dest, sym_proc),
-                            f"SET {v // 2}",
+                            Instr("SET", v // 2),
                             self.c_add(exp.dest, sym_proc),
                             self.c_store(exp.dest, sym_proc),
                         ]
@@ -433,27 +660,27 @@ class CProcessor:
                     back = self.getHelperReg(3)
                     self.__outerMulIsUsed = True
                     code = [
-                        "SET 0",
-                        f"STORE {ret}",
-                        f"SET {self.to_label(label_back)}",
-                        f"STORE {back}",
-                        f"SET {self.__max_const}",
-                        f"STORE {h0}",
-                        f"SET {q}",
-                        f"JUMP {self.to_label(self.getMulLabel())}",
+                        Instr("SET", 0),
+                        Instr("STORE", ret),
+                        Instr("SET", self.to_label(label_back)),
+                        Instr("STORE", back),
+                        Instr("SET", self.__max_const),
+                        Instr("STORE", h0),
+                        Instr("SET", q),
+                        Instr("JUMP", self.to_label(self.getMulLabel())),
                     ]
                     if r > 0:
                         code.extend(
                             [
-                                f"SET {r} {self.dest_label(label_back)}",
-                                f"ADD {ret}",
+                                Instr("SET", r, label_back),
+                                Instr("ADD", ret),
                                 self.c_store(exp.dest, sym_proc),
                             ]
                         )
                     else:
                         code.extend(
                             [
-                                f"{self.c_store(exp.dest, sym_proc)} {self.dest_label(label_back)}",
+                                self.c_store(exp.dest, sym_proc).mark(label_back),
                             ]
                         )
                     return code
@@ -461,10 +688,10 @@ class CProcessor:
             if exp.right.vType == ValueType.NUM:
                 exp.right, exp.left = exp.left, exp.right
             if exp.left.vType == ValueType.NUM:
-                l = int(exp.left.data)
+                l = exp.left.data
                 if l == 0:
                     return [
-                        f"SET 0",
+                        Instr("SET", 0),
                         self.c_store(exp.dest, sym_proc),
                     ]
                 elif l == 1:
@@ -481,14 +708,14 @@ class CProcessor:
                 ):
                     t = [self.c_load(exp.right.data, sym_proc)]
                     while l > 1:
-                        t.append("ADD 0")
+                        t.append(Instr("ADD", 0))
                         l //= 2
                     t.append(self.c_store(exp.dest, sym_proc))
                     return t
                 elif l == 3:
                     return [
                         self.c_load(exp.right.data, sym_proc),
-                        "ADD 0",
+                        Instr("ADD", 0),
                         self.c_add(exp.right.data, sym_proc),
                         self.c_store(exp.dest, sym_proc),
                     ]
@@ -500,20 +727,20 @@ class CProcessor:
                     h0 = self.getHelperReg(0)
                     h1 = self.getHelperReg(1)
                     t = [
-                        "SET 0",
-                        f"STORE {h1}",
+                        Instr("SET", 0),
+                        Instr("STORE", h1),
                         self.c_load(exp.right.data, sym_proc),
                     ]
                     while l > 0:
                         if l == 1:
-                            t.append(f"ADD {h1}")
+                            t.append(Instr("ADD", h1))
                             break
                         elif l % 2 == 1:
-                            t.append(f"STORE {h0}")
-                            t.append(f"ADD {h1}")
-                            t.append(f"STORE {h1}")
-                            t.append(f"LOAD {h0}")
-                        t.append("ADD 0")
+                            t.append(Instr("STORE", h0))
+                            t.append(Instr("ADD", h1))
+                            t.append(Instr("STORE", h1))
+                            t.append(Instr("LOAD", h0))
+                        t.append(Instr("ADD", 0))
                         l //= 2
                     t.append(self.c_store(exp.dest, sym_proc))
                     return t
@@ -525,15 +752,15 @@ class CProcessor:
                     back = self.getHelperReg(3)
                     self.__outerMulIsUsed = True
                     return [
-                        "SET 0",
-                        f"STORE {ret}",
-                        f"SET {self.to_label(label_back)}",
-                        f"STORE {back}",
+                        Instr("SET", 0),
+                        Instr("STORE", ret),
+                        Instr("SET", self.to_label(label_back)),
+                        Instr("STORE", back),
                         self.c_load(exp.right.data, sym_proc),
-                        f"STORE {h0}",
-                        f"SET {l}",
-                        f"JUMP {self.to_label(self.getMulLabel())}",
-                        f"{self.c_store(exp.dest, sym_proc)} {self.dest_label(label_back)}",
+                        Instr("STORE", h0),
+                        Instr("SET", l),
+                        Instr("JUMP", self.to_label(self.getMulLabel())),
+                        self.c_store(exp.dest, sym_proc).mark(label_back),
                     ]
             else:
                 label_back = self.createLabel()
@@ -543,30 +770,32 @@ class CProcessor:
                 back = self.getHelperReg(3)
                 self.__outerMulIsUsed = True
                 return [
-                    "SET 0",
-                    f"STORE {ret}",
-                    f"SET {self.to_label(label_back)}",
-                    f"STORE {back}",
+                    Instr("SET", 0),
+                    Instr("STORE", ret),
+                    Instr("SET", self.to_label(label_back)),
+                    Instr("STORE", back),
                     self.c_load(exp.right.data, sym_proc),
-                    f"STORE {h0}",
+                    Instr("STORE", h0),
                     self.c_load(exp.left.data, sym_proc),
-                    f"JUMP {self.to_label(self.getMulLabel())}",
-                    f"{self.c_store(exp.dest, sym_proc)} {self.dest_label(label_back)}",
+                    Instr("JUMP", self.to_label(self.getMulLabel())),
+                    self.c_store(exp.dest, sym_proc).mark(label_back),
                 ]
 
     def b_div(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            v = int(exp.left.data) // int(exp.right.data)
+            v = 0
+            if exp.right.data != 0:
+                v = exp.left.data // exp.right.data
             return [
-                f"SET {v}",
+                Instr("SET", v),
                 self.c_store(exp.dest, sym_proc),
             ]
         else:
             if exp.right.vType == ValueType.NUM:
-                r = int(exp.right.data)
+                r = exp.right.data
                 if r == 0:
                     return [
-                        "SET 0",
+                        Instr("SET", 0),
                         self.c_store(exp.dest, sym_proc),
                     ]
                 elif r == 1:
@@ -580,7 +809,7 @@ class CProcessor:
                 elif (r & (r - 1)) == 0:
                     t = [self.c_load(exp.left.data, sym_proc)]
                     while r > 1:
-                        t.append("HALF")
+                        t.append(Instr("HALF"))
                         r //= 2
                     t.append(self.c_store(exp.dest, sym_proc))
                     return t
@@ -593,24 +822,24 @@ class CProcessor:
                     back = self.getHelperReg(4)
                     back_label = self.createLabel()
                     return [
-                        f"SET {self.to_label(back_label)}",
-                        f"STORE {back}",
-                        f"SET 0",
-                        f"STORE {q}",
+                        Instr("SET", self.to_label(back_label)),
+                        Instr("STORE", back),
+                        Instr("SET", 0),
+                        Instr("STORE", q),
                         self.c_load(exp.left.data, sym_proc),
-                        f"STORE {rem}",
-                        f"SET {exp.right.data}",
-                        f"STORE {d}",
-                        f"STORE {od}",
-                        f"JUMP {self.to_label(self.getDivLabel())}",
-                        f"LOAD {q} {self.dest_label(back_label)}",
+                        Instr("STORE", rem),
+                        Instr("SET", exp.right.data),
+                        Instr("STORE", d),
+                        Instr("STORE", od),
+                        Instr("JUMP", self.to_label(self.getDivLabel())),
+                        Instr("LOAD", q, back_label),
                         self.c_store(exp.dest, sym_proc),
                     ]
             elif exp.left.vType == ValueType.NUM:
-                l = int(exp.left.data)
+                l = exp.left.data
                 if l == 0:
                     return [
-                        "SET 0",
+                        Instr("SET", 0),
                         self.c_store(exp.dest, sym_proc),
                     ]
                 elif l == 1:
@@ -618,13 +847,13 @@ class CProcessor:
                     skip_label2 = self.createLabel()
                     return [
                         self.c_load(exp.right.data, sym_proc),
-                        f"JZERO {self.to_label(skip_label)}",
-                        "HALF",
-                        f"JPOS {self.to_label(skip_label)}",
-                        "SET 1",
-                        f"JUMP {self.to_label(skip_label2)}",
-                        f"SET 0 {self.dest_label(skip_label)}",
-                        f"{self.c_store(exp.dest, sym_proc)} {self.dest_label(skip_label2)}",
+                        Instr("JZERO", self.to_label(skip_label)),
+                        Instr("HALF"),
+                        Instr("JPOS", self.to_label(skip_label)),
+                        Instr("SET", 1),
+                        Instr("JUMP", self.to_label(skip_label2)),
+                        Instr("SET", 0, skip_label),
+                        self.c_store(exp.dest, sym_proc).mark(skip_label2),
                     ]
                 else:
                     self.__outerDivIsUsed = True
@@ -636,18 +865,18 @@ class CProcessor:
                     back_label = self.createLabel()
                     skip_zero = self.createLabel()
                     return [
-                        f"SET {self.to_label(back_label)}",
-                        f"STORE {back}",
-                        f"SET 0",
-                        f"STORE {q}",
-                        f"SET {l}",
-                        f"STORE {r}",
+                        Instr("SET", self.to_label(back_label)),
+                        Instr("STORE", back),
+                        Instr("SET", 0),
+                        Instr("STORE", q),
+                        Instr("SET", l),
+                        Instr("STORE", r),
                         self.c_load(exp.right.data, sym_proc),
-                        f"JZERO {self.to_label(skip_zero)}",
-                        f"STORE {d}",
-                        f"STORE {od}",
-                        f"JUMP {self.to_label(self.getDivLabel())}",
-                        f"LOAD {q} {self.dest_label(back_label)} {self.dest_label(skip_zero)}",
+                        Instr("JZERO", self.to_label(skip_zero)),
+                        Instr("STORE", d),
+                        Instr("STORE", od),
+                        Instr("JUMP", self.to_label(self.getDivLabel())),
+                        Instr("LOAD", q, back_label, skip_zero),
                         self.c_store(exp.dest, sym_proc),
                     ]
             else:
@@ -660,33 +889,35 @@ class CProcessor:
                 back_label = self.createLabel()
                 skip_zero = self.createLabel()
                 return [
-                    f"SET {self.to_label(back_label)}",
-                    f"STORE {back}",
-                    f"SET 0",
-                    f"STORE {q}",
+                    Instr("SET", self.to_label(back_label)),
+                    Instr("STORE", back),
+                    Instr("SET", 0),
+                    Instr("STORE", q),
                     self.c_load(exp.left.data, sym_proc),
-                    f"STORE {r}",
+                    Instr("STORE", r),
                     self.c_load(exp.right.data, sym_proc),
-                    f"JZERO {self.to_label(skip_zero)}",
-                    f"STORE {d}",
-                    f"STORE {od}",
-                    f"JUMP {self.to_label(self.getDivLabel())}",
-                    f"LOAD {q} {self.dest_label(back_label)} {self.dest_label(skip_zero)}",
+                    Instr("JZERO", self.to_label(skip_zero)),
+                    Instr("STORE", d),
+                    Instr("STORE", od),
+                    Instr("JUMP", self.to_label(self.getDivLabel())),
+                    Instr("LOAD", q, back_label, skip_zero),
                     self.c_store(exp.dest, sym_proc),
                 ]
 
     def b_mod(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            v = int(exp.left.data) % int(exp.right.data)
+            v = 0
+            if exp.right.data != 0:
+                v = exp.left.data % exp.right.data
             return [
-                f"SET {v}",
+                Instr("SET", v),
                 self.c_store(exp.dest, sym_proc),
             ]
         elif exp.right.vType == ValueType.NUM:
-            r = int(exp.right.data)
+            r = exp.right.data
             if r == 0 or r == 1:
                 return [
-                    "SET 0",
+                    Instr("SET", 0),
                     self.c_store(exp.dest, sym_proc),
                 ]
             elif r == 2:
@@ -694,15 +925,15 @@ class CProcessor:
                 skip2 = self.createLabel()
                 return [
                     self.c_load(exp.left.data, sym_proc),
-                    "HALF",
-                    "ADD 0",
-                    f"ADD {self.const_tag(1)}",
+                    Instr("HALF"),
+                    Instr("ADD", 0),
+                    Instr("ADD", self.const_tag(1)),
                     self.c_sub(exp.left.data, sym_proc),
-                    f"JPOS {self.to_label(skip1)}",
-                    "SET 1",
-                    f"JUMP {self.to_label(skip2)}",
-                    f"SET 0 {self.dest_label(skip1)}",
-                    f"{self.c_store(exp.dest, sym_proc)} {self.dest_label(skip2)}",
+                    Instr("JPOS", self.to_label(skip1)),
+                    Instr("SET", 1),
+                    Instr("JUMP", self.to_label(skip2)),
+                    Instr("SET", 0, skip1),
+                    self.c_store(exp.dest, sym_proc).mark(skip2),
                 ]
             else:
                 if self.__no_divs == 0:
@@ -714,15 +945,15 @@ class CProcessor:
                     back = self.getHelperReg(4)
                     back_label = self.createLabel()
                     return [
-                        f"SET {self.to_label(back_label)}",
-                        f"STORE {back}",
+                        Instr("SET", self.to_label(back_label)),
+                        Instr("STORE", back),
                         self.c_load(exp.left.data, sym_proc),
-                        f"STORE {rem}",
-                        f"SET {r}",
-                        f"STORE {d}",
-                        f"STORE {od}",
-                        f"JUMP {self.to_label(self.getModLabel())}",
-                        f"{self.c_store(exp.dest, sym_proc)} {self.dest_label(back_label)}",
+                        Instr("STORE", rem),
+                        Instr("SET", r),
+                        Instr("STORE", d),
+                        Instr("STORE", od),
+                        Instr("JUMP", self.to_label(self.getModLabel())),
+                        self.c_store(exp.dest, sym_proc).mark(back_label),
                     ]
                 else:
                     self.__outerDivIsUsed = True
@@ -733,22 +964,22 @@ class CProcessor:
                     back = self.getHelperReg(4)
                     back_label = self.createLabel()
                     return [
-                        f"SET {self.to_label(back_label)}",
-                        f"STORE {back}",  # q not set
+                        Instr("SET", self.to_label(back_label)),
+                        Instr("STORE", back),  # q not set
                         self.c_load(exp.left.data, sym_proc),
-                        f"STORE {rem}",
-                        f"SET {exp.right.data}",
-                        f"STORE {d}",
-                        f"STORE {od}",
-                        f"JUMP {self.to_label(self.getDivLabel())}",
-                        f"LOAD {rem} {self.dest_label(back_label)}",
+                        Instr("STORE", rem),
+                        Instr("SET", exp.right.data),
+                        Instr("STORE", d),
+                        Instr("STORE", od),
+                        Instr("JUMP", self.to_label(self.getDivLabel())),
+                        Instr("LOAD", rem, back_label),
                         self.c_store(exp.dest, sym_proc),
                     ]
         elif exp.left.vType == ValueType.NUM:
-            l = int(exp.left.data)
+            l = exp.left.data
             if l == 0:
                 return [
-                    "SET 0",
+                    Instr("SET", 0),
                     self.c_store(exp.dest, sym_proc),
                 ]
             else:
@@ -762,16 +993,16 @@ class CProcessor:
                     back_label = self.createLabel()
                     skip_zero = self.createLabel()
                     return [
-                        f"SET {self.to_label(back_label)}",
-                        f"STORE {back}",
-                        f"SET {l}",
-                        f"STORE {rem}",
+                        Instr("SET", self.to_label(back_label)),
+                        Instr("STORE", back),
+                        Instr("SET", l),
+                        Instr("STORE", rem),
                         self.c_load(exp.right.data, sym_proc),
-                        f"JZERO {self.to_label(skip_zero)}",
-                        f"STORE {d}",
-                        f"STORE {od}",
-                        f"JUMP {self.to_label(self.getModLabel())}",
-                        f"{self.c_store(exp.dest, sym_proc)} {self.dest_label(back_label)} {self.dest_label(skip_zero)}",
+                        Instr("JZERO", self.to_label(skip_zero)),
+                        Instr("STORE", d),
+                        Instr("STORE", od),
+                        Instr("JUMP", self.to_label(self.getModLabel())),
+                        self.c_store(exp.dest, sym_proc).mark(back_label, skip_zero),
                     ]
                 else:
                     self.__outerDivIsUsed = True
@@ -783,17 +1014,17 @@ class CProcessor:
                     back_label = self.createLabel()
                     skip_zero = self.createLabel()
                     return [
-                        f"SET {self.to_label(back_label)}",
-                        f"STORE {back}",  # q not set
-                        f"SET {l}",
-                        f"STORE {rem}",
+                        Instr("SET", self.to_label(back_label)),
+                        Instr("STORE", back),  # q not set
+                        Instr("SET", l),
+                        Instr("STORE", rem),
                         self.c_load(exp.right.data, sym_proc),
-                        f"JZERO {self.to_label(skip_zero)}",
-                        f"STORE {d}",
-                        f"STORE {od}",
-                        f"JUMP {self.to_label(self.getDivLabel())}",
-                        f"LOAD {rem} {self.dest_label(back_label)}",
-                        f"{self.c_store(exp.dest, sym_proc)} {self.dest_label(skip_zero)}",
+                        Instr("JZERO", self.to_label(skip_zero)),
+                        Instr("STORE", d),
+                        Instr("STORE", od),
+                        Instr("JUMP", self.to_label(self.getDivLabel())),
+                        Instr("LOAD", rem, back_label),
+                        self.c_store(exp.dest, sym_proc).mark(skip_zero),
                     ]
         else:
             if self.__no_divs == 0:
@@ -806,16 +1037,16 @@ class CProcessor:
                 back_label = self.createLabel()
                 skip_zero = self.createLabel()
                 return [
-                    f"SET {self.to_label(back_label)}",
-                    f"STORE {back}",
+                    Instr("SET", self.to_label(back_label)),
+                    Instr("STORE", back),
                     self.c_load(exp.left.data, sym_proc),
-                    f"STORE {rem}",
+                    Instr("STORE", rem),
                     self.c_load(exp.right.data, sym_proc),
-                    f"JZERO {self.to_label(skip_zero)}",
-                    f"STORE {d}",
-                    f"STORE {od}",
-                    f"JUMP {self.to_label(self.getModLabel())}",
-                    f"{self.c_store(exp.dest, sym_proc)} {self.dest_label(back_label)} {self.dest_label(skip_zero)}",
+                    Instr("JZERO", self.to_label(skip_zero)),
+                    Instr("STORE", d),
+                    Instr("STORE", od),
+                    Instr("JUMP", self.to_label(self.getModLabel())),
+                    self.c_store(exp.dest, sym_proc).mark(back_label, skip_zero),
                 ]
             else:
                 self.__outerDivIsUsed = True
@@ -827,17 +1058,17 @@ class CProcessor:
                 back_label = self.createLabel()
                 skip_zero = self.createLabel()
                 return [
-                    f"SET {self.to_label(back_label)}",
-                    f"STORE {back}",  # q not set
+                    Instr("SET", self.to_label(back_label)),
+                    Instr("STORE", back),  # q not set
                     self.c_load(exp.left.data, sym_proc),
-                    f"STORE {rem}",
+                    Instr("STORE", rem),
                     self.c_load(exp.right.data, sym_proc),
-                    f"JZERO {self.to_label(skip_zero)}",
-                    f"STORE {d}",
-                    f"STORE {od}",
-                    f"JUMP {self.to_label(self.getDivLabel())}",
-                    f"LOAD {rem} {self.dest_label(back_label)}",
-                    f"{self.c_store(exp.dest, sym_proc)} {self.dest_label(skip_zero)}",
+                    Instr("JZERO", self.to_label(skip_zero)),
+                    Instr("STORE", d),
+                    Instr("STORE", od),
+                    Instr("JUMP", self.to_label(self.getDivLabel())),
+                    Instr("LOAD", rem, back_label),
+                    self.c_store(exp.dest, sym_proc).mark(skip_zero),
                 ]
 
     # result in p_0; a in p_0, b in helper regs 1; back in reg 3
@@ -851,24 +1082,30 @@ class CProcessor:
         ret = self.getHelperReg(2)
         back = self.getHelperReg(3)
         return [
-            f"JZERO {self.to_label(label_fin)} {self.dest_label(label_back)} {self.dest_label(self.getMulLabel())} [mul]",
-            f"STORE {h1}",
-            "HALF",
-            "ADD 0",
-            f"ADD {one}",
-            f"SUB {h1}",
-            f"JPOS {self.to_label(label_skip)}",
-            f"LOAD {h0}",
-            f"ADD {ret}",
-            f"STORE {ret}",
-            f"LOAD {h0} {self.dest_label(label_skip)}",
-            "ADD 0",
-            f"STORE {h0}",
-            f"LOAD {h1}",
-            "HALF",
-            f"JUMP {self.to_label(label_back)}",
-            f"LOAD {ret} {self.dest_label(label_fin)}",
-            f"JUMPI {back}",
+            Instr(
+                "JZERO",
+                self.to_label(label_fin),
+                label_back,
+                self.getMulLabel(),
+                comment="mul",
+            ),
+            Instr("STORE", h1),
+            Instr("HALF"),
+            Instr("ADD", 0),
+            Instr("ADD", one),
+            Instr("SUB", h1),
+            Instr("JPOS", self.to_label(label_skip)),
+            Instr("LOAD", h0),
+            Instr("ADD", ret),
+            Instr("STORE", ret),
+            Instr("LOAD", h0, label_skip),
+            Instr("ADD", 0),
+            Instr("STORE", h0),
+            Instr("LOAD", h1),
+            Instr("HALF"),
+            Instr("JUMP", self.to_label(label_back)),
+            Instr("LOAD", ret, label_fin),
+            Instr("JUMPI", back),
         ]
 
     def outer_div(self):
@@ -883,33 +1120,33 @@ class CProcessor:
         out2 = self.createLabel()
         skip1 = self.createLabel()
         return [
-            f"ADD 0 {self.dest_label(loop1)} {self.dest_label(self.getDivLabel())} [div]",
-            f"SUB {r}",
-            f"JPOS {self.to_label(out1)}",
-            f"LOAD {d}",
-            "ADD 0",
-            f"STORE {d}",
-            f"JUMP {self.to_label(loop1)}",
-            f"LOAD {d} {self.dest_label(out1)} {self.dest_label(loop2)}",
-            f"SUB {r}",
-            f"JPOS {self.to_label(skip1)}",
-            f"LOAD {q}",
-            f"ADD {self.const_tag(1)}",
-            f"STORE {q}",
-            f"LOAD {r}",
-            f"SUB {d}",
-            f"STORE {r}",
-            f"LOAD {d} {self.dest_label(skip1)}",
-            "HALF",
-            f"STORE {d}",
-            f"LOAD {od}",
-            f"SUB {d}",
-            f"JPOS {self.to_label(out2)}",
-            f"LOAD {q}",
-            "ADD 0",
-            f"STORE {q}",
-            f"JUMP {self.to_label(loop2)}",
-            f"JUMPI {back} {self.dest_label(out2)}",
+            Instr("ADD", 0, loop1, self.getDivLabel(), comment="div"),
+            Instr("SUB", r),
+            Instr("JPOS", self.to_label(out1)),
+            Instr("LOAD", d),
+            Instr("ADD", 0),
+            Instr("STORE", d),
+            Instr("JUMP", self.to_label(loop1)),
+            Instr("LOAD", d, out1, loop2),
+            Instr("SUB", r),
+            Instr("JPOS", self.to_label(skip1)),
+            Instr("LOAD", q),
+            Instr("ADD", self.const_tag(1)),
+            Instr("STORE", q),
+            Instr("LOAD", r),
+            Instr("SUB", d),
+            Instr("STORE", r),
+            Instr("LOAD", d, skip1),
+            Instr("HALF"),
+            Instr("STORE", d),
+            Instr("LOAD", od),
+            Instr("SUB", d),
+            Instr("JPOS", self.to_label(out2)),
+            Instr("LOAD", q),
+            Instr("ADD", 0),
+            Instr("STORE", q),
+            Instr("JUMP", self.to_label(loop2)),
+            Instr("JUMPI", back, out2),
         ]
 
     # reminder in p_0
@@ -925,28 +1162,28 @@ class CProcessor:
         out2 = self.createLabel()
         skip1 = self.createLabel()
         return [
-            f"ADD 0 {self.dest_label(loop1)} {self.dest_label(self.getModLabel())} [mod]",
-            f"SUB {r}",
-            f"JPOS {self.to_label(out1)}",
-            f"LOAD {d}",
-            "ADD 0",
-            f"STORE {d}",
-            f"JUMP {self.to_label(loop1)}",
-            f"LOAD {d} {self.dest_label(out1)} {self.dest_label(loop2)}",
-            f"SUB {r}",
-            f"JPOS {self.to_label(skip1)}",
-            f"LOAD {r}",
-            f"SUB {d}",
-            f"STORE {r}",
-            f"LOAD {d} {self.dest_label(skip1)}",
-            "HALF",
-            f"STORE {d}",
-            f"LOAD {od}",
-            f"SUB {d}",
-            f"JPOS {self.to_label(out2)}",
-            f"JUMP {self.to_label(loop2)}",
-            f"LOAD {r} {self.dest_label(out2)}",
-            f"JUMPI {back}",
+            Instr("ADD", 0, loop1, self.getModLabel(), comment="mod"),
+            Instr("SUB", r),
+            Instr("JPOS", self.to_label(out1)),
+            Instr("LOAD", d),
+            Instr("ADD", 0),
+            Instr("STORE", d),
+            Instr("JUMP", self.to_label(loop1)),
+            Instr("LOAD", d, out1, loop2),
+            Instr("SUB", r),
+            Instr("JPOS", self.to_label(skip1)),
+            Instr("LOAD", r),
+            Instr("SUB", d),
+            Instr("STORE", r),
+            Instr("LOAD", d, skip1),
+            Instr("HALF"),
+            Instr("STORE", d),
+            Instr("LOAD", od),
+            Instr("SUB", d),
+            Instr("JPOS", self.to_label(out2)),
+            Instr("JUMP", self.to_label(loop2)),
+            Instr("LOAD", r, out2),
+            Instr("JUMPI", back),
         ]
 
     def b_cond(self, dest, exp: "ExpObject", sym_proc):
@@ -954,14 +1191,14 @@ class CProcessor:
             if self.__loop_depth == 0:
                 raise Exception(f"Uninitialized variable {exp.left.data}")
             else:
-                print(f"WARINIG: {exp.left.data} may be used before set")
+                self.warn(f"WARINIG: {exp.left.data} may be used before set")
         if exp.right.vType == ValueType.VAR and (
             not sym_proc.check_ivar(exp.right.data)
         ):
             if self.__loop_depth == 0:
                 raise Exception(f"Uninitialized variable {exp.right.data}")
             else:
-                print(f"WARINIG: {exp.right.data} may be used before set")
+                self.warn(f"WARINIG: {exp.right.data} may be used before set")
         exp.dest = self.to_label(dest)
         if exp.oType == OpType.EQ:
             return self.b_eq(exp, sym_proc)
@@ -979,17 +1216,17 @@ class CProcessor:
     # jeśli fałsz: jump do dest (poza instrukcją warunkową); jeśli prawda: nic
     def b_eq(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            if int(exp.left.data) == int(exp.right.data):
+            if exp.left.data == exp.right.data:
                 return ([], 1)
             else:
                 return ([], 0)
         elif exp.left.vType == ValueType.NUM:
-            l = int(exp.left.data)
+            l = exp.left.data
             if l == 0:
                 return (
                     [
                         self.c_load(exp.right.data, sym_proc),
-                        f"JPOS {exp.dest}",
+                        Instr("JPOS", exp.dest),
                     ],
                     -1,
                 )
@@ -997,21 +1234,21 @@ class CProcessor:
             return (
                 [
                     self.c_load(exp.right.data, sym_proc),
-                    f"SUB {i}",
-                    f"JPOS {exp.dest}",
-                    f"LOAD {i}",
+                    Instr("SUB", i),
+                    Instr("JPOS", exp.dest),
+                    Instr("LOAD", i),
                     self.c_sub(exp.right.data, sym_proc),
-                    f"JPOS {exp.dest}",
+                    Instr("JPOS", exp.dest),
                 ],
                 -1,
             )
         elif exp.right.vType == ValueType.NUM:
-            r = int(exp.right.data)
+            r = exp.right.data
             if r == 0:
                 return (
                     [
                         self.c_load(exp.left.data, sym_proc),
-                        f"JPOS {exp.dest}",
+                        Instr("JPOS", exp.dest),
                     ],
                     -1,
                 )
@@ -1019,11 +1256,11 @@ class CProcessor:
             return (
                 [
                     self.c_load(exp.left.data, sym_proc),
-                    f"SUB {i}",
-                    f"JPOS {exp.dest}",
-                    f"LOAD {i}",
+                    Instr("SUB", i),
+                    Instr("JPOS", exp.dest),
+                    Instr("LOAD", i),
                     self.c_sub(exp.left.data, sym_proc),
-                    f"JPOS {exp.dest}",
+                    Instr("JPOS", exp.dest),
                 ],
                 -1,
             )
@@ -1032,27 +1269,27 @@ class CProcessor:
                 [
                     self.c_load(exp.left.data, sym_proc),
                     self.c_sub(exp.right.data, sym_proc),
-                    f"JPOS {exp.dest}",
+                    Instr("JPOS", exp.dest),
                     self.c_load(exp.right.data, sym_proc),
                     self.c_sub(exp.left.data, sym_proc),
-                    f"JPOS {exp.dest}",
+                    Instr("JPOS", exp.dest),
                 ],
                 -1,
             )
 
     def b_neq(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            if int(exp.left.data) == int(exp.right.data):
+            if exp.left.data == exp.right.data:
                 return ([], 0)
             else:
                 return ([], 1)
         elif exp.left.vType == ValueType.NUM:
-            l = int(exp.left.data)
+            l = exp.left.data
             if l == 0:
                 return (
                     [
                         self.c_load(exp.right.data, sym_proc),
-                        f"JZERO {exp.dest}",
+                        Instr("JZERO", exp.dest),
                     ],
                     -1,
                 )
@@ -1061,21 +1298,21 @@ class CProcessor:
             return (
                 [
                     self.c_load(exp.right.data, sym_proc),
-                    f"SUB {i}",
-                    f"JPOS {self.to_label_next(true_label)}",
-                    f"LOAD {i}",
+                    Instr("SUB", i),
+                    Instr("JPOS", self.to_label_next(true_label)),
+                    Instr("LOAD", i),
                     self.c_sub(exp.right.data, sym_proc),
-                    f"JZERO {exp.dest} {self.dest_label(true_label)}",
+                    Instr("JZERO", exp.dest, true_label),
                 ],
                 -1,
             )
         elif exp.right.vType == ValueType.NUM:
-            r = int(exp.right.data)
+            r = exp.right.data
             if r == 0:
                 return (
                     [
                         self.c_load(exp.left.data, sym_proc),
-                        f"JZERO {exp.dest}",
+                        Instr("JZERO", exp.dest),
                     ],
                     -1,
                 )
@@ -1084,11 +1321,11 @@ class CProcessor:
             return (
                 [
                     self.c_load(exp.left.data, sym_proc),
-                    f"SUB {i}",
-                    f"JPOS {self.to_label_next(true_label)}",
-                    f"LOAD {i}",
+                    Instr("SUB", i),
+                    Instr("JPOS", self.to_label_next(true_label)),
+                    Instr("LOAD", i),
                     self.c_sub(exp.left.data, sym_proc),
-                    f"JZERO {exp.dest} {self.dest_label(true_label)}",
+                    Instr("JZERO", exp.dest, true_label),
                 ],
                 -1,
             )
@@ -1098,47 +1335,47 @@ class CProcessor:
                 [
                     self.c_load(exp.left.data, sym_proc),
                     self.c_sub(exp.right.data, sym_proc),
-                    f"JPOS {self.to_label_next(true_label)}",
+                    Instr("JPOS", self.to_label_next(true_label)),
                     self.c_load(exp.right.data, sym_proc),
                     self.c_sub(exp.left.data, sym_proc),
-                    f"JZERO {exp.dest} {self.dest_label(true_label)}",
+                    Instr("JZERO", exp.dest, true_label),
                 ],
                 -1,
             )
 
     def b_gt(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            if int(exp.left.data) > int(exp.right.data):
+            if exp.left.data > exp.right.data:
                 return ([], 1)
             else:
                 return ([], 0)
         elif exp.left.vType == ValueType.NUM:
-            l = int(exp.left.data)
+            l = exp.left.data
             if l == 0:
                 return ([], 0)
             if l == 1:
                 return (
                     [
                         self.c_load(exp.right.data, sym_proc),
-                        f"JPOS {exp.dest}",
+                        Instr("JPOS", exp.dest),
                     ],
                     -1,
                 )
             return (
                 [
-                    f"SET {l}",
+                    Instr("SET", l),
                     self.c_sub(exp.right.data, sym_proc),
-                    f"JZERO {exp.dest}",
+                    Instr("JZERO", exp.dest),
                 ],
                 -1,
             )
         elif exp.right.vType == ValueType.NUM:
-            r = int(exp.right.data)
+            r = exp.right.data
             if r == 0:
                 return (
                     [
                         self.c_load(exp.left.data, sym_proc),
-                        f"JZERO {exp.dest}",
+                        Instr("JZERO", exp.dest),
                     ],
                     -1,
                 )
@@ -1146,8 +1383,8 @@ class CProcessor:
             return (
                 [
                     self.c_load(exp.left.data, sym_proc),
-                    f"SUB {i}",
-                    f"JZERO {exp.dest}",
+                    Instr("SUB", i),
+                    Instr("JZERO", exp.dest),
                 ],
                 -1,
             )
@@ -1156,24 +1393,24 @@ class CProcessor:
                 [
                     self.c_load(exp.left.data, sym_proc),
                     self.c_sub(exp.right.data, sym_proc),
-                    f"JZERO {exp.dest}",
+                    Instr("JZERO", exp.dest),
                 ],
                 -1,
             )
 
     def b_lt(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            if int(exp.left.data) < int(exp.right.data):
+            if exp.left.data < exp.right.data:
                 return ([], 1)
             else:
                 return ([], 0)
         elif exp.left.vType == ValueType.NUM:
-            l = int(exp.left.data)
+            l = exp.left.data
             if l == 0:
                 return (
                     [
                         self.c_load(exp.right.data, sym_proc),
-                        f"JZERO {exp.dest}",
+                        Instr("JZERO", exp.dest),
                     ],
                     -1,
                 )
@@ -1181,28 +1418,28 @@ class CProcessor:
             return (
                 [
                     self.c_load(exp.right.data, sym_proc),
-                    f"SUB {i}",
-                    f"JZERO {exp.dest}",
+                    Instr("SUB", i),
+                    Instr("JZERO", exp.dest),
                 ],
                 -1,
             )
         elif exp.right.vType == ValueType.NUM:
-            r = int(exp.right.data)
+            r = exp.right.data
             if r == 0:
                 return ([], 0)
             if r == 1:
                 return (
                     [
                         self.c_load(exp.left.data, sym_proc),
-                        f"JPOS {exp.dest}",
+                        Instr("JPOS", exp.dest),
                     ],
                     -1,
                 )
             return (
                 [
-                    f"SET {r}",
+                    Instr("SET", r),
                     self.c_sub(exp.left.data, sym_proc),
-                    f"JZERO {exp.dest}",
+                    Instr("JZERO", exp.dest),
                 ],
                 -1,
             )
@@ -1211,24 +1448,24 @@ class CProcessor:
                 [
                     self.c_load(exp.right.data, sym_proc),
                     self.c_sub(exp.left.data, sym_proc),
-                    f"JZERO {exp.dest}",
+                    Instr("JZERO", exp.dest),
                 ],
                 -1,
             )
 
     def b_ge(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            if int(exp.left.data) >= int(exp.right.data):
+            if exp.left.data >= exp.right.data:
                 return ([], 1)
             else:
                 return ([], 0)
         elif exp.left.vType == ValueType.NUM:
-            l = int(exp.left.data)
+            l = exp.left.data
             if l == 0:
                 return (
                     [
                         self.c_load(exp.right.data, sym_proc),
-                        f"JPOS {exp.dest}",
+                        Instr("JPOS", exp.dest),
                     ],
                     -1,
                 )
@@ -1236,28 +1473,28 @@ class CProcessor:
             return (
                 [
                     self.c_load(exp.right.data, sym_proc),
-                    f"SUB {i}",
-                    f"JPOS {exp.dest}",
+                    Instr("SUB", i),
+                    Instr("JPOS", exp.dest),
                 ],
                 -1,
             )
         elif exp.right.vType == ValueType.NUM:
-            r = int(exp.right.data)
+            r = exp.right.data
             if r == 0:
                 return ([], 1)
             if r == 1:
                 return (
                     [
                         self.c_load(exp.left.data, sym_proc),
-                        f"JZERO {exp.dest}",
+                        Instr("JZERO", exp.dest),
                     ],
                     -1,
                 )
             return (
                 [
-                    f"SET {r}",
+                    Instr("SET", r),
                     self.c_sub(exp.left.data, sym_proc),
-                    f"JPOS {exp.dest}",
+                    Instr("JPOS", exp.dest),
                 ],
                 -1,
             )
@@ -1266,44 +1503,44 @@ class CProcessor:
                 [
                     self.c_load(exp.right.data, sym_proc),
                     self.c_sub(exp.left.data, sym_proc),
-                    f"JPOS {exp.dest}",
+                    Instr("JPOS", exp.dest),
                 ],
                 -1,
             )
 
     def b_le(self, exp: "ExpObject", sym_proc):
         if exp.left.vType == ValueType.NUM and exp.right.vType == ValueType.NUM:
-            if int(exp.left.data) <= int(exp.right.data):
+            if exp.left.data <= exp.right.data:
                 return ([], 1)
             else:
                 return ([], 0)
         elif exp.left.vType == ValueType.NUM:
-            l = int(exp.left.data)
+            l = exp.left.data
             if l == 0:
                 return ([], 1)
             if l == 1:
                 return (
                     [
                         self.c_load(exp.right.data, sym_proc),
-                        f"JZERO {exp.dest}",
+                        Instr("JZERO", exp.dest),
                     ],
                     -1,
                 )
             return (
                 [
-                    f"SET {l}",
+                    Instr("SET", l),
                     self.c_sub(exp.right.data, sym_proc),
-                    f"JPOS {exp.dest}",
+                    Instr("JPOS", exp.dest),
                 ],
                 -1,
             )
         elif exp.right.vType == ValueType.NUM:
-            r = int(exp.right.data)
+            r = exp.right.data
             if r == 0:
                 return (
                     [
                         self.c_load(exp.left.data, sym_proc),
-                        f"JPOS {exp.dest}",
+                        Instr("JPOS", exp.dest),
                     ],
                     -1,
                 )
@@ -1311,8 +1548,8 @@ class CProcessor:
             return (
                 [
                     self.c_load(exp.left.data, sym_proc),
-                    f"SUB{i}",
-                    f"JPOS {exp.dest}",
+                    Instr("SUB", i),
+                    Instr("JPOS", exp.dest),
                 ],
                 -1,
             )
@@ -1321,7 +1558,7 @@ class CProcessor:
                 [
                     self.c_load(exp.left.data, sym_proc),
                     self.c_sub(exp.right.data, sym_proc),
-                    f"JPOS {exp.dest}",
+                    Instr("JPOS", exp.dest),
                 ],
                 -1,
             )
@@ -1335,86 +1572,62 @@ class CProcessor:
         tlabel = self.createLabel()
         return [("#ife", flabel, tlabel, cond, cmdst, cmdsf)]
 
-    def b_if(self, flabel, cond, cmds, sym_proc):
+    # the b_ statements with a block put their code into out and return the
+    # blocks still to be compiled as (commands, destination, is loop body);
+    # process_list_inner compiles them in order
+    def b_if(self, flabel, cond, cmds, out, sym_proc):
         cond_code, cond_stat = self.b_cond(flabel, cond, sym_proc)
         if cond_stat == 0:
             return []
         elif cond_stat == 1:
-            return self.process_list_inner(cmds, sym_proc)
+            return [(cmds, out, False)]
         else:
-            return [("#if", flabel, cond_code, self.process_list_inner(cmds, sym_proc))]
+            block = []
+            out.append(("#if", flabel, cond_code, block))
+            return [(cmds, block, False)]
 
-    def b_ife(self, flabel, tlabel, cond, cmdst, cmdsf, sym_proc):
+    def b_ife(self, flabel, tlabel, cond, cmdst, cmdsf, out, sym_proc):
         cond_code, cond_stat = self.b_cond(flabel, cond, sym_proc)
         if cond_stat == 0:
-            return self.process_list_inner(cmdsf, sym_proc)
+            return [(cmdsf, out, False)]
         elif cond_stat == 1:
-            return self.process_list_inner(cmdst, sym_proc)
+            return [(cmdst, out, False)]
         else:
-            return [
-                (
-                    "#ife",
-                    flabel,
-                    tlabel,
-                    cond_code,
-                    self.process_list_inner(cmdst, sym_proc),
-                    self.process_list_inner(cmdsf, sym_proc),
-                )
-            ]
+            tblock = []
+            fblock = []
+            out.append(("#ife", flabel, tlabel, cond_code, tblock, fblock))
+            return [(cmdst, tblock, False), (cmdsf, fblock, False)]
 
     def a_while(self, cond, cmds):
         flabel = self.createLabel()
         blabel = self.createLabel()
         return [("#while", flabel, blabel, cond, cmds)]
 
-    def b_while(self, flabel, blabel, cond, cmds, sym_proc):
+    def b_while(self, flabel, blabel, cond, cmds, out, sym_proc):
         cond_code, cond_stat = self.b_cond(flabel, cond, sym_proc)
         if cond_stat == 0:
             return []
-        elif cond_stat == 1:
-            self.__loop_depth += 1
-            t = [("#inf", blabel, self.process_list_inner(cmds, sym_proc), sym_proc)]
-            self.__loop_depth -= 1
-            return t
+        block = []
+        if cond_stat == 1:
+            out.append(("#inf", blabel, block, sym_proc))
         else:
-            self.__loop_depth += 1
-            t = [
-                (
-                    "#while",
-                    flabel,
-                    blabel,
-                    cond_code,
-                    self.process_list_inner(cmds, sym_proc),
-                )
-            ]
-            self.__loop_depth -= 1
-            return t
+            out.append(("#while", flabel, blabel, cond_code, block))
+        return [(cmds, block, True)]
 
     def a_until(self, cond, cmds):
         flabel = self.createLabel()
         return [("#until", flabel, cond, cmds)]
 
-    def b_until(self, flabel, cond, cmds, sym_proc):
+    def b_until(self, flabel, cond, cmds, out, sym_proc):
         cond_code, cond_stat = self.b_cond(flabel, cond, sym_proc)
+        if cond_stat == 1:
+            return [(cmds, out, False)]
+        block = []
         if cond_stat == 0:
-            self.__loop_depth += 1
-            t = [("#inf", flabel, self.process_list_inner(cmds, sym_proc), sym_proc)]
-            self.__loop_depth -= 1
-            return t
-        elif cond_stat == 1:
-            return self.process_list_inner(cmds, sym_proc)
+            out.append(("#inf", flabel, block, sym_proc))
         else:
-            self.__loop_depth += 1
-            t = [
-                (
-                    "#until",
-                    flabel,
-                    cond_code,
-                    self.process_list_inner(cmds, sym_proc),
-                )
-            ]
-            self.__loop_depth -= 1
-            return t
+            out.append(("#until", flabel, cond_code, block))
+        return [(cmds, block, True)]
 
     def a_proc(self, id, refs):
         if id not in self.symbols_proc:
@@ -1423,7 +1636,6 @@ class CProcessor:
         return [("#proc", id, blabel, refs)]
 
     def b_proc(self, id, blabel, refs, sym_proc):
-        self.symbols_proc[id].call()
         code = []
         proc = self.symbols_proc[id]
         for idx, r in enumerate(refs):
@@ -1431,61 +1643,698 @@ class CProcessor:
             if not sym_proc.touch_var(r):
                 raise Exception(f"Unknown variable {r}")
             if sym_proc.get_var(r).mode == Mode.VAR:
-                code.append(f"SET {sym_proc.get_var(r).address}")
-                code.append(f"STORE {proc.params[idx].address}")
+                code.append(Instr("SET", sym_proc.get_var(r).address))
+                code.append(Instr("STORE", proc.params[idx].address))
             else:
-                code.append(f"LOAD {sym_proc.get_var(r).address}")
-                code.append(f"STORE {proc.params[idx].address}")
-        code.append(f"SET {self.to_label(blabel)}")
-        code.append(f"STORE {proc.getBackAdd()}")
-        code.append(f"JUMP {self.to_label(proc.getLabel())}")
+                code.append(Instr("LOAD", sym_proc.get_var(r).address))
+                code.append(Instr("STORE", proc.params[idx].address))
+        code.append(Instr("SET", self.to_label(blabel)))
+        code.append(Instr("STORE", proc.getBackAdd()))
+        code.append(Instr("JUMP", self.to_label(proc.getLabel())))
         return [("#proc", blabel, code)]
 
+    # the arguments of an inlined call are set as b_proc would set them
+    def b_touch(self, refs, sym_proc):
+        for r in refs:
+            if not sym_proc.touch_var(r):
+                raise Exception(f"Unknown variable {r}")
+        return []
+
     #!parse
+    # inline
+    # a call is replaced by a copy of the body of its procedure, parameters
+    # renamed to the arguments and locals to "proc.name" variables of the
+    # caller, behind a #touch of the arguments. Procedures are taken in
+    # declaration order, so their own calls are already inlined. A single
+    # call is always inlined, others deepest loop first while the body is
+    # not bigger than what the call costs or fits the limit of its loop
+    # depth and the growth left in the inline_growth budget
+    def inline_procedures(self, procedures, main):
+        sites = {}
+        depth = {}
+        bodies = dict(procedures)
+        bodies[main[0]] = main[1]
+        total = self.h_call_sites(main[1], "main", sites, depth)
+        for name, _ in reversed(procedures):
+            if name in sites:
+                total += self.h_call_sites(bodies[name], name, sites, depth)
+        budget = total * self.inline_growth // 100
+        for name, body in procedures:
+            proc = self.symbols_proc[name]
+            calls = [
+                site
+                for site in sites.get(name, ())
+                if self.h_can_inline(proc, site[1], self.symbols_proc[site[2]])
+            ]
+            if not calls or not self.h_inlinable(proc, body):
+                continue
+            size = sum(map(len, self.h_blocks(body)))
+            growth = size - len(proc.params) - 2
+            chosen = []
+            if len(calls) == len(sites[name]) == 1:
+                chosen = calls
+            else:
+                calls.sort(key=lambda site: -depth[id(site[0])])
+                for site in calls:
+                    d = min(depth[id(site[0])], 3)
+                    if growth <= 0:
+                        chosen.append(site)
+                    elif size <= self.__inline_size << 2 * d and growth <= budget:
+                        chosen.append(site)
+                        budget -= growth
+                if len(chosen) == len(sites[name]):
+                    budget += size
+            copies = {}
+            for site in chosen:
+                copies[id(site[1])] = self.h_inline_call(proc, body, site)
+            for block in {id(site[0]): site[0] for site in chosen}.values():
+                block[:] = itertools.chain.from_iterable(
+                    copies.get(id(line), (line,)) for line in block
+                )
+            if chosen:
+                self.__inlined[name] = len(chosen)
+
+    # (block, call, caller) of every call in l by callee, the loop depth of
+    # every block in depth; returns the number of statements
+    def h_call_sites(self, l, caller, sites, depth):
+        depth[id(l)] = 0
+        size = 0
+        for block in self.h_blocks(l):
+            d = depth[id(block)]
+            size += len(block)
+            for line in block:
+                kind = line[0]
+                if kind == "#proc":
+                    sites.setdefault(line[1], []).append((block, line, caller))
+                elif kind == "#if":
+                    depth[id(line[3])] = d
+                elif kind == "#ife":
+                    depth[id(line[4])] = d
+                    depth[id(line[5])] = d
+                elif kind == "#while":
+                    depth[id(line[4])] = d + 1
+                elif kind == "#until":
+                    depth[id(line[3])] = d + 1
+        return size
+
+    # the arguments of the call are declared and match the parameters
+    def h_can_inline(self, proc, line, caller):
+        refs = line[3]
+        if len(refs) != len(proc.params):
+            return False
+        return all(r in caller.symbols for r in refs)
+
+    # the body compiles without a warning or an error: every name is
+    # declared, every call is allowed and every local is set before it is
+    # read, in the order the statements are compiled and on every path; so
+    # its copies need neither the values of earlier calls nor the checks
+    def h_inlinable(self, proc, body):
+        symbols = proc.symbols
+        done = {name for name, var in symbols.items() if var.mode == Mode.REF}
+        stack = [iter(body)]
+        while stack:
+            for line in stack[-1]:
+                kind = line[0]
+                (reads, sets, blocks) = ((), (), ())
+                if kind == "#assign":
+                    (reads, sets) = (self.h_names(line[2]), (line[1],))
+                elif kind == "#read":
+                    sets = (line[1],)
+                elif kind == "#write":
+                    reads = self.h_names(line[1])
+                elif kind == "#proc" or kind == "#touch":
+                    sets = line[3] if kind == "#proc" else line[1]
+                    if kind == "#proc":
+                        callee = self.symbols_proc[line[1]]
+                        if not proc.canCall(callee) or len(sets) != len(callee.params):
+                            return False
+                elif kind == "#if":
+                    (reads, blocks) = (self.h_names(line[2]), (line[3],))
+                elif kind == "#ife":
+                    (reads, blocks) = (self.h_names(line[3]), (line[5], line[4]))
+                elif kind == "#while":
+                    (reads, blocks) = (self.h_names(line[3]), (line[4],))
+                elif kind == "#until":
+                    (reads, blocks) = (self.h_names(line[2]), (line[3],))
+                for name in reads:
+                    if name not in done:
+                        return False
+                for name in sets:
+                    if name not in symbols:
+                        return False
+                    done.add(name)
+                if blocks:
+                    stack.extend(map(iter, blocks))
+                    break
+            else:
+                stack.pop()
+        bits = self.h_var_bits(proc)
+        summaries = self.h_summaries(self.h_blocks(body), bits)
+        return summaries[id(body)][0] == 0
+
+    # the statements taking the place of the call of site
+    def h_inline_call(self, proc, body, site):
+        (_, line, caller_name) = site
+        caller = self.symbols_proc[caller_name]
+        prefix = proc.getName() + "."
+        names = {}
+        for name, var in proc.symbols.items():
+            if var.mode == Mode.REF:
+                idx = next(i for i, param in enumerate(proc.params) if param is var)
+                names[name] = line[3][idx]
+            else:
+                names[name] = prefix + name
+                if prefix + name not in caller.symbols:
+                    caller.symbols[prefix + name] = Variable(None, Mode.VAR)
+        code = [("#touch", line[3])]
+        code.extend(self.h_copy_body(body, names))
+        return code
+
+    # a copy of the statements of l with names renamed and new labels
+    def h_copy_body(self, l, names):
+        out = []
+        stack = [(iter(l), out)]
+        while stack:
+            (lines, dest) = stack[-1]
+            for line in lines:
+                kind = line[0]
+                if kind == "#assign":
+                    dest.append(
+                        ("#assign", names[line[1]], self.h_rename(line[2], names))
+                    )
+                elif kind == "#read":
+                    dest.append(("#read", names[line[1]]))
+                elif kind == "#write":
+                    dest.append(("#write", self.h_rename(line[1], names)))
+                elif kind == "#proc":
+                    refs = [names[r] for r in line[3]]
+                    dest.append(("#proc", line[1], self.createLabel(), refs))
+                elif kind == "#touch":
+                    dest.append(("#touch", [names[r] for r in line[1]]))
+                elif kind == "#if":
+                    block = []
+                    cond = self.h_rename(line[2], names)
+                    dest.append(("#if", self.createLabel(), cond, block))
+                    stack.append((iter(line[3]), block))
+                    break
+                elif kind == "#ife":
+                    (tblock, fblock) = ([], [])
+                    cond = self.h_rename(line[3], names)
+                    dest.append(
+                        (
+                            "#ife",
+                            self.createLabel(),
+                            self.createLabel(),
+                            cond,
+                            tblock,
+                            fblock,
+                        )
+                    )
+                    stack.append((iter(line[5]), fblock))
+                    stack.append((iter(line[4]), tblock))
+                    break
+                elif kind == "#while":
+                    block = []
+                    cond = self.h_rename(line[3], names)
+                    dest.append(
+                        ("#while", self.createLabel(), self.createLabel(), cond, block)
+                    )
+                    stack.append((iter(line[4]), block))
+                    break
+                elif kind == "#until":
+                    block = []
+                    cond = self.h_rename(line[2], names)
+                    dest.append(("#until", self.createLabel(), cond, block))
+                    stack.append((iter(line[3]), block))
+                    break
+            else:
+                stack.pop()
+        return out
+
+    # expressions are always copied, code generation sets their dest
+    def h_rename(self, val, names):
+        if type(val) is ExpObject:
+            return ExpObject(
+                val.oType,
+                self.h_rename(val.left, names),
+                self.h_rename(val.right, names),
+            )
+        if val.vType == ValueType.VAR:
+            return self.a_id(names[val.data])
+        return val
+
+    #!inline
+    # hoist
+    # multiplications, divisions and remainders whose operands no statement
+    # of a loop assigns are computed once, into an "inv.n" variable, just
+    # before the loop; inner loops go first, so what they hoisted can move
+    # further out. An operand must have been set earlier on the way to the
+    # loop, the hoisted code is checked outside of it. A REF parameter
+    # assigned in the loop may be an alias of any other, none of them is
+    # invariant then
+    def hoist_invariants(self, l):
+        sym_proc = self.symbols_proc[l[0]]
+        assigned = self.h_assigned(l[1])
+        refs = {name for name, var in sym_proc.symbols.items() if var.mode == Mode.REF}
+        loops = self.h_loops(l[1], refs)
+        hoisted = 0
+        for (loop, block, done, outer) in reversed(loops):
+            written = assigned[id(loop)]
+            if not refs.isdisjoint(written):
+                written = written | refs
+            temps = {}
+            code = []
+            body = loop[4] if loop[0] == "#while" else loop[3]
+            for lines in self.h_loop_blocks(body):
+                for idx, line in enumerate(lines):
+                    if line[0] != "#assign" or type(line[2]) is not ExpObject:
+                        continue
+                    exp = line[2]
+                    if not self.h_hoistable(exp, written, done):
+                        continue
+                    key = (
+                        exp.oType,
+                        exp.left.vType,
+                        exp.left.data,
+                        exp.right.vType,
+                        exp.right.data,
+                    )
+                    temp = temps.get(key)
+                    if temp is None:
+                        temp = f"inv.{len(sym_proc.symbols)}"
+                        sym_proc.symbols[temp] = Variable(None, Mode.VAR)
+                        temps[key] = temp
+                        code.append(("#assign", temp, exp))
+                    lines[idx] = ("#assign", line[1], self.a_id(temp))
+            if code:
+                idx = next(i for i, line in enumerate(block) if line is loop)
+                block[idx:idx] = code
+                for line in outer:
+                    assigned[id(line)].update(temps.values())
+                hoisted += len(code)
+        self.__hoisted[l[0]] = hoisted
+
+    # the loops of a procedure body, each after the loops around it, with
+    # the block holding it, the names set before it on the way from the
+    # start (REF parameters count as set) and the loops around it
+    def h_loops(self, l, refs):
+        loops = []
+        stack = [(iter(l), l, set(refs), ())]
+        while stack:
+            (lines, block, done, outer) = stack[-1]
+            for line in lines:
+                kind = line[0]
+                if kind == "#assign" or kind == "#read":
+                    done.add(line[1])
+                elif kind == "#proc" or kind == "#touch":
+                    done.update(line[3] if kind == "#proc" else line[1])
+                elif kind == "#if":
+                    stack.append((iter(line[3]), line[3], set(done), outer))
+                    break
+                elif kind == "#ife":
+                    stack.append((iter(line[5]), line[5], set(done), outer))
+                    stack.append((iter(line[4]), line[4], set(done), outer))
+                    break
+                elif kind == "#while" or kind == "#until":
+                    loops.append((line, block, frozenset(done), outer))
+                    body = line[4] if kind == "#while" else line[3]
+                    stack.append((iter(body), body, set(done), outer + (line,)))
+                    break
+            else:
+                stack.pop()
+        return loops
+
+    # the lists of statements of a loop body outside of its inner loops
+    def h_loop_blocks(self, body):
+        blocks = [body]
+        idx = 0
+        while idx < len(blocks):
+            for line in blocks[idx]:
+                if line[0] == "#if":
+                    blocks.append(line[3])
+                elif line[0] == "#ife":
+                    blocks.append(line[4])
+                    blocks.append(line[5])
+            idx += 1
+        return blocks
+
+    # worth computing once: not folded already nor a shift by a power of
+    # two, operands set before the loop and not written in it
+    def h_hoistable(self, exp, written, done):
+        if exp.oType in (OpType.ADD, OpType.SUB):
+            return False
+        (left, right) = (exp.left, exp.right)
+        if left.vType == ValueType.NUM and right.vType == ValueType.NUM:
+            return False
+        const = None
+        if right.vType == ValueType.NUM:
+            const = right.data
+        elif exp.oType == OpType.MUL and left.vType == ValueType.NUM:
+            const = left.data
+        if const is not None and const & (const - 1) == 0:
+            return False
+        return self.h_invariant(left, written, done) and self.h_invariant(
+            right, written, done
+        )
+
+    # a constant, or a variable set before the loop and not written in it
+    def h_invariant(self, val, written, done):
+        if val.vType == ValueType.NUM:
+            return True
+        return val.data not in written and val.data in done
+
+    #!hoist
+    # strength
+    # an induction variable of a loop is a VAR variable set before it whose
+    # only assignment in the loop is i := i + c at the top of its body, c
+    # invariant, so it runs once a pass. A product i * k with k invariant
+    # gets an "ind.n" variable set to i * k before the loop and increased by
+    # c * k right after i := i + c; the loop adds where it multiplied. c * k
+    # is a constant when both are and it fits into SET, else it is computed
+    # before the loop too. i := i - c is left alone, SUB stops at 0. Runs
+    # after hoisting, the products it leaves in a loop depend on the loop
+    def reduce_strength(self, l):
+        sym_proc = self.symbols_proc[l[0]]
+        assigned = self.h_assigned(l[1])
+        refs = {name for name, var in sym_proc.symbols.items() if var.mode == Mode.REF}
+        reduced = 0
+        for (loop, block, done, outer) in reversed(self.h_loops(l[1], refs)):
+            written = assigned[id(loop)]
+            if not refs.isdisjoint(written):
+                written = written | refs
+            body = loop[4] if loop[0] == "#while" else loop[3]
+            steps = self.h_induction(body, written, done, assigned, sym_proc)
+            if not steps:
+                continue
+            temps = {}
+            code = []
+            updates = {}
+            for lines in self.h_loop_blocks(body):
+                for idx, line in enumerate(lines):
+                    if line[0] != "#assign" or type(line[2]) is not ExpObject:
+                        continue
+                    exp = line[2]
+                    if exp.oType != OpType.MUL:
+                        continue
+                    (var, factor) = (exp.left, exp.right)
+                    if var.vType != ValueType.VAR or var.data not in steps:
+                        (var, factor) = (factor, var)
+                        if var.vType != ValueType.VAR or var.data not in steps:
+                            continue
+                    if not self.h_invariant(factor, written, done):
+                        continue
+                    if factor.vType == ValueType.NUM and self.h_cheap(factor.data):
+                        continue
+                    key = (var.data, factor.vType, factor.data)
+                    temp = temps.get(key)
+                    if temp is None:
+                        temp = f"ind.{len(sym_proc.symbols)}"
+                        sym_proc.symbols[temp] = Variable(None, Mode.VAR)
+                        temps[key] = temp
+                        code.append(("#assign", temp, exp))
+                        (inc, step) = steps[var.data]
+                        if step.vType == ValueType.NUM and step.data == 1:
+                            step = factor
+                        elif (
+                            step.vType == factor.vType == ValueType.NUM
+                            and step.data * factor.data <= self.__max_const
+                        ):
+                            step = self.h_num(step.data * factor.data)
+                        else:
+                            name = f"ind.{len(sym_proc.symbols)}"
+                            sym_proc.symbols[name] = Variable(None, Mode.VAR)
+                            code.append(
+                                ("#assign", name, ExpObject(OpType.MUL, step, factor))
+                            )
+                            step = self.a_id(name)
+                        updates.setdefault(id(inc), []).append(
+                            (
+                                "#assign",
+                                temp,
+                                ExpObject(OpType.ADD, self.a_id(temp), step),
+                            )
+                        )
+                    lines[idx] = ("#assign", line[1], self.a_id(temp))
+            if code:
+                body[:] = itertools.chain.from_iterable(
+                    [line] + updates.get(id(line), []) for line in body
+                )
+                idx = next(i for i, line in enumerate(block) if line is loop)
+                block[idx:idx] = code
+                names = [line[1] for line in code]
+                for line in outer:
+                    assigned[id(line)].update(names)
+                reduced += len(temps)
+        self.__reduced[l[0]] = reduced
+
+    # the induction variables of a loop body by name, with their i := i + c
+    # and c
+    def h_induction(self, body, written, done, assigned, sym_proc):
+        found = {}
+        for line in body:
+            if line[0] != "#assign" or type(line[2]) is not ExpObject:
+                continue
+            (name, exp) = (line[1], line[2])
+            var = sym_proc.symbols.get(name)
+            if exp.oType != OpType.ADD or var is None or var.mode != Mode.VAR:
+                continue
+            if exp.left.vType == ValueType.VAR and exp.left.data == name:
+                step = exp.right
+            elif exp.right.vType == ValueType.VAR and exp.right.data == name:
+                step = exp.left
+            else:
+                continue
+            if name in done and self.h_invariant(step, written, done):
+                found[name] = (line, step)
+        if found:
+            for line in body:
+                kind = line[0]
+                if kind == "#assign" or kind == "#read":
+                    names = (line[1],)
+                elif kind == "#proc":
+                    names = line[3]
+                elif kind in ("#if", "#ife", "#while", "#until"):
+                    names = assigned[id(line)]
+                else:
+                    continue
+                for name in [n for n in found if n in names]:
+                    if found[name][0] is not line:
+                        del found[name]
+        return found
+
+    # a product b_mul gets from a few additions, no cheaper by adding
+    def h_cheap(self, num):
+        return num == 3 or (num <= 8 and num & (num - 1) == 0)
+
+    #!strength
+    # dead stores
+    # liveness over the statements of a procedure, one bit per VAR variable.
+    # A statement moves the set X of variables live after it to g | (X & t)
+    # before it (t = -1 keeps all); summaries holds (g, t) by id of every
+    # statement and block. A store to a VAR variable not live after it
+    # becomes #dead, which compiles to nothing; REF parameters, READ and
+    # procedure arguments are never removed. What a procedure may read
+    # before setting stays live at its end, the next call sees it
+    def remove_dead_stores(self, l):
+        bits = self.h_var_bits(self.symbols_proc[l[0]])
+        blocks = self.h_blocks(l[1])
+        removed = 0
+        while True:
+            summaries = self.h_summaries(blocks, bits)
+            end = 0 if l[0] == "main" else summaries[id(l[1])][0]
+            after = {id(l[1]): end}
+            dead = 0
+            for block in blocks:
+                live = after[id(block)]
+                for idx in range(len(block) - 1, -1, -1):
+                    line = block[idx]
+                    kind = line[0]
+                    if kind == "#assign" and line[1] in bits:
+                        if not live & bits[line[1]]:
+                            block[idx] = ("#dead", line[1], line[2])
+                            dead += 1
+                            continue
+                    elif kind == "#if":
+                        after[id(line[3])] = live
+                    elif kind == "#ife":
+                        after[id(line[4])] = live
+                        after[id(line[5])] = live
+                    elif kind == "#while" or kind == "#until":
+                        cond = line[3] if kind == "#while" else line[2]
+                        body = line[4] if kind == "#while" else line[3]
+                        # live at the loop head: after it, in the condition
+                        # or read by the body before it sets it
+                        head = live | self.h_uses(cond, bits) | summaries[id(body)][0]
+                        after[id(body)] = head
+                    (gs, ts) = summaries[id(line)]
+                    live = gs | (live & ts)
+            removed += dead
+            if dead == 0:
+                break
+        self.__dead_stores[l[0]] = removed
+
+    # every list of statements under l, l first, each before its blocks
+    def h_blocks(self, l):
+        blocks = [l]
+        idx = 0
+        while idx < len(blocks):
+            for line in blocks[idx]:
+                if line[0] == "#if" or line[0] == "#until":
+                    blocks.append(line[3])
+                elif line[0] == "#ife":
+                    blocks.append(line[4])
+                    blocks.append(line[5])
+                elif line[0] == "#while":
+                    blocks.append(line[4])
+            idx += 1
+        return blocks
+
+    def h_var_bits(self, sym_proc):
+        bits = {}
+        for name, var in sym_proc.symbols.items():
+            if var.mode == Mode.VAR:
+                bits[name] = 1 << len(bits)
+        return bits
+
+    def h_summaries(self, blocks, bits):
+        summaries = {}
+        for block in reversed(blocks):
+            (g, t) = (0, -1)
+            for line in reversed(block):
+                (gs, ts) = self.h_live_line(line, bits, summaries)
+                summaries[id(line)] = (gs, ts)
+                (g, t) = (gs | (g & ts), t & ts)
+            summaries[id(block)] = (g, t)
+        return summaries
+
+    # (g, t) of a statement, its blocks are already in summaries
+    def h_live_line(self, line, bits, summaries):
+        kind = line[0]
+        if kind == "#assign":
+            uses = self.h_uses(line[2], bits)
+            return (uses, ~bits.get(line[1], 0))
+        elif kind == "#read":
+            return (0, ~bits.get(line[1], 0))
+        elif kind == "#write":
+            return (self.h_uses(line[1], bits), -1)
+        elif kind == "#proc":
+            uses = 0
+            for name in line[3]:
+                uses |= bits.get(name, 0)
+            return (uses, -1)
+        elif kind == "#if":
+            return (self.h_uses(line[2], bits) | summaries[id(line[3])][0], -1)
+        elif kind == "#ife":
+            (gt, tt) = summaries[id(line[4])]
+            (gf, tf) = summaries[id(line[5])]
+            return (self.h_uses(line[3], bits) | gt | gf, tt | tf)
+        elif kind == "#while":
+            return (self.h_uses(line[3], bits) | summaries[id(line[4])][0], -1)
+        elif kind == "#until":
+            (g, t) = summaries[id(line[3])]
+            return (g | (self.h_uses(line[2], bits) & t), t)
+        return (0, -1)
+
+    def h_uses(self, val, bits):
+        if type(val) is ExpObject:
+            return bits.get(val.left.data, 0) | bits.get(val.right.data, 0)
+        return bits.get(val.data, 0)
+
+    # the variables the code of a procedure refers to, its #dead stores
+    # left out
+    def h_used(self, l):
+        used = set()
+        for block in self.h_blocks(l):
+            for line in block:
+                kind = line[0]
+                if kind == "#assign":
+                    used.add(line[1])
+                    used.update(self.h_names(line[2]))
+                elif kind == "#read":
+                    used.add(line[1])
+                elif kind == "#write":
+                    used.update(self.h_names(line[1]))
+                elif kind == "#proc":
+                    used.update(line[3])
+                elif kind == "#if" or kind == "#until":
+                    used.update(self.h_names(line[2]))
+                elif kind == "#ife" or kind == "#while":
+                    used.update(self.h_names(line[3]))
+        return used
+
+    def h_names(self, val):
+        if type(val) is ExpObject:
+            vals = (val.left, val.right)
+        else:
+            vals = (val,)
+        return [v.data for v in vals if v.vType == ValueType.VAR]
+
+    # cells for main and the called procedures, in the order they were
+    # declared; procedures never called get none
+    def place_variables(self, procedures, main):
+        bodies = dict(procedures)
+        bodies[main[0]] = main[1]
+        for name, proc in self.symbols_proc.items():
+            if name == "main" or proc.isCalled():
+                proc.place(self, self.h_used(bodies[name]))
+
+    #!dead stores
     # tree walk
+    # explicit stack of the blocks being walked, nesting depth is not
+    # limited by the recursion limit
     def tree_walk_inner(self, l, proc):
-        for line in l:
-            if line[0] == "#assign":
-                if type(line[2]) is ExpObject:
-                    if line[2].oType == OpType.DIV:
-                        if line[2].right.vType == ValueType.NUM:
-                            right = int(line[2].right.data)
-                            if not (
-                                (right & (right - 1)) == 0 or right == 0 or right == 1
-                            ):
+        stack = [iter(l)]
+        while stack:
+            for line in stack[-1]:
+                if line[0] == "#assign":
+                    if type(line[2]) is ExpObject:
+                        if line[2].oType == OpType.DIV:
+                            if line[2].right.vType == ValueType.NUM:
+                                right = line[2].right.data
+                                if not (
+                                    (right & (right - 1)) == 0
+                                    or right == 0
+                                    or right == 1
+                                ):
+                                    self.__no_divs += 1
+                            else:
                                 self.__no_divs += 1
-                        else:
-                            self.__no_divs += 1
-                    elif line[2].oType == OpType.MOD:
-                        if line[2].right.vType == ValueType.NUM:
-                            right = int(line[2].right.data)
-                            if right > 2:
+                        elif line[2].oType == OpType.MOD:
+                            if line[2].right.vType == ValueType.NUM:
+                                right = line[2].right.data
+                                if right > 2:
+                                    self.__no_mods += 1
+                            else:
                                 self.__no_mods += 1
-                        else:
-                            self.__no_mods += 1
-                    elif (
-                        (line[2].oType == OpType.MUL)
-                        and (line[2].left.vType == line[2].right.vType)
-                        and (line[2].left.vType == ValueType.VAR)
-                    ):
-                        self.__no_muls += 1
-            elif line[0] == "#if":
-                self.tree_walk_inner(line[3], proc)
-            elif line[0] == "#ife":
-                self.tree_walk_inner(line[4], proc)
-                self.tree_walk_inner(line[5], proc)
-            elif line[0] == "#while":
-                self.tree_walk_inner(line[4], proc)
-            elif line[0] == "#until":
-                self.tree_walk_inner(line[3], proc)
-            elif line[0] == "#proc":
-                if not proc.canCall(self.symbols_proc[line[1]]):
-                    raise Exception(
-                        f"{line[1]} cannot be called from inside {proc.getName()}"
-                    )
-                else:
-                    p = self.symbols_proc[line[1]]
-                    p.call()
+                        elif (
+                            (line[2].oType == OpType.MUL)
+                            and (line[2].left.vType == line[2].right.vType)
+                            and (line[2].left.vType == ValueType.VAR)
+                        ):
+                            self.__no_muls += 1
+                elif line[0] == "#if":
+                    stack.append(iter(line[3]))
+                    break
+                elif line[0] == "#ife":
+                    stack.append(iter(line[5]))
+                    stack.append(iter(line[4]))
+                    break
+                elif line[0] == "#while":
+                    stack.append(iter(line[4]))
+                    break
+                elif line[0] == "#until":
+                    stack.append(iter(line[3]))
+                    break
+                elif line[0] == "#proc":
+                    if not proc.canCall(self.symbols_proc[line[1]]):
+                        raise Exception(
+                            f"{line[1]} cannot be called from inside {proc.getName()}"
+                        )
+                    else:
+                        p = self.symbols_proc[line[1]]
+                        p.call()
+            else:
+                stack.pop()
 
     def tree_walk(self, l):
         proc = self.symbols_proc[l[0]]
@@ -1507,13 +2356,18 @@ class CProcessor:
     #!tree walk
     # transform
     def process_list_procedures(self, l):
-        called_proc = []
+        called = []
         for proc in reversed(l):
-            name = proc[0]
-            if self.symbols_proc[name].isCalled():
-                t = self.process_list(proc)
-                t.append(f"JUMPI {self.symbols_proc[name].getBackAdd()}")
-                called_proc.append((t, self.symbols_proc[name].getLabel()))
+            if self.symbols_proc[proc[0]].isCalled():
+                called.append(proc)
+        if self.codegen_jobs > 1 and len(called) > 1:
+            codes = self.glue_parallel(called)
+        else:
+            codes = (self.fragment(proc, self.glue_proc) for proc in called)
+        called_proc = []
+        for proc, code in zip(called, codes):
+            code[0].mark(self.symbols_proc[proc[0]].getLabel())
+            called_proc.append(code)
         return called_proc
 
     def process_list(self, l):
@@ -1522,219 +2376,1108 @@ class CProcessor:
         sym_proc = self.symbols_proc[proc_name]
         return self.process_list_inner(l[1], sym_proc)
 
+    # blocks are compiled from an explicit stack in source order, each one
+    # into the list its statement left for it. What p_0 holds is tracked
+    # through the straight-line code of a list (see h_track); a block
+    # statement leaves a join behind it, so nothing is known after it.
+    # With propagation the facts about variables (see h_propagate) go into
+    # the blocks; joins lists the facts met when the frame resumes
     def process_list_inner(self, l, sym_proc):
         curr = []
-        for line in l:
-            if line[0] == "#assign":
-                if type(line[2]) is ValueObject:
-                    curr.extend(self.b_assign(line[1], line[2], sym_proc))
-                else:
-                    curr.extend(self.b_assign_e(line[1], line[2], sym_proc))
-            elif line[0] == "#write":
-                curr.extend(self.b_write(line[1], sym_proc))
-            elif line[0] == "#read":
-                curr.extend(self.b_read(line[1], sym_proc))
-            elif line[0] == "#if":
-                curr.extend(self.b_if(line[1], line[2], line[3], sym_proc))
-            elif line[0] == "#ife":
-                curr.extend(
-                    self.b_ife(line[1], line[2], line[3], line[4], line[5], sym_proc)
-                )
-            elif line[0] == "#while":
-                curr.extend(self.b_while(line[1], line[2], line[3], line[4], sym_proc))
-            elif line[0] == "#until":
-                curr.extend(self.b_until(line[1], line[2], line[3], sym_proc))
-            elif line[0] == "#proc":
-                if not sym_proc.canCall(self.symbols_proc[line[1]]):
-                    raise Exception(
-                        f"{line[1]} cannot be called from inside {sym_proc.getName()}"
+        assigned = self.h_assigned(l) if self.propagation else None
+        stack = [(iter(l), curr, False, [None, set(), set()], Facts(), [])]
+        while stack:
+            (lines, out, loop, known, facts, joins) = stack[-1]
+            if joins:
+                facts.meet(joins)
+                joins.clear()
+            for line in lines:
+                blocks = None
+                size = len(out)
+                if assigned is not None:
+                    line = self.h_propagate(line, facts, assigned, sym_proc)
+                    if line is None:
+                        continue
+                if line[0] == "#assign":
+                    if type(line[2]) is ValueObject:
+                        code = self.b_assign(line[1], line[2], sym_proc)
+                    else:
+                        code = self.b_assign_e(line[1], line[2], sym_proc)
+                    out.extend(self.h_track(code, known))
+                elif line[0] == "#write":
+                    out.extend(self.h_track(self.b_write(line[1], sym_proc), known))
+                elif line[0] == "#read":
+                    out.extend(self.h_track(self.b_read(line[1], sym_proc), known))
+                elif line[0] == "#dead":
+                    out.extend(self.b_dead(line[1], line[2], sym_proc))
+                elif line[0] == "#touch":
+                    out.extend(self.b_touch(line[1], sym_proc))
+                elif line[0] == "#if":
+                    blocks = self.b_if(line[1], line[2], line[3], out, sym_proc)
+                elif line[0] == "#ife":
+                    blocks = self.b_ife(
+                        line[1], line[2], line[3], line[4], line[5], out, sym_proc
                     )
-                else:
-                    curr.extend(self.b_proc(line[1], line[2], line[3], sym_proc))
+                elif line[0] == "#while":
+                    blocks = self.b_while(
+                        line[1], line[2], line[3], line[4], out, sym_proc
+                    )
+                elif line[0] == "#until":
+                    blocks = self.b_until(line[1], line[2], line[3], out, sym_proc)
+                elif line[0] == "#proc":
+                    if not sym_proc.canCall(self.symbols_proc[line[1]]):
+                        raise Exception(
+                            f"{line[1]} cannot be called from inside {sym_proc.getName()}"
+                        )
+                    else:
+                        out.extend(self.b_proc(line[1], line[2], line[3], sym_proc))
+                if len(out) > size and type(out[-1]) is tuple:
+                    block = out[-1]
+                    # the condition of an IF runs straight after the code
+                    # before it
+                    if block[0] == "#if":
+                        block[2][:] = self.h_track(block[2], known)
+                    elif block[0] == "#ife":
+                        block[3][:] = self.h_track(block[3], known)
+                    known[0] = None
+                    known[1] = set()
+                    known[2] = set()
+                if blocks:
+                    ends = []
+                    for (cmds, dest, is_loop) in reversed(blocks):
+                        if is_loop:
+                            self.__loop_depth += 1
+                        if dest is not out:
+                            state = [None, set(), set()]
+                            env = facts.copy()
+                            ends.append(env)
+                        else:
+                            (state, env) = (known, facts)
+                        stack.append((iter(cmds), dest, is_loop, state, env, []))
+                    # loops start from facts holding on every pass, which
+                    # also hold after the loop
+                    if ends and line[0] == "#if":
+                        joins.extend((facts, ends[0]))
+                    elif ends and line[0] == "#ife":
+                        joins.extend(ends)
+                    break
+            else:
+                stack.pop()
+                if loop:
+                    self.__loop_depth -= 1
         return curr
 
+    # known: [constant in p_0 or None, cells equal to p_0, cells p such that
+    # p_0 equals p_mem[p]]. A LOAD, LOADI or SET of what p_0 already holds
+    # is left out, the rest of code is returned and known updated past it.
+    # STOREI keeps every fact, the cell it writes gets the value of p_0. A
+    # labelled instruction may be jumped to, nothing is known before it,
+    # and one reached through an offset from a label is kept
+    def h_track(self, code, known):
+        if not self.tracking:
+            return code
+        (value, cells, refs) = known
+        out = []
+        offsets = None
+        after = False
+        for instr in code:
+            op = instr.op
+            arg = instr.arg
+            if instr.labels is not None:
+                (value, cells, refs) = (None, set(), set())
+                if offsets is None:
+                    offsets = {
+                        i.arg.label
+                        for i in code
+                        if type(i.arg) is LabelRef and i.arg.offset > 0
+                    }
+                pinned = after
+                after = not offsets.isdisjoint(instr.labels)
+            else:
+                pinned = after
+                after = False
+            if op == "LOAD":
+                if type(arg) is ConstRef:
+                    if value == arg.value and not pinned:
+                        continue
+                    (value, cells, refs) = (arg.value, set(), set())
+                elif arg == 0 or arg in cells:
+                    if not pinned:
+                        continue
+                else:
+                    (value, cells, refs) = (None, {arg}, set())
+            elif op == "SET":
+                if type(arg) is not int:
+                    (value, cells, refs) = (None, set(), set())
+                elif value == arg and not pinned:
+                    continue
+                else:
+                    (value, cells, refs) = (arg, set(), set())
+            elif op == "LOADI":
+                if arg in refs and not pinned:
+                    continue
+                (value, cells, refs) = (None, set(), {arg})
+            elif op == "STORE":
+                cells.add(arg)
+                refs.discard(arg)
+            elif op == "STOREI":
+                refs.add(arg)
+            elif op == "GET":
+                if arg == 0:
+                    (value, cells) = (None, set())
+                cells.discard(arg)
+                refs = set()
+            elif op != "PUT" and op != "JPOS" and op != "JZERO":
+                (value, cells, refs) = (None, set(), set())
+            out.append(instr)
+        known[0] = value
+        known[1] = cells
+        known[2] = refs
+        return out
+
     #!transform
+    # propagate
+    # the variables assigned in the body of every loop and if, by id of its
+    # statement; procedure arguments count as assigned
+    def h_assigned(self, l):
+        result = {}
+        stack = [[iter(l), set(), None]]
+        while stack:
+            frame = stack[-1]
+            for line in frame[0]:
+                kind = line[0]
+                if kind == "#assign" or kind == "#read":
+                    frame[1].add(line[1])
+                elif kind == "#proc":
+                    frame[1].update(line[3])
+                elif kind == "#if":
+                    stack.append([iter(line[3]), set(), line])
+                    break
+                elif kind == "#ife":
+                    stack.append([itertools.chain(line[4], line[5]), set(), line])
+                    break
+                elif kind == "#while":
+                    stack.append([iter(line[4]), set(), line])
+                    break
+                elif kind == "#until":
+                    stack.append([iter(line[3]), set(), line])
+                    break
+            else:
+                stack.pop()
+                if frame[2] is not None:
+                    result[id(frame[2])] = frame[1]
+                if stack:
+                    stack[-1][1] |= frame[1]
+        return result
+
+    # the statement with known values of VAR variables put in where the
+    # code it gets is not worse, None when it has no effect; facts are
+    # updated past it. A loop's facts lose what its body assigns before its
+    # condition is looked at, they hold on every pass
+    def h_propagate(self, line, facts, assigned, sym_proc):
+        kind = line[0]
+        if kind == "#assign":
+            return self.h_propagate_assign(line, facts, sym_proc)
+        elif kind == "#write":
+            (const, val) = self.h_fact(line[1], facts, sym_proc)
+            if val is not line[1]:
+                return ("#write", val)
+        elif kind == "#read":
+            facts.kill(line[1])
+        elif kind == "#proc":
+            for name in line[3]:
+                facts.kill(name)
+        elif kind == "#if":
+            cond = self.h_propagate_exp(line[2], facts, sym_proc)
+            if cond is not line[2]:
+                return ("#if", line[1], cond, line[3])
+        elif kind == "#ife":
+            cond = self.h_propagate_exp(line[3], facts, sym_proc)
+            if cond is not line[3]:
+                return ("#ife", line[1], line[2], cond, line[4], line[5])
+        elif kind == "#while":
+            for name in assigned[id(line)]:
+                facts.kill(name)
+            cond = self.h_propagate_exp(line[3], facts, sym_proc)
+            if cond is not line[3]:
+                return ("#while", line[1], line[2], cond, line[4])
+        elif kind == "#until":
+            for name in assigned[id(line)]:
+                facts.kill(name)
+            cond = self.h_propagate_exp(line[2], facts, sym_proc)
+            if cond is not line[2]:
+                return ("#until", line[1], cond, line[3])
+        return line
+
+    def h_propagate_assign(self, line, facts, sym_proc):
+        (_, name, val) = line
+        var = sym_proc.symbols.get(name)
+        tracked = var is not None and var.mode == Mode.VAR
+        if type(val) is ValueObject:
+            (const, new) = self.h_fact(val, facts, sym_proc)
+            if not tracked:
+                pass
+            elif const is not None:
+                if facts.known.get(name) == const:
+                    return None
+                facts.setConst(name, const)
+            elif new.data == name or facts.known.get(name) == new.data:
+                return None
+            elif self.h_tracked(new.data, sym_proc):
+                facts.setCopy(name, new.data)
+            else:
+                facts.kill(name)
+            if new is not val:
+                return ("#assign", name, new)
+            return line
+        exp = self.h_propagate_exp(val, facts, sym_proc)
+        if tracked:
+            value = self.h_fold(val, facts, sym_proc)
+            if value is None:
+                facts.kill(name)
+            elif facts.known.get(name) == value:
+                return None
+            else:
+                facts.setConst(name, value)
+        if exp is not val:
+            return ("#assign", name, exp)
+        return line
+
+    # operands get their known constants when that decides the code: both
+    # known, multiplication and division, a 0 and the constant subtrahend;
+    # otherwise only copies are replaced
+    def h_propagate_exp(self, exp, facts, sym_proc):
+        (lc, left) = self.h_fact(exp.left, facts, sym_proc)
+        (rc, right) = self.h_fact(exp.right, facts, sym_proc)
+        op = exp.oType
+        both = lc is not None and rc is not None
+        if both and op in (OpType.ADD, OpType.SUB, OpType.MUL):
+            both = self.h_fold(exp, facts, sym_proc) <= self.__max_const
+        spread = both or op in (OpType.MUL, OpType.DIV, OpType.MOD)
+        if lc is not None and lc <= self.__max_const and (spread or lc == 0):
+            left = self.h_num(lc)
+        if rc is not None and rc <= self.__max_const:
+            if spread or rc == 0 or op == OpType.SUB:
+                right = self.h_num(rc)
+        if left is exp.left and right is exp.right:
+            return exp
+        return ExpObject(op, left, right)
+
+    # (known constant or None, the value or the variable it is a copy of)
+    def h_fact(self, val, facts, sym_proc):
+        if val.vType == ValueType.NUM:
+            return (val.data, val)
+        fact = facts.known.get(val.data)
+        if type(fact) is int:
+            return (fact, val)
+        if fact is not None and sym_proc.check_ivar(fact):
+            return (None, self.a_id(fact))
+        return (None, val)
+
+    def h_tracked(self, name, sym_proc):
+        var = sym_proc.symbols.get(name)
+        return var is not None and var.mode == Mode.VAR
+
+    # the value of an arithmetic expression of known operands, None if one
+    # is unknown; division and modulo by 0 give 0
+    def h_fold(self, exp, facts, sym_proc):
+        l = self.h_fact(exp.left, facts, sym_proc)[0]
+        r = self.h_fact(exp.right, facts, sym_proc)[0]
+        if l is None or r is None:
+            return None
+        op = exp.oType
+        if op == OpType.ADD:
+            return l + r
+        elif op == OpType.SUB:
+            return l - r if r <= l else 0
+        elif op == OpType.MUL:
+            return l * r
+        elif op == OpType.DIV:
+            return l // r if r != 0 else 0
+        return l % r if r != 0 else 0
+
+    #!propagate
     # glue
     def createLabel(self):
         self.__label_no += 1
         return self.__label_no
 
-    def dest_label(self, label):
-        return f" [{self.__dest_label}{label}]"
-
     def to_label_next(self, label):
-        return f" [{self.__to_label_next}{label}]"
+        return LabelRef(label, 1)
 
     def to_label(self, label):
-        return f" [{self.__to_label}{label}]"
+        return LabelRef(label)
 
+    # label: labels waiting for the next instruction. A frame per open block:
+    # [statements, its waiting labels, statement, kind, index in out of the
+    # block's first instruction]; the block's tail is handled when it closes
     def fin_glue(self, code):
         out = []
-        label = []
-        setLabel = False
-        for elem in code:
-            if type(elem) is tuple:
+        stack = [[iter(code), [], None, None, 0]]
+        while True:
+            frame = stack[-1]
+            label = frame[1]
+            for elem in frame[0]:
+                if type(elem) is not tuple:
+                    for l in label:
+                        elem.mark(l)
+                    label.clear()
+                    out.append(elem)
+                    continue
                 # (#if, flabel, cond, block)
                 if elem[0] == "#if":
-                    if setLabel:
-                        for l in label:
-                            elem[2][0] += self.dest_label(l)
-                        setLabel = False
-                        label = []
-                    setLabel = True
+                    for l in label:
+                        elem[2][0].mark(l)
+                    label.clear()
                     label.append(elem[1])
                     out.extend(elem[2])
-                    (block, bSetL, bLabel) = self.fin_glue(elem[3])
-                    if bSetL:
-                        label.extend(bLabel)
-                    out.extend(block)
+                    stack.append([iter(elem[3]), [], elem, "#if", len(out)])
+                    break
                 # (#ife, flabel, tlabel, cond, tblock, fblock)
                 elif elem[0] == "#ife":
-                    if setLabel:
-                        for l in label:
-                            elem[3][0] += self.dest_label(l)
-                        setLabel = False
-                        label = []
+                    for l in label:
+                        elem[3][0].mark(l)
+                    label.clear()
                     out.extend(elem[3])
-                    (block0, bSetL0, bLabel0) = self.fin_glue(elem[4])
-                    if bSetL0:
-                        label.extend(bLabel0)
-                    out.extend(block0)
-                    out.append(f"JUMP {self.to_label(elem[2])}")
-                    (block1, bSetL1, bLabel1) = self.fin_glue(elem[5])
-                    if bSetL1:
-                        label.extend(bLabel1)
-                    block1[0] += self.dest_label(elem[1])
-                    out.extend(block1)
-                    setLabel = True
-                    label.append(elem[2])
+                    stack.append([iter(elem[4]), [], elem, "#ife", len(out)])
+                    break
                 # (#inf, loop_label, block)
                 elif elem[0] == "#inf":
-                    (block, bSetL, bLabel) = self.fin_glue(elem[2])
-                    if setLabel:
-                        for l in label:
-                            block[0] += self.dest_label(l)
-                        setLabel = False
-                        label = []
-                    block[0] += self.dest_label(elem[1])
-                    if bSetL:
-                        for l in bLabel:
-                            block[0] += self.dest_label(l)
-                    label = []
-                    setLabel = False
-                    out.extend(block)
-                    out.append(f"JUMP {self.to_label(elem[1])}")
+                    stack.append([iter(elem[2]), [], elem, "#inf", len(out)])
                     break
                 # (#while, flabel, back_label, cond, block)
                 elif elem[0] == "#while":
-                    if setLabel:
-                        for l in label:
-                            elem[3][0] += self.dest_label(l)
-                        label = []
-                        setLabel = False
-                    elem[3][0] += self.dest_label(elem[2])
-                    (block, bSetL, bLabel) = self.fin_glue(elem[4])
-                    if bSetL:
-                        for l in bLabel:
-                            elem[3][0] += self.dest_label(l)
+                    for l in label:
+                        elem[3][0].mark(l)
+                    label.clear()
+                    elem[3][0].mark(elem[2])
                     out.extend(elem[3])
-                    out.extend(block)
-                    out.append(f"JUMP {self.to_label(elem[2])}")
-                    setLabel = True
-                    label.append(elem[1])
+                    stack.append([iter(elem[4]), [], elem, "#while", len(out)])
+                    break
                 # (#until, back_label, cond, block)
                 elif elem[0] == "#until":
-                    (block, bSetL, bLabel) = self.fin_glue(elem[3])
-                    if setLabel:
-                        for l in label:
-                            block[0] += self.dest_label(l)
-                        setLabel = False
-                        label = []
-                    block[0] += self.dest_label(elem[1])
-                    out.extend(block)
-                    if bSetL:
-                        for l in bLabel:
-                            elem[2][0] += self.dest_label(l)
-                    out.extend(elem[2])
+                    stack.append([iter(elem[3]), [], elem, "#until", len(out)])
+                    break
                 # (#proc, blabel, code)
                 elif elem[0] == "#proc":
-                    if setLabel:
-                        for l in label:
-                            elem[2][0] += self.dest_label(l)
-                        setLabel = False
-                        label = []
+                    for l in label:
+                        elem[2][0].mark(l)
+                    label.clear()
                     out.extend(elem[2])
                     label.append(elem[1])
-                    setLabel = True
             else:
-                if setLabel:
+                stack.pop()
+                (_, _, elem, kind, start) = frame
+                if kind is None:
+                    return (out, len(label) > 0, label)
+                parent = stack[-1]
+                outer = parent[1]
+                if kind == "#if":
+                    outer.extend(label)
+                elif kind == "#ife":
+                    outer.extend(label)
+                    out.append(Instr("JUMP", self.to_label(elem[2])))
+                    stack.append([iter(elem[5]), [], elem, "#else", len(out)])
+                elif kind == "#else":
+                    outer.extend(label)
+                    # an empty block falls through to what follows the #ife
+                    if start < len(out):
+                        out[start].mark(elem[1])
+                    else:
+                        outer.append(elem[1])
+                    outer.append(elem[2])
+                elif kind == "#inf":
+                    jump = Instr("JUMP", self.to_label(elem[1]))
+                    first = out[start] if start < len(out) else jump
+                    for l in outer:
+                        first.mark(l)
+                    first.mark(elem[1])
+                    for l in label:
+                        first.mark(l)
+                    outer.clear()
+                    out.append(jump)
+                    # nothing after an infinite loop is reachable
+                    parent[0] = iter(())
+                elif kind == "#while":
+                    for l in label:
+                        elem[3][0].mark(l)
+                    out.append(Instr("JUMP", self.to_label(elem[2])))
+                    outer.append(elem[1])
+                elif kind == "#until":
+                    first = out[start] if start < len(out) else elem[2][0]
+                    for l in outer:
+                        first.mark(l)
+                    outer.clear()
+                    first.mark(elem[1])
                     for l in label:
-                        elem += self.dest_label(l)
-                    setLabel = False
-                    label = []
-                out.append(elem)
-        return (out, setLabel, label)
+                        elem[2][0].mark(l)
+                    out.extend(elem[2])
 
     def fin_glue_outer(self, code):
         (block, bSetL, bLabel) = self.fin_glue(code)
-        block.append("HALT")
+        block.append(Instr("HALT"))
         if bSetL:
             for l in bLabel:
-                block[-1] += self.dest_label(l)
+                block[-1].mark(l)
         return block
 
-    def fin_glue_proc(self, proc):
-        out = []
-        for (p, label) in proc:
-            (code, _, _) = self.fin_glue(p)
-            code[0] += self.dest_label(label)
-            out.extend(code)
-        return out
-
-    def fin_merge(self, main, proc):
+    # the program as a list of sections, nothing is copied. The mul/div/mod
+    # routines are added when the merged code jumps to them: fin_glue drops
+    # statements after an infinite loop, and a reused fragment gives its
+    # code only, so the flags set during code generation may be stale
+    def fin_merge(self, main, procs):
+        called = set()
+        for instr in itertools.chain(main, itertools.chain.from_iterable(procs)):
+            if type(instr.arg) is LabelRef:
+                called.add(instr.arg.label)
+        self.__outerMulIsUsed = self.__mul_label in called
+        self.__outerDivIsUsed = self.__div_label in called
+        self.__outerModIsUsed = self.__mod_label in called
+        sections = [main]
         if self.__outerMulIsUsed:
-            main.extend(self.outer_mul())
+            sections.append(self.outer_mul())
         if self.__outerDivIsUsed:
-            main.extend(self.outer_div())
+            sections.append(self.outer_div())
         if self.__outerModIsUsed:
-            main.extend(self.outer_mod())
-        main.extend(proc)
-        return main
-
-    def substitute_consts(self, code):
-        for idx, line in enumerate(code):
-            for match in re.finditer(r"\[@\#[^\]]+\]", line):
-                temp = line[match.start() + 3 : match.end() - 1]
-                i = self.getConst(int(temp))
-                code[idx] = line[: match.start()] + f"{i}" + line[(match.end() + 1) :]
-        code = self.__dataSection + code
+            sections.append(self.outer_mod())
+        sections.extend(procs)
+        return sections
+
+    # one pass: constants get their cells, label positions are recorded and
+    # references to labels are patched once the data section size is known;
+    # the data section goes in front of the other sections
+    def resolve(self, sections):
+        labels = {}
+        refs = []
+        for idx, instr in enumerate(itertools.chain.from_iterable(sections)):
+            if instr.labels is not None:
+                for l in instr.labels:
+                    labels[l] = idx
+            arg = instr.arg
+            if type(arg) is ConstRef:
+                instr.arg = self.getConst(arg.value)
+            elif type(arg) is LabelRef:
+                refs.append(instr)
+        base = len(self.__dataSection)
+        for instr in refs:
+            instr.arg = labels[instr.arg.label] + instr.arg.offset + base
+        self.__addresses = (labels, base)
+        return [self.__dataSection] + sections
+
+    # after resolve: (first instruction, source line, name) of the constants,
+    # main, the mul/div/mod routines and every procedure, in address order
+    def getSourceMap(self):
+        (labels, base) = self.__addresses
+        result = [(base, self.symbols_proc["main"].line, "main")]
+        if base > 0:
+            result.append((0, None, "const"))
+        for name, used, label in (
+            ("mul", self.__outerMulIsUsed, self.__mul_label),
+            ("div", self.__outerDivIsUsed, self.__div_label),
+            ("mod", self.__outerModIsUsed, self.__mod_label),
+        ):
+            if used:
+                result.append((labels[label] + base, None, name))
+        for name, proc in self.symbols_proc.items():
+            if name != "main" and proc.isCalled():
+                result.append((labels[proc.getLabel()] + base, proc.line, name))
+        result.sort(key=lambda entry: entry[0])
+        return result
+
+    # everything after parsing, for CParser and CFastParser
+    def compile_program(self, procedures, main):
+        if self.inlining:
+            with self.timed("inline"):
+                self.inline_procedures(procedures, main)
+        if self.hoisting:
+            with self.timed("hoist"):
+                self.hoist_invariants(main)
+                for proc in procedures:
+                    self.hoist_invariants(proc)
+        if self.strength_reduction:
+            with self.timed("strength"):
+                self.reduce_strength(main)
+                for proc in procedures:
+                    self.reduce_strength(proc)
+        if self.dead_stores:
+            with self.timed("dead_stores"):
+                self.remove_dead_stores(main)
+                for proc in procedures:
+                    self.remove_dead_stores(proc)
+        with self.timed("tree_walk"):
+            self.tree_walk(main)
+            self.tree_walk_proc(procedures)
+        self.place_variables(procedures, main)
+        t1 = self.fragment(main, self.glue_main)
+        f1 = self.process_list_procedures(procedures)
+        with self.timed("fin_merge"):
+            t1 = self.fin_merge(t1, f1)
+        if self.jump_threading:
+            with self.timed("jumps"):
+                t1 = self.thread_jumps(t1)
+        if self.peephole:
+            with self.timed("peephole"):
+                t1 = self.optimize_peephole(t1)
+        with self.timed("resolve"):
+            t1 = self.resolve(t1)
+        return t1
+
+    #!glue
+    # peephole
+    # every section is rewritten through a stack: each instruction is pushed
+    # and the rules whose window ends with it are tried on the top of the
+    # stack until none applies. Only the first instruction of a window may
+    # be a jump target, its labels go to the first instruction left in its
+    # place
+    def optimize_peephole(self, sections):
+        rules = {}
+        for rule in self.__peephole_rules:
+            for op in rule[1][-1]:
+                rules.setdefault(op, []).append(rule)
+        pinned = self.h_pinned(sections)
+        return [self.h_peephole(code, rules, pinned) for code in sections]
+
+    # windows are up to three instructions long
+    def h_peephole(self, code, rules, pinned):
+        out = []
+        removed = self.__removed
+        last = len(code) - 1
+        for idx, instr in enumerate(code):
+            out.append(instr)
+            nxt = code[idx + 1] if idx < last else None
+            while out:
+                top = out[-1]
+                target = top.labels is not None or id(top) in pinned
+                for name, ops, rewrite in rules.get(top.op, ()):
+                    n = len(ops)
+                    if n > 1:
+                        if target or len(out) < n:
+                            continue
+                        prev = out[-2]
+                        if prev.op not in ops[-2]:
+                            continue
+                        if n > 2 and (
+                            prev.labels is not None
+                            or id(prev) in pinned
+                            or out[-3].op not in ops[0]
+                        ):
+                            continue
+                    window = out[-n:]
+                    new = rewrite(self, window, nxt)
+                    if new is None:
+                        continue
+                    first = window[0]
+                    if not new or new[0] is not first:
+                        if id(first) in pinned:
+                            continue
+                        heir = new[0] if new else nxt
+                        if heir is None:
+                            continue
+                        if first.labels is not None:
+                            heir.mark(*first.labels)
+                        if heir.comment is None:
+                            heir.comment = first.comment
+                    del out[-n:]
+                    out.extend(new)
+                    removed[name] = removed.get(name, 0) + n - len(new)
+                    break
+                else:
+                    break
+        return out
+
+    # the instructions from one referenced with an offset (to_label_next)
+    # up to the one the offset points at are neither removed nor moved
+    def h_pinned(self, sections):
+        offsets = {}
+        for instr in itertools.chain.from_iterable(sections):
+            arg = instr.arg
+            if type(arg) is LabelRef and arg.offset > 0:
+                offsets[arg.label] = max(offsets.get(arg.label, 0), arg.offset)
+        pinned = set()
+        if not offsets:
+            return pinned
+        left = 0
+        for instr in itertools.chain.from_iterable(sections):
+            if left > 0:
+                pinned.add(id(instr))
+                left -= 1
+            if instr.labels is not None:
+                for l in instr.labels:
+                    if l in offsets:
+                        pinned.add(id(instr))
+                        left = max(left, offsets[l])
+        return pinned
+
+    def h_same_arg(self, a, b):
+        if type(a) is ConstRef:
+            return type(b) is ConstRef and a.value == b.value
+        return type(a) is int and a == b
+
+    # STORE x; LOAD x
+    def p_store_load(self, w, nxt):
+        if self.h_same_arg(w[0].arg, w[1].arg):
+            return [w[0]]
+
+    # LOAD x; STORE x
+    def p_load_store(self, w, nxt):
+        if self.h_same_arg(w[0].arg, w[1].arg):
+            return [w[0]]
+
+    def p_store_store(self, w, nxt):
+        if self.h_same_arg(w[0].arg, w[1].arg):
+            return [w[0]]
+
+    # the first value of p_0 is overwritten before it is read
+    def p_dead_load(self, w, nxt):
+        (op, arg) = (w[1].op, w[1].arg)
+        if op == "SET":
+            return [w[1]]
+        # LOAD 0 and LOADI 0 read p_0, GET x writes it only for x = 0
+        zero = type(arg) is int and arg == 0
+        if zero == (op == "GET"):
+            return [w[1]]
+
+    # SET k; STORE x; SET k: p_0 still holds k, a LOAD y likewise still
+    # holds y, stored to or not
+    def p_reload(self, w, nxt):
+        if w[0].op == w[2].op and self.h_same_arg(w[0].arg, w[2].arg):
+            return w[:2]
+
+    # SET k; ADD 0
+    def p_double(self, w, nxt):
+        (k, arg) = (w[0].arg, w[1].arg)
+        if type(k) is int and type(arg) is int and arg == 0:
+            if 2 * k <= self.__max_const:
+                return [Instr("SET", 2 * k)]
+
+    # SET 0; ADD x
+    def p_zero_add(self, w, nxt):
+        (k, arg) = (w[0].arg, w[1].arg)
+        if type(k) is int and k == 0 and not (type(arg) is int and arg == 0):
+            return [Instr("LOAD" if w[1].op == "ADD" else "LOADI", arg)]
+
+    # ADD 0; HALF
+    def p_double_half(self, w, nxt):
+        arg = w[0].arg
+        if type(arg) is int and arg == 0:
+            return []
+
+    # a jump to the instruction right after it
+    def p_jump_next(self, w, nxt):
+        arg = w[0].arg
+        if type(arg) is LabelRef and arg.offset == 0 and nxt is not None:
+            if nxt.labels is not None and arg.label in nxt.labels:
+                return []
+
+    # LOAD 0, STORE 0
+    def p_nop(self, w, nxt):
+        arg = w[0].arg
+        if type(arg) is int and arg == 0:
+            return []
+
+    # (name, opcodes allowed at each position of the window, rewrite); a
+    # rewrite gets the window and the instruction after it and returns what
+    # replaces the window or None
+    __peephole_rules = (
+        ("store_load", (("STORE",), ("LOAD",)), p_store_load),
+        ("store_load", (("STOREI",), ("LOADI",)), p_store_load),
+        ("load_store", (("LOAD",), ("STORE",)), p_load_store),
+        ("load_store", (("LOADI",), ("STOREI",)), p_load_store),
+        ("store_store", (("STORE",), ("STORE",)), p_store_store),
+        ("store_store", (("STOREI",), ("STOREI",)), p_store_store),
+        (
+            "reload",
+            (("SET", "LOAD"), ("STORE", "STOREI"), ("SET", "LOAD")),
+            p_reload,
+        ),
+        (
+            "dead_load",
+            (("SET", "LOAD", "LOADI"), ("SET", "LOAD", "LOADI", "GET")),
+            p_dead_load,
+        ),
+        ("double", (("SET",), ("ADD",)), p_double),
+        ("zero_add", (("SET",), ("ADD", "ADDI")), p_zero_add),
+        ("double_half", (("ADD",), ("HALF",)), p_double_half),
+        ("jump_next", (("JUMP", "JPOS", "JZERO"),), p_jump_next),
+        ("nop", (("LOAD", "STORE"),), p_nop),
+    )
+
+    #!peephole
+    # jumps
+    __inverse = {"JPOS": "JZERO", "JZERO": "JPOS"}
+
+    # repeated until nothing changes: jumps are sent straight to the end of
+    # their chains, a conditional jump over a JUMP is inverted into one
+    # jump, and code after JUMP, JUMPI or HALT that no label leads to is
+    # dropped
+    def thread_jumps(self, sections):
+        pinned = self.h_pinned(sections)
+        while True:
+            code = list(itertools.chain.from_iterable(sections))
+            pos = {}
+            for idx, instr in enumerate(code):
+                if instr.labels is not None:
+                    for l in instr.labels:
+                        pos[l] = idx
+            changed = self.h_thread(code, pos)
+            dropped = self.h_invert(code, pos, pinned)
+            self.h_unreachable(code, pinned, dropped)
+            if dropped:
+                sections = [
+                    [instr for instr in section if id(instr) not in dropped]
+                    for section in sections
+                ]
+            elif not changed:
+                return sections
+
+    # a JUMP goes on through the JUMPs it lands on, JPOS and JZERO also
+    # through jumps of their own kind, the accumulator being unchanged
+    def h_thread(self, code, pos):
+        changed = False
+        for instr in code:
+            op = instr.op
+            if op != "JUMP" and op != "JPOS" and op != "JZERO":
+                continue
+            arg = instr.arg
+            if type(arg) is not LabelRef:
+                continue
+            seen = {id(instr)}
+            dest = arg
+            while True:
+                target = code[pos[dest.label] + dest.offset]
+                if target.op != "JUMP" and target.op != op:
+                    break
+                if type(target.arg) is not LabelRef or id(target) in seen:
+                    break
+                seen.add(id(target))
+                dest = target.arg
+            if pos[dest.label] + dest.offset != pos[arg.label] + arg.offset:
+                instr.arg = dest
+                self.__jumps["threaded"] += 1
+                changed = True
+        return changed
+
+    # JPOS L; JUMP M; L: ... becomes JZERO M; L: ..., likewise with JZERO
+    def h_invert(self, code, pos, pinned):
+        dropped = set()
+        for idx in range(len(code) - 2):
+            instr = code[idx]
+            op = self.__inverse.get(instr.op)
+            if op is None or type(instr.arg) is not LabelRef:
+                continue
+            jump = code[idx + 1]
+            if jump.op != "JUMP" or id(jump) in dropped:
+                continue
+            if jump.labels is not None or id(jump) in pinned:
+                continue
+            if pos[instr.arg.label] + instr.arg.offset != idx + 2:
+                continue
+            instr.op = op
+            instr.arg = jump.arg
+            dropped.add(id(jump))
+            self.__jumps["inverted"] += 1
+        return dropped
+
+    # adds the unreachable instructions to dropped
+    def h_unreachable(self, code, pinned, dropped):
+        used = set()
+        for instr in code:
+            if type(instr.arg) is LabelRef:
+                used.add(instr.arg.label)
+        for label in (self.__mul_label, self.__div_label, self.__mod_label):
+            used.add(label)
+        for proc in self.symbols_proc.values():
+            used.add(proc.getLabel())
+        dead = False
+        for instr in code:
+            if id(instr) in dropped:
+                continue
+            if id(instr) in pinned or (
+                instr.labels is not None and not used.isdisjoint(instr.labels)
+            ):
+                dead = False
+            elif dead:
+                dropped.add(id(instr))
+                self.__jumps["unreachable"] += 1
+                continue
+            op = instr.op
+            dead = op == "JUMP" or op == "JUMPI" or op == "HALT"
+
+    #!jumps
+    # fragments
+    def glue_main(self, l):
+        with self.timed("process_list"):
+            t = self.process_list(l)
+        with self.timed("glue"):
+            return self.fin_glue_outer(t)
+
+    def glue_proc(self, l):
+        with self.timed("process_list"):
+            t = self.process_list(l)
+        t.append(Instr("JUMPI", self.symbols_proc[l[0]].getBackAdd()))
+        with self.timed("glue"):
+            (code, _, _) = self.fin_glue(t)
         return code
 
-    def substitute_labels(self, code):
-        labels = {}
-        for idx, line in enumerate(code):
-            for match in re.finditer(r"\[LBL\#[^\]]+\]", line):
-                temp = line[match.start() + 5 : match.end() - 1]
-                labels[int(temp)] = idx
-        for idx, line in enumerate(code):
-            for match in re.finditer(r"\[TO\#[^\]]+\]", line):
-                next = 0
-                if line[match.start() + 4] == "$":
-                    next = 1
-                temp = line[(match.start() + 4 + next) : match.end() - 1]
-                code[idx] = (
-                    line[: match.start()]
-                    + f"{labels[int(temp)] + next} "
-                    + line[match.start() :]
-                )
+    # a block is reused from self.fragments when its body, its own symbols,
+    # the interfaces of its callees and the global codegen switches are
+    # unchanged; labels and helper registers are stored symbolically
+    def fragment(self, l, glue):
+        if self.fragments is None:
+            return glue(l)
+        with self.timed("fragments"):
+            key = self.fragments.fragment_key(self.fragment_source(l, glue))
+            frag = self.fragments.get_fragment(key)
+            if frag is not None:
+                return self.import_fragment(frag)
+            start = self.fragment_start()
+            code = glue(l)
+            self.fragments.put_fragment(key, self.export_fragment(code, start))
+            return code
+
+    def fragment_source(self, l, glue):
+        sym_proc = self.symbols_proc[l[0]]
+        callees = set()
+        body = self.h_fragment_ast(l[1], callees)
+        symbols = sorted(
+            (name, var.address, var.mode.value)
+            for name, var in sym_proc.symbols.items()
+        )
+        interfaces = []
+        for name in sorted(callees):
+            proc = self.symbols_proc[name]
+            params = tuple(var.address for var in proc.params)
+            interfaces.append((name, params, proc.getBackAdd()))
+        back = sym_proc.getBackAdd() if glue == self.glue_proc else None
+        switches = (
+            self.__no_muls > 0,
+            self.__no_divs > 0,
+            self.propagation,
+            self.tracking,
+        )
+        return marshal.dumps(
+            (glue.__name__, switches, tuple(symbols), back, tuple(interfaces), body)
+        )
+
+    # parse time labels are left out, they only name their own statement.
+    # Flattened in source order, a block is given by its number of
+    # statements, so deep nesting stays within marshal's depth limit
+    def h_fragment_ast(self, l, callees):
+        out = []
+        stack = [iter(l)]
+        while stack:
+            for line in stack[-1]:
+                if line[0] == "#assign":
+                    out.append(("=", line[1], self.h_fragment_exp(line[2])))
+                elif line[0] == "#write":
+                    out.append(("w", self.h_fragment_exp(line[1])))
+                elif line[0] == "#read":
+                    out.append(("r", line[1]))
+                elif line[0] == "#dead":
+                    out.append(("d", line[1], self.h_fragment_exp(line[2])))
+                elif line[0] == "#touch":
+                    out.append(("t", tuple(line[1])))
+                elif line[0] == "#if":
+                    out.append(("if", self.h_fragment_exp(line[2]), len(line[3])))
+                    stack.append(iter(line[3]))
+                    break
+                elif line[0] == "#ife":
+                    out.append(
+                        (
+                            "ife",
+                            self.h_fragment_exp(line[3]),
+                            len(line[4]),
+                            len(line[5]),
+                        )
+                    )
+                    stack.append(iter(line[5]))
+                    stack.append(iter(line[4]))
+                    break
+                elif line[0] == "#while":
+                    out.append(("while", self.h_fragment_exp(line[3]), len(line[4])))
+                    stack.append(iter(line[4]))
+                    break
+                elif line[0] == "#until":
+                    out.append(("until", self.h_fragment_exp(line[2]), len(line[3])))
+                    stack.append(iter(line[3]))
+                    break
+                elif line[0] == "#proc":
+                    callees.add(line[1])
+                    out.append(("proc", line[1], tuple(line[3])))
+            else:
+                stack.pop()
+        return tuple(out)
+
+    def h_fragment_exp(self, exp):
+        if type(exp) is ValueObject:
+            return (exp.vType.value, exp.data)
+        return (
+            exp.oType.value,
+            self.h_fragment_exp(exp.left),
+            self.h_fragment_exp(exp.right),
+        )
+
+    # where the log of a block starts; helper registers are counted from here
+    def fragment_start(self):
+        self.__helpers_asked = 0
+        return len(self.__log)
+
+    # labels become local numbers, procedure names or "@mul"/"@div"/"@mod";
+    # helper registers become their index. Stored column-wise, only the
+    # instructions with symbolic parts are listed in fixups/marks/comments
+    def export_fragment(self, code, start):
+        names = {}
+        for name, proc in self.symbols_proc.items():
+            names[proc.getLabel()] = name
+        names[self.__mul_label] = "@mul"
+        names[self.__div_label] = "@div"
+        names[self.__mod_label] = "@mod"
+        helpers = {}
+        for idx, address in enumerate(self.__helper_reg):
+            helpers[address] = idx
+        local = {}
+        # code dropped after an infinite loop may have asked for more
+        nhelpers = self.__helpers_asked
+        ops = []
+        args = []
+        fixups = []
+        marks = []
+        comments = []
+        for idx, instr in enumerate(code):
+            ops.append(instr.op)
+            arg = instr.arg
+            if type(arg) is LabelRef:
+                label = self.h_export_label(arg.label, names, local)
+                fixups.append((idx, "L", label, arg.offset))
+                arg = None
+            elif type(arg) is ConstRef:
+                fixups.append((idx, "C", arg.value, 0))
+                arg = None
+            elif instr.op in self.__address_ops and arg in helpers:
+                fixups.append((idx, "H", helpers[arg], 0))
+                nhelpers = max(nhelpers, helpers[arg] + 1)
+                arg = None
+            args.append(arg)
+            if instr.labels is not None:
+                labels = [self.h_export_label(l, names, local) for l in instr.labels]
+                marks.append((idx, tuple(labels)))
+            if instr.comment is not None:
+                comments.append((idx, instr.comment))
+        return (
+            tuple(self.__log[start:]),
+            len(local),
+            nhelpers,
+            tuple(ops),
+            tuple(args),
+            tuple(fixups),
+            tuple(marks),
+            tuple(comments),
+        )
+
+    def h_export_label(self, label, names, local):
+        if label in names:
+            return names[label]
+        if label not in local:
+            local[label] = len(local)
+        return local[label]
+
+    # replays what compiling the block did: warnings, calls and helper
+    # registers; fin_merge adds the mul/div/mod routines the code jumps to
+    def import_fragment(self, frag):
+        (warnings, nlabels, nhelpers, ops, args, fixups, marks, comments) = frag
+        for msg in warnings:
+            self.warn(msg)
+        for n in range(nhelpers):
+            self.getHelperReg(n)
+        helpers = self.__helper_reg
+        code = list(map(Instr, ops, args))
+        # local labels get a fresh consecutive range
+        first = self.__label_no + 1
+        self.__label_no += nlabels
+        for (idx, kind, value, offset) in fixups:
+            if kind == "L":
+                if type(value) is int:
+                    value += first
+                else:
+                    value = self.h_import_label(value)
+                code[idx].arg = LabelRef(value, offset)
+            elif kind == "C":
+                code[idx].arg = ConstRef(value)
+            else:
+                code[idx].arg = helpers[value]
+        for (idx, labels) in marks:
+            code[idx].labels = [
+                l + first if type(l) is int else self.h_import_label(l) for l in labels
+            ]
+        for (idx, comment) in comments:
+            code[idx].comment = comment
         return code
 
-    #!glue
+    # procedure bodies are compiled in codegen_jobs worker processes, each
+    # with its own labels and addresses; importing the fragments in the
+    # sequential order renumbers them exactly as compiling here would. The
+    # workers get the processor and the bodies once, when they start
+    def glue_parallel(self, procs):
+        jobs = []
+        misses = []
+        for proc in procs:
+            key = None
+            frag = None
+            if self.fragments is not None:
+                with self.timed("fragments"):
+                    source = self.fragment_source(proc, self.glue_proc)
+                    key = self.fragments.fragment_key(source)
+                    frag = self.fragments.get_fragment(key)
+            if frag is None:
+                misses.append(proc)
+            jobs.append((key, frag))
+        frags = iter(())
+        pool = None
+        if misses:
+            pool = ProcessPoolExecutor(
+                min(self.codegen_jobs, len(misses)),
+                initializer=_init_codegen,
+                initargs=(self.h_worker_state(), misses),
+            )
+            frags = pool.map(_glue_procedure, range(len(misses)))
+        try:
+            codes = []
+            for key, frag in jobs:
+                if frag is None:
+                    with self.timed("parallel"):
+                        frag = next(frags)
+                    if key is not None:
+                        self.fragments.put_fragment(key, frag)
+                with self.timed("fragments"):
+                    codes.append(self.import_fragment(frag))
+            return codes
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    def h_worker_state(self):
+        state = dict(self.__dict__)
+        state["fragments"] = None
+        state["timings"] = None
+        state["codegen_jobs"] = 0
+        return state
+
+    def h_import_label(self, label):
+        if label == "@mul":
+            return self.getMulLabel()
+        elif label == "@div":
+            return self.getDivLabel()
+        elif label == "@mod":
+            return self.getModLabel()
+        else:
+            return self.symbols_proc[label].getLabel()
+
+    #!fragments
     def createConst(self, num: int):
         i = self.getNewAddress()
         self.data[num] = i
-        self.__dataSection.append(f"SET {num}")
-        self.__dataSection.append(f"STORE {i} [const]")
+        self.__dataSection.append(Instr("SET", num))
+        self.__dataSection.append(Instr("STORE", i, comment="const"))
         return i
 
     def getConst(self, num: int):
@@ -1744,4 +3487,22 @@ class CProcessor:
             return self.createConst(num)
 
     def const_tag(self, const: int):
-        return f" [{self.__const_tag}{const}]"
+        return ConstRef(const)
+
+
+# worker side of CProcessor.glue_parallel: one processor per worker, it
+# compiles its share of the bodies one after another like the parent would
+_codegen = None
+
+
+def _init_codegen(state, procs):
+    global _codegen
+    proc = CProcessor.__new__(CProcessor)
+    proc.__dict__.update(state)
+    _codegen = (proc, procs)
+
+
+def _glue_procedure(idx):
+    (proc, procs) = _codegen
+    start = proc.fragment_start()
+    return proc.export_fragment(proc.glue_proc(procs[idx]), start)
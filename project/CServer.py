@@ -0,0 +1,96 @@
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import kompilator
+import os
+import signal
+import socket
+import sys
+
+# protocol: one JSON line each way on a Unix socket
+#   request:  {"args": <parsed command line>, "cwd": <client directory>}
+#   response: {"out": <what kompilator.py would print>, "code": <exit status>}
+
+
+class CServer:
+    def __init__(self, path, workers):
+        self.path = path
+        self.workers = workers
+        self.pool = None
+
+    # the pool is warmed up front: every worker imports the compiler and
+    # loads the parse tables once, compile_source starts each compilation
+    # from fresh state
+    def start_pool(self):
+        self.pool = ProcessPoolExecutor(self.workers)
+        n = self.workers or os.cpu_count() or 1
+        list(self.pool.map(_ping, range(n)))
+
+    async def handle(self, reader, writer):
+        try:
+            request = json.loads(await reader.readline())
+            response = await self.compile(request)
+        except Exception as e:
+            response = {"out": f"Error: {e}\n", "code": 1}
+        writer.write(json.dumps(response).encode() + b"\n")
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def compile(self, request):
+        args = argparse.Namespace(**request["args"])
+        (cache, jobs) = kompilator.prepare(args, request["cwd"])
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(self.pool, kompilator.run_job, j) for j in jobs)
+        )
+        # no await below, so the redirect cannot catch another request
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            failed = kompilator.report(args, cache, results, request["cwd"])
+        return {"out": out.getvalue(), "code": 1 if failed > 0 else 0}
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set_result, None)
+        server = await asyncio.start_unix_server(self.handle, path=self.path)
+        print(f"listening on {self.path}", flush=True)
+        async with server:
+            await stop
+
+
+# CParser is imported on first use, the warm-up does it in every worker
+def _ping(_):
+    kompilator.make_parser("sly")
+    return os.getpid()
+
+
+def in_use(path):
+    with socket.socket(socket.AF_UNIX) as s:
+        try:
+            s.connect(path)
+        except OSError:
+            return False
+    return True
+
+
+def serve(args):
+    if os.path.exists(args.socket):
+        if in_use(args.socket):
+            print(f"Error: a server is already listening on {args.socket}")
+            sys.exit(1)
+        os.remove(args.socket)
+    server = CServer(args.socket, args.jobs)
+    server.start_pool()
+    try:
+        asyncio.run(server.run())
+    finally:
+        server.pool.shutdown()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
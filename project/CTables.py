@@ -0,0 +1,85 @@
+from sly.yacc import YaccError
+import marshal
+import os
+import sly
+import zlib
+
+# bump when the cached layout changes
+TABLE_VERSION = 1
+
+
+class CachedTable:
+    def __init__(self, lr_action, lr_goto, defaulted_states):
+        self.lr_action = lr_action
+        self.lr_goto = lr_goto
+        self.defaulted_states = defaulted_states
+
+
+# everything the LALR construction depends on; stored in the cache file and
+# compared on load, its crc only names the file
+def grammar_signature(cls):
+    lines = [
+        f"{TABLE_VERSION} {sly.__version__}",
+        " ".join(sorted(cls.tokens)),
+        str(getattr(cls, "start", None)),
+        repr(getattr(cls, "precedence", None)),
+    ]
+    lines.extend(str(p) for p in cls._grammar.Productions)
+    return "\n".join(lines)
+
+
+def table_path(cls, signature):
+    cache_dir = os.environ.get("KOMPILATOR_TABLE_CACHE")
+    if cache_dir is None:
+        cache_dir = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "__pycache__"
+        )
+    key = zlib.crc32(signature.encode())
+    return os.path.join(cache_dir, f"{cls.__name__}.{key:08x}.lrtab")
+
+
+def load_table(path, signature):
+    try:
+        with open(path, "rb") as f:
+            data = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if type(data) is not tuple or len(data) != 4 or data[0] != signature:
+        return None
+    return CachedTable(data[1], data[2], data[3])
+
+
+def store_table(path, signature, lrtable):
+    data = (signature, lrtable.lr_action, lrtable.lr_goto, lrtable.defaulted_states)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp, "wb") as f:
+            marshal.dump(data, f)
+        os.replace(tmp, path)
+    except OSError:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+# replaces Parser._build: the grammar is still built from the @_ rules (it
+# is cheap and carries the rule functions), only the LALR tables come from
+# the cache when the grammar signature matches
+def build(cls, definitions):
+    rules = [
+        (name, value)
+        for name, value in definitions
+        if callable(value) and hasattr(value, "rules")
+    ]
+    if not cls._Parser__validate_specification():
+        raise YaccError("Invalid parser specification")
+    cls._Parser__build_grammar(rules)
+    signature = grammar_signature(cls)
+    path = table_path(cls, signature)
+    table = load_table(path, signature)
+    if table is not None:
+        cls._lrtable = table
+        return
+    if not cls._Parser__build_lrtables():
+        raise YaccError("Can't build parsing tables")
+    store_table(path, signature, cls._lrtable)
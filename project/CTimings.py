@@ -0,0 +1,78 @@
+import contextlib
+import time
+import tracemalloc
+
+# display order, phases that did not run are left out
+PHASES = (
+    "lex",
+    "parse",
+    "inline",
+    "hoist",
+    "strength",
+    "dead_stores",
+    "tree_walk",
+    "process_list",
+    "glue",
+    "fragments",
+    "parallel",
+    "fin_merge",
+    "jumps",
+    "peephole",
+    "resolve",
+)
+
+
+# wall time and tracemalloc peak per compiler phase. Phases may nest, the
+# outer one is paused meanwhile, so the times add up to the whole compile;
+# peak is the most memory traced at any point during the phase
+class Timings:
+    def __init__(self):
+        self.phases = {}
+        self.__stack = []
+        self.__started = False
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.__started = True
+
+    def stop(self):
+        if self.__started:
+            tracemalloc.stop()
+            self.__started = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        now = time.perf_counter()
+        if self.__stack:
+            outer = self.__stack[-1]
+            self.add(outer[0], now - outer[1], 0)
+        self.__stack.append([name, now])
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            (name, start) = self.__stack.pop()
+            self.add(name, now - start, 1)
+            if self.__stack:
+                self.__stack[-1][1] = now
+                tracemalloc.reset_peak()
+
+    def add(self, name, elapsed, calls):
+        peak = tracemalloc.get_traced_memory()[1]
+        entry = self.phases.get(name)
+        if entry is None:
+            self.phases[name] = [calls, elapsed, peak]
+        else:
+            entry[0] += calls
+            entry[1] += elapsed
+            entry[2] = max(entry[2], peak)
+
+    def report(self):
+        result = {}
+        for name in PHASES:
+            if name in self.phases:
+                (calls, elapsed, peak) = self.phases[name]
+                result[name] = {"calls": calls, "time": elapsed, "peak": peak}
+        return result
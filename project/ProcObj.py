@@ -20,7 +20,9 @@ class OpType(Enum):
     LE = 10
 
 
+# data: the value of a NUM, the name of a VAR
 class ValueObject:
+    __slots__ = ("vType", "data")
     vType: "ValueType"
 
     def __init__(self, t: "ValueType", data):
@@ -32,6 +34,7 @@ class ValueObject:
 
 
 class ExpObject:
+    __slots__ = ("oType", "left", "right", "dest")
     oType: "OpType"
 
     def __init__(self, t: "OpType", left, right, dest=None):
@@ -0,0 +1,45 @@
+import CCli
+import json
+import os
+import socket
+import sys
+
+
+# sends the parsed command line to the compile server, None if no server
+# is listening
+def request(args):
+    with socket.socket(socket.AF_UNIX) as s:
+        try:
+            s.connect(args.socket)
+        except OSError:
+            return None
+        data = {"args": vars(args), "cwd": os.getcwd()}
+        s.sendall(json.dumps(data).encode() + b"\n")
+        chunks = []
+        while True:
+            chunk = s.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return json.loads(b"".join(chunks))
+
+
+def main():
+    argp = CCli.make_argparser("klient.py")
+    args = argp.parse_args()
+    CCli.check_args(argp, args)
+    response = None
+    if not args.serve:
+        response = request(args)
+    if response is None:
+        # no server running, compile here
+        import kompilator
+
+        kompilator.run(args)
+        return
+    sys.stdout.write(response["out"])
+    sys.exit(response["code"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,443 @@
-from CLexer import CLexer
-from CParser import CParser
+from CFastLexer import CFastLexer
+from CFastParser import CFastParser
+from CProcessor import CProcessor
+from concurrent.futures import ProcessPoolExecutor
+import CCache
+import CCli
+import CObject
+import CTimings
+import contextlib
+import io
+import itertools
+import json
+import os
 import sys
 
+OPTIONS = {
+    # fragment store for per-procedure reuse, see CCache.CompileCache
+    "fragments": None,
+    # per-phase wall time and peak memory in CompileResult.timings
+    "timings": False,
+    # worker processes generating procedure code, sequential below 2
+    "codegen_jobs": 0,
+    # "sly" (CParser) or the hand-written "fast" one (CFastParser)
+    "parser": "sly",
+    # copy the bodies of called procedures into their callers
+    "inlining": True,
+    # how much inlining may grow the program, in percent of its statements
+    "inline_growth": 100,
+    # compute what does not change in a loop once, before it
+    "hoisting": True,
+    # add to a variable instead of multiplying a loop counter in every pass
+    "strength_reduction": True,
+    # carry known constants and copies of variables into later statements
+    "propagation": True,
+    # leave out loads of what the accumulator already holds
+    "tracking": True,
+    # turn stores no later statement reads into no code
+    "dead_stores": True,
+    # send jumps to the end of jump chains, drop unreachable code
+    "jump_threading": True,
+    # rewrite the merged code with CProcessor's peephole rules
+    "peephole": True,
+}
+PARSERS = ("sly", "fast")
+# options that change the generated code, part of the cache key
+CODE_OPTIONS = (
+    "inlining",
+    "inline_growth",
+    "hoisting",
+    "strength_reduction",
+    "propagation",
+    "tracking",
+    "dead_stores",
+    "jump_threading",
+    "peephole",
+)
 
-def main():
-    inFile = open(sys.argv[1], "r")
+
+class CompileError(Exception):
+    def __init__(self, message, log):
+        super().__init__(message)
+        self.log = log
+
+
+# code sections in address order: constants, main, mul/div/mod, procedures
+class CompileResult:
+    def __init__(self, sections, log, stats, timings=None, source_map=None):
+        self.sections = sections
+        self.log = log
+        self.stats = stats
+        self.timings = timings
+        self.source_map = source_map
+
+    # a new flat list on every access
+    @property
+    def code(self):
+        return list(self.instructions())
+
+    def instructions(self):
+        return itertools.chain.from_iterable(self.sections)
+
+    def lines(self):
+        return map(str, self.instructions())
+
+    def text(self):
+        return "\n".join(self.lines())
+
+    # text() to a file, joined chunk lines at a time
+    def write(self, f, chunk=4096):
+        lines = self.lines()
+        sep = ""
+        while True:
+            block = list(itertools.islice(lines, chunk))
+            if not block:
+                return
+            f.write(sep)
+            f.write("\n".join(block))
+            sep = "\n"
+
+    # the CObject object file, decodes back to text()
+    def binary(self, source_map=True):
+        return CObject.encode(
+            self.instructions(), self.source_map if source_map else None
+        )
+
+
+# compiles one program in memory. Every call gets its own lexer, parser and
+# CProcessor, so no state is shared between compilations; raises
+# CompileError with the message kompilator.py prints and the warnings so far
+def compile_source(text, options=None):
+    opts = dict(OPTIONS)
+    if options is not None:
+        for name in options:
+            if name not in OPTIONS:
+                raise ValueError(f"Unknown option {name}")
+        opts.update(options)
+    if opts["parser"] not in PARSERS:
+        raise ValueError(f"Unknown parser {opts['parser']}")
+    parser = make_parser(opts["parser"])
+    parser.proc = CProcessor()
+    parser.proc.fragments = opts["fragments"]
+    parser.proc.codegen_jobs = opts["codegen_jobs"]
+    parser.proc.inlining = opts["inlining"]
+    parser.proc.inline_growth = opts["inline_growth"]
+    parser.proc.hoisting = opts["hoisting"]
+    parser.proc.strength_reduction = opts["strength_reduction"]
+    parser.proc.propagation = opts["propagation"]
+    parser.proc.tracking = opts["tracking"]
+    parser.proc.dead_stores = opts["dead_stores"]
+    parser.proc.jump_threading = opts["jump_threading"]
+    parser.proc.peephole = opts["peephole"]
+    timings = None
+    if opts["timings"]:
+        # lexing is done up front to be measured on its own
+        timings = CTimings.Timings()
+        parser.proc.timings = timings
+        timings.start()
+    try:
+        if timings is None:
+            code = parser.parse(CFastLexer().tokenize(text))
+        else:
+            with timings.phase("lex"):
+                tokens = list(CFastLexer().tokenize(text))
+            with timings.phase("parse"):
+                code = parser.parse(iter(tokens))
+        if code is None:
+            raise CompileError("Compilation failed!", parser.proc.getLog())
+    except CompileError:
+        raise
+    except TypeError:
+        raise CompileError("Compilation failed!", parser.proc.getLog())
+    except Exception as e:
+        raise CompileError(f"Error: {e}", parser.proc.getLog())
+    finally:
+        if timings is not None:
+            timings.stop()
+    proc = parser.proc
+    result = CompileResult(code, proc.getLog(), proc.getStats(code))
+    result.source_map = proc.getSourceMap()
+    if timings is not None:
+        result.timings = timings.report()
+    return result
+
+
+# sly and the parse tables are only loaded when CParser is used
+def make_parser(name):
+    if name == "fast":
+        return CFastParser()
+    from CParser import CParser
+
+    return CParser()
+
+
+# returns (error message or None, CompileResult or None when taken from
+# the cache). A timed compilation does not take its result from the cache,
+# neither does one writing an object file or statistics (the cache keeps
+# neither a source map nor statistics)
+def compile_file(inPath, outPath, cache=None, options=None):
+    options = dict(options or ())
+    binary = options.pop("binary", False)
+    stats = options.pop("stats", False)
+    inFile = open(inPath, "r")
     inData = inFile.read()
     inFile.close()
-    lexer = CLexer()
-    parser = CParser()
+    if cache is not None:
+        key = cache.key(
+            inData, [(name, options.get(name, OPTIONS[name])) for name in CODE_OPTIONS]
+        )
+        hit = None
+        if not options.get("timings") and not binary and not stats:
+            hit = cache.get(key)
+        if hit is not None:
+            sys.stdout.write(hit[0])
+            write_output(outPath, hit[1])
+            return (None, None)
+    options["fragments"] = cache
     try:
-        result = parser.parse(lexer.tokenize(inData))
-        result = "\n".join(result)
-        outFile = open(sys.argv[2], "w")
-        outFile.write(result)
-        outFile.close()
-    except TypeError as e:
-        print("Compilation failed!")
-    except Exception as e:
-        print(f"Error: {e}")
+        result = compile_source(inData, options)
+    except CompileError as e:
+        print_log(e.log)
+        return (str(e), None)
+    print_log(result.log)
+    with open(outPath, "w") as f:
+        result.write(f)
+    if binary:
+        with open(object_path(outPath), "wb") as f:
+            f.write(result.binary())
+    if cache is not None:
+        cache.put_file(key, "".join(f"{msg}\n" for msg in result.log), outPath)
+    return (None, result)
+
+
+def print_log(log):
+    for msg in log:
+        print(msg)
+
+
+def write_output(outPath, result):
+    outFile = open(outPath, "w")
+    outFile.write(result)
+    outFile.close()
+
+
+# next to the text output: prog.mr -> prog.mrb
+def object_path(outPath):
+    (root, ext) = os.path.splitext(outPath)
+    if ext == ".mrb":
+        return outPath + ".mrb"
+    return root + ".mrb"
+
+
+# batch
+# job: (name shown in the log, input path, output path, cache, options)
+def run_job(job):
+    name, inPath, outPath, cache, options = job
+    log = io.StringIO()
+    timings = None
+    stats = None
+    with contextlib.redirect_stdout(log):
+        try:
+            (err, result) = compile_file(inPath, outPath, cache, options)
+            if result is not None:
+                timings = result.timings
+                if options.get("stats"):
+                    stats = result.stats
+        except OSError as e:
+            err = f"Error: {e}"
+    counters = cache.take_counters() if cache is not None else None
+    return (name, err, log.getvalue(), counters, timings, stats)
+
+
+def collect_jobs(paths, outDir, cache, options, cwd=os.curdir):
+    if outDir is not None:
+        outDir = os.path.join(cwd, outDir)
+    jobs = []
+    for path in paths:
+        full = os.path.join(cwd, path)
+        if os.path.isdir(full):
+            for root, dirs, files in os.walk(full):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".imp"):
+                        inPath = os.path.join(root, name)
+                        rel = os.path.relpath(inPath, full)
+                        outPath = out_path(inPath, rel, outDir)
+                        name = os.path.join(path, rel)
+                        jobs.append((name, inPath, outPath, cache, options))
+        else:
+            outPath = out_path(full, os.path.basename(path), outDir)
+            jobs.append((path, full, outPath, cache, options))
+    return jobs
+
+
+def out_path(inPath, rel, outDir):
+    if outDir is None:
+        return os.path.splitext(inPath)[0] + ".mr"
+    outPath = os.path.join(outDir, os.path.splitext(rel)[0] + ".mr")
+    os.makedirs(os.path.dirname(outPath), exist_ok=True)
+    return outPath
+
+
+def batch(jobs, workers):
+    chunk = max(1, len(jobs) // ((workers or os.cpu_count() or 1) * 4))
+    with ProcessPoolExecutor(workers) as pool:
+        yield from pool.map(run_job, jobs, chunksize=chunk)
+
+
+#!batch
+# paths are taken relative to cwd, the compile server passes the client's
+def prepare(args, cwd=os.curdir):
+    cache = None
+    if not args.no_cache:
+        cache = CCache.CompileCache(
+            os.path.join(cwd, args.cache_dir), args.cache_size * 1024 * 1024
+        )
+    options = compile_options(args)
+    if args.batch:
+        jobs = collect_jobs(args.paths, args.out_dir, cache, options, cwd)
+    elif args.paths:
+        inPath = os.path.join(cwd, args.paths[0])
+        outPath = os.path.join(cwd, args.paths[1])
+        jobs = [(args.paths[0], inPath, outPath, cache, options)]
+    else:
+        jobs = []
+    return (cache, jobs)
+
+
+def compile_options(args):
+    return {
+        "timings": args.timings or args.timings_json is not None,
+        "codegen_jobs": args.codegen_jobs,
+        "binary": args.binary,
+        "parser": args.parser,
+        "stats": args.stats_json is not None,
+        "inlining": not args.no_inlining,
+        "inline_growth": args.inline_growth,
+        "hoisting": not args.no_hoisting,
+        "strength_reduction": not args.no_strength_reduction,
+        "propagation": not args.no_propagation,
+        "tracking": not args.no_tracking,
+        "dead_stores": not args.no_dead_stores,
+        "jump_threading": not args.no_jump_threading,
+        "peephole": not args.no_peephole,
+    }
+
+
+# prints the results in the order of the jobs, returns the number of
+# failed batch jobs
+def report(args, cache, results, cwd=os.curdir):
+    failed = 0
+    count = 0
+    timings = {}
+    stats = {}
+    for name, err, log, counters, times, counts in results:
+        sys.stdout.write(log)
+        if times is not None:
+            timings[name] = times
+        if counts is not None:
+            stats[name] = counts
+        if counters is not None:
+            cache.add_counters(counters)
+        count += 1
+        if not args.batch:
+            if err is not None:
+                print(err)
+        elif err is None:
+            if counters is not None and counters["hits"] > 0:
+                print(f"{name}: OK (cached)")
+            else:
+                print(f"{name}: OK")
+        else:
+            failed += 1
+            print(f"{name}: {err}")
+    if args.batch:
+        print(f"{count - failed} compiled, {failed} failed")
+    if args.timings:
+        for name, times in timings.items():
+            print_timings(name, times)
+    if args.timings_json is not None:
+        write_report(report_path(args.timings_json, cwd), timings)
+    if args.stats_json is not None:
+        write_report(report_path(args.stats_json, cwd), stats)
+    if cache is not None:
+        if cache.counters["misses"] > 0:
+            cache.evict()
+        cache.save_stats()
+        if args.cache_stats:
+            print_cache_stats(cache)
+    return failed
+
+
+def print_cache_stats(cache):
+    stats = cache.stats()
+    print(f"cache: {cache.path}")
+    for name in ("hits", "fragment_hits"):
+        miss = name.replace("hits", "misses")
+        total = stats[name] + stats[miss]
+        rate = 100 * stats[name] / total if total > 0 else 0
+        print(f"  {name + ':':16} {stats[name]} ({rate:.1f}%)")
+        print(f"  {miss + ':':16} {stats[miss]}")
+    print(f"  {'evictions:':16} {stats['evictions']}")
+    print(
+        f"  {'entries:':16} {stats['entries']} ({stats['size']} B of {cache.max_size} B)"
+    )
+
+
+def print_timings(name, timings):
+    print(f"timings: {name}")
+    total = 0
+    peak = 0
+    for phase, t in timings.items():
+        total += t["time"]
+        peak = max(peak, t["peak"])
+        print(
+            f"  {phase + ':':14}{1000 * t['time']:10.2f} ms"
+            f"{t['peak'] / 1024:12.1f} KiB peak  ({t['calls']}x)"
+        )
+    print(f"  {'total:':14}{1000 * total:10.2f} ms{peak / 1024:12.1f} KiB peak")
+
+
+# "-" is stdout, other paths are relative to cwd
+def report_path(path, cwd):
+    if path == "-":
+        return path
+    return os.path.join(cwd, path)
+
+
+# per-file timings (seconds, peaks in bytes) or statistics as JSON
+def write_report(path, files):
+    data = {"version": CCache.compiler_version(), "files": files}
+    if path == "-":
+        json.dump(data, sys.stdout, indent=1)
+        print()
+        return
+    with open(path, "w") as f:
+        json.dump(data, f, indent=1)
+        f.write("\n")
+
+
+def run(args):
+    if args.serve:
+        import CServer
+
+        CServer.serve(args)
+        return
+    (cache, jobs) = prepare(args)
+    if args.batch:
+        failed = report(args, cache, batch(jobs, args.jobs))
+    else:
+        results = [run_job(job) for job in jobs]
+        failed = report(args, cache, results)
+    if failed > 0:
+        sys.exit(1)
+
+
+def main():
+    argp = CCli.make_argparser("kompilator.py")
+    args = argp.parse_args()
+    CCli.check_args(argp, args)
+    run(args)
 
 
 if __name__ == "__main__":